@@ -0,0 +1,183 @@
+"""
+Persistent cache of Gemini analyses keyed by a perceptual image hash.
+
+Re-saved pictures rarely match byte for byte, so entries are keyed by a
+hash of the drawing's ink and looked up by Hamming distance. Drawings are
+thin strokes on a plain background, so the hash covers only the strokes'
+bounding box, scaled to a square, and the default distance accepts only
+near-exact matches: a re-encoded or recoloured copy of a drawing hits, a
+different equation does not. Entries are tied to the prompt version that
+produced them, expire after a TTL and are evicted least-recently-used
+beyond max_entries. Lookups scan the table itself, so the workers of a
+serve.py deployment share one cache.
+"""
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from database import connect
+
+# Grey levels a pixel must differ from the background by to count as ink,
+# and a hash cell's mean ink level to set its bit
+INK_LEVEL = 32
+# Bumped when perceptual_hash changes; older entries no longer match
+HASH_VERSION = 2
+
+
+def perceptual_hash(image, hash_size=32):
+    """
+    Hash of a drawing's strokes as an int of hash_size**2 bits. image is a
+    decoded BGR array, or encoded bytes when no decoded copy is at hand.
+
+    Pixels that differ from the background (the median grey level) are
+    ink. The ink's bounding box is centred in a square, so the hash does
+    not depend on where on the canvas or how large the drawing is, and
+    shrunk to hash_size x hash_size; each bit says whether a cell holds
+    ink. A blank canvas hashes to 0.
+    """
+    if isinstance(image, np.ndarray):
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        image = cv2.imdecode(np.frombuffer(image, np.uint8),
+                             cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Invalid image data")
+    background = np.full_like(image, int(np.median(image)))
+    ink = cv2.threshold(cv2.absdiff(image, background), INK_LEVEL, 255,
+                        cv2.THRESH_BINARY)[1]
+    points = cv2.findNonZero(ink)
+    if points is None:
+        return 0
+    x, y, width, height = cv2.boundingRect(points)
+    side = max(width, height)
+    square = np.zeros((side, side), np.uint8)
+    left, top = (side - width) // 2, (side - height) // 2
+    square[top:top + height, left:left + width] = \
+        ink[y:y + height, x:x + width]
+    small = cv2.resize(square, (hash_size, hash_size),
+                       interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(small >= INK_LEVEL).tobytes(), 'big')
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class AnalysisCache:
+    def __init__(self, db_path='drawings.db', prompt_version='', max_distance=4,
+                 max_entries=1000, ttl=30 * 24 * 3600):
+        # Entries of an older hash are dropped like those of an older prompt
+        self.prompt_version = f'{prompt_version}#hash{HASH_VERSION}'
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'near_hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self.conn = connect(db_path)
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phash TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            analysis TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+        ''')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_analysis_cache_lookup '
+            'ON analysis_cache (prompt_version, phash)')
+        self.conn.commit()
+        with self._lock:
+            self._expire_locked()
+
+    def get(self, phash):
+        """Return the live cached analysis closest to phash, or None."""
+        with self._lock:
+            now = time.time()
+            # The table is scanned rather than a copy kept in memory: every
+            # worker of a serve.py deployment reads and writes the same rows
+            self.conn.execute(
+                'DELETE FROM analysis_cache '
+                'WHERE prompt_version = ? AND created_at < ?',
+                (self.prompt_version, now - self.ttl))
+            best_id, best_distance = None, self.max_distance + 1
+            row = self.conn.execute(
+                'SELECT id FROM analysis_cache '
+                'WHERE prompt_version = ? AND phash = ?',
+                (self.prompt_version, format(phash, 'x'))).fetchone()
+            if row is not None:
+                best_id, best_distance = row[0], 0
+            elif self.max_distance:
+                cursor = self.conn.execute(
+                    'SELECT id, phash FROM analysis_cache '
+                    'WHERE prompt_version = ?', (self.prompt_version,))
+                for entry_id, entry_hash in cursor:
+                    distance = hamming_distance(phash, int(entry_hash, 16))
+                    if distance < best_distance:
+                        best_id, best_distance = entry_id, distance
+
+            row = None
+            if best_id is not None:
+                row = self.conn.execute(
+                    'SELECT analysis FROM analysis_cache WHERE id = ?',
+                    (best_id,)).fetchone()
+            if row is None:
+                # Ends the DELETE's transaction, which blocks other writers
+                self.conn.commit()
+                self.stats['misses'] += 1
+                return None
+
+            self.conn.execute(
+                'UPDATE analysis_cache SET last_used = ? WHERE id = ?',
+                (now, best_id))
+            self.conn.commit()
+            self.stats['hits'] += 1
+            if best_distance:
+                self.stats['near_hits'] += 1
+            return row[0]
+
+    def put(self, phash, analysis):
+        with self._lock:
+            now = time.time()
+            self.conn.execute(
+                'INSERT INTO analysis_cache '
+                '(phash, prompt_version, analysis, created_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (format(phash, 'x'), self.prompt_version, analysis, now, now))
+
+            overflow = self._count_locked() - self.max_entries
+            if overflow > 0:
+                cursor = self.conn.execute(
+                    'DELETE FROM analysis_cache WHERE id IN ('
+                    'SELECT id FROM analysis_cache WHERE prompt_version = ? '
+                    'ORDER BY last_used LIMIT ?)',
+                    (self.prompt_version, overflow))
+                self.stats['evictions'] += cursor.rowcount
+            self.conn.commit()
+
+    def _count_locked(self):
+        return self.conn.execute(
+            'SELECT COUNT(*) FROM analysis_cache WHERE prompt_version = ?',
+            (self.prompt_version,)).fetchone()[0]
+
+    def _expire_locked(self):
+        """Drop expired entries and those written for an older prompt."""
+        self.conn.execute(
+            'DELETE FROM analysis_cache WHERE created_at < ? OR prompt_version != ?',
+            (time.time() - self.ttl, self.prompt_version))
+        self.conn.commit()
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(
+                self.stats,
+                entries=self._count_locked(),
+                hit_rate=self.stats['hits'] / lookups if lookups else 0.0
+            )
+
+    def close(self):
+        self.conn.close()
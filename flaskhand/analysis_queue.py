@@ -0,0 +1,149 @@
+"""
+Background Gemini analysis of saved drawings.
+
+Saving a drawing only writes it to the database; the remote analysis runs
+later on a small worker pool. Each job retries with exponential backoff,
+its progress is persisted in drawings.analysis_status, and a callback is
+notified once the analysis lands or finally fails. With an AnalysisCache,
+near-duplicate drawings reuse a stored analysis instead of calling Gemini.
+Model calls go through an AnalysisScheduler, which rate-limits, coalesces
+and batches them; fresh saves are queued ahead of resumed jobs.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from analysis_cache import perceptual_hash
+from database import DrawingDatabase
+from metrics import STAGE_SECONDS
+
+# Scheduler priorities, lower first: a user waiting on a fresh save beats
+# jobs resumed after a restart
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class AnalysisQueue:
+    def __init__(self, analyzer, notify=None, max_workers=2, max_retries=3,
+                 backoff=2.0, db_factory=DrawingDatabase, cache=None):
+        """
+        analyzer is an AnalysisScheduler (anything with
+        analyze(image_bytes, priority=...));
+        notify(drawing_id, sid, payload) is called when a job finishes.
+        """
+        self.analyzer = analyzer
+        self.notify = notify
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.db_factory = db_factory
+        self.cache = cache
+        # Jobs submitted and not yet finished
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='analysis')
+
+    def submit(self, drawing_id, image_bytes, sid=None,
+               priority=PRIORITY_INTERACTIVE, image=None):
+        """
+        Queue analysis of encoded image_bytes. image, the same drawing
+        already decoded, spares the cache lookup a decode.
+        """
+        with self._pending_lock:
+            self.pending += 1
+        return self.executor.submit(
+            self._run, drawing_id, image_bytes, sid, priority, image)
+
+    def _run(self, drawing_id, image_bytes, sid, priority, image=None):
+        try:
+            return self._analyze(drawing_id, image_bytes, sid, priority, image)
+        finally:
+            with self._pending_lock:
+                self.pending -= 1
+
+    def _analyze(self, drawing_id, image_bytes, sid, priority, image):
+        self._update(drawing_id, 'running')
+
+        phash = None
+        if self.cache is not None:
+            try:
+                phash = perceptual_hash(
+                    image if image is not None else image_bytes)
+                analysis = self.cache.get(phash)
+            except Exception as e:
+                print(f"Analysis cache lookup failed: {e}")
+                analysis = None
+            if analysis is not None:
+                self._update(drawing_id, 'done', analysis)
+                self._notify(drawing_id, sid, {
+                    'status': 'done',
+                    'analysis': analysis,
+                    'cached': True
+                })
+                return analysis
+
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                analysis = self.analyzer.analyze(image_bytes, priority=priority)
+            except Exception as e:
+                error = e
+                print(f"Gemini analysis of drawing {drawing_id} failed "
+                      f"(attempt {attempt + 1}): {e}")
+                if attempt < self.max_retries:
+                    delay = self.backoff * 2 ** attempt
+                    time.sleep(delay + random.uniform(0, delay / 2))
+                continue
+
+            if phash is not None:
+                self.cache.put(phash, analysis)
+            self._update(drawing_id, 'done', analysis)
+            self._notify(drawing_id, sid, {
+                'status': 'done',
+                'analysis': analysis
+            })
+            return analysis
+
+        self._update(drawing_id, 'failed')
+        self._notify(drawing_id, sid, {
+            'status': 'failed',
+            'message': str(error)
+        })
+        return None
+
+    def _update(self, drawing_id, status, analysis=None):
+        db = self.db_factory()
+        try:
+            with STAGE_SECONDS.time(stage='db_write'):
+                db.update_analysis(drawing_id, status, analysis)
+        finally:
+            db.close()
+
+    def _notify(self, drawing_id, sid, payload):
+        if self.notify is None:
+            return
+        try:
+            self.notify(drawing_id, sid, dict(payload, drawing_id=drawing_id))
+        except Exception as e:
+            print(f"Error notifying analysis of drawing {drawing_id}: {e}")
+
+    def resume_pending(self):
+        """Re-enqueue jobs left pending or running by a previous process."""
+        db = self.db_factory()
+        try:
+            pending = [(drawing_id, db.get_image(digest))
+                       for drawing_id, digest in db.get_pending_analyses()]
+        finally:
+            db.close()
+
+        for drawing_id, image_bytes in pending:
+            if image_bytes is None:
+                self._update(drawing_id, 'failed')
+            else:
+                self.submit(drawing_id, image_bytes,
+                            priority=PRIORITY_BACKGROUND)
+        return len(pending)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
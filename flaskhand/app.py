@@ -1,16 +1,34 @@
 """
 Flask application for webcam-based drawing with hand tracking and image analysis.
 """
-from flask import Flask, render_template, request
-from flask_socketio import SocketIO
-import cv2
+from flask import (Flask, Response, jsonify, make_response, render_template,
+                   request, send_file)
+from flask_socketio import ConnectionRefusedError, SocketIO, join_room
 import os
-import numpy as np
-import base64
+import io
+import json
+import threading
+import time
+from datetime import datetime, timezone
 from engineio.payload import Payload
-from database import DrawingDatabase
-from gemini_helper import GeminiHelper
-from hand_tracker import HandTracker
+from database import DrawingDatabase, get_pool, image_hash, image_mime_type
+from analysis_cache import AnalysisCache
+from analysis_queue import AnalysisQueue
+from canvas_sync import CanvasSession
+from image_pipeline import (IMAGE_FORMATS, decode_image, encode_image,
+                            make_thumbnail)
+from gemini_helper import AnalysisScheduler, GeminiHelper, StubModel
+from inference import create_backend
+from message_queue import message_queue_options
+from metrics import (ANALYSIS_QUEUE_DEPTH, CONNECTED_SESSIONS,
+                     FRAME_QUEUE_DEPTH, FRAMES, GEMINI_QUEUE_DEPTH, REGISTRY,
+                     SAVES, STAGE_SECONDS, FrameTracer, observe_stages)
+from strokes import (CANVAS_HEIGHT, CANVAS_WIDTH, StrokeRecorder,
+                     encode_strokes, iter_strokes, parse_landmark_packet,
+                     render_strokes)
+from tracker_pool import PoolFullError
+from transport import (ClientLimits, FrameSequencer, TransportStats,
+                       decode_base64, decode_frame_payload, timed)
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -22,34 +40,264 @@ Payload.max_decode_packets = 500
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
 app.config['GEMINI_API_KEY'] = os.getenv('GEMINI_API')
-socketio = SocketIO(app, cors_allowed_origins="*", ping_timeout=600)
-
-# Initialize hand tracker
-hand_tracker = HandTracker()
+# 'gemini' calls the remote API, 'stub' answers locally (tests, load runs)
+app.config['GEMINI_BACKEND'] = os.getenv('GEMINI_BACKEND', 'gemini')
+# Analysis jobs mostly wait on the scheduler, which caps actual API traffic
+app.config['ANALYSIS_WORKERS'] = int(os.getenv('ANALYSIS_WORKERS', 8))
+app.config['ANALYSIS_MAX_RETRIES'] = int(os.getenv('ANALYSIS_MAX_RETRIES', 3))
+# Re-queue analyses left pending at startup; with several server processes
+# only one of them should
+app.config['ANALYSIS_RESUME'] = os.getenv('ANALYSIS_RESUME', '1') == '1'
+# Gemini request scheduling: token bucket sized to the API quota, up to
+# GEMINI_MAX_BATCH queued drawings per call, GEMINI_CONCURRENCY calls at once
+app.config['GEMINI_RPM'] = float(os.getenv('GEMINI_RPM', 15))
+app.config['GEMINI_BURST'] = int(os.getenv('GEMINI_BURST', 3))
+app.config['GEMINI_MAX_BATCH'] = int(os.getenv('GEMINI_MAX_BATCH', 4))
+app.config['GEMINI_CONCURRENCY'] = int(os.getenv('GEMINI_CONCURRENCY', 2))
+app.config['GEMINI_QUOTA_BACKOFF'] = float(
+    os.getenv('GEMINI_QUOTA_BACKOFF', 30))
+# Reuse analyses of drawings whose perceptual hashes differ by at most
+# ANALYSIS_CACHE_DISTANCE of 1024 bits, i.e. copies of the same drawing
+app.config['ANALYSIS_CACHE'] = os.getenv('ANALYSIS_CACHE', '1') == '1'
+app.config['ANALYSIS_CACHE_DISTANCE'] = int(
+    os.getenv('ANALYSIS_CACHE_DISTANCE', 4))
+app.config['ANALYSIS_CACHE_SIZE'] = int(os.getenv('ANALYSIS_CACHE_SIZE', 1000))
+app.config['ANALYSIS_CACHE_TTL'] = float(
+    os.getenv('ANALYSIS_CACHE_TTL', 30 * 24 * 3600))
+app.config['DRAWINGS_PAGE_SIZE'] = int(os.getenv('DRAWINGS_PAGE_SIZE', 24))
+# The drawings database, by default next to this file whatever the working
+# directory; every server process of a deployment must use the same file
+app.config['DATABASE_PATH'] = os.path.abspath(os.getenv(
+    'DATABASE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'drawings.db')))
+# Idle SQLite connections kept open for reuse by requests and jobs
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 8))
+# File (or '-' for stdout) receiving a JSON line of stage timings per frame
+app.config['METRICS_TRACE'] = os.getenv('METRICS_TRACE')
+app.config['THUMBNAIL_MAX_SIDE'] = int(os.getenv('THUMBNAIL_MAX_SIDE', 240))
+app.config['RENDER_MAX_SIDE'] = int(os.getenv('RENDER_MAX_SIDE', 4096))
+# Storage format of saved drawings: 'png' at PNG_COMPRESSION (0-9) or
+# lossless 'webp'
+app.config['IMAGE_FORMAT'] = os.getenv('IMAGE_FORMAT', 'png')
+app.config['PNG_COMPRESSION'] = int(os.getenv('PNG_COMPRESSION', 1))
+if app.config['IMAGE_FORMAT'] not in IMAGE_FORMATS:
+    raise ValueError(f"IMAGE_FORMAT must be one of {', '.join(IMAGE_FORMATS)}")
+app.config['TRACKER_POOL_SIZE'] = int(os.getenv('TRACKER_POOL_SIZE', 32))
+app.config['TRACKER_IDLE_TIMEOUT'] = float(
+    os.getenv('TRACKER_IDLE_TIMEOUT', 60))
+# Inference backend: 'inline', 'thread' or 'process'
+app.config['INFERENCE_BACKEND'] = os.getenv('INFERENCE_BACKEND', 'thread')
+app.config['INFERENCE_WORKERS'] = int(os.getenv('INFERENCE_WORKERS', 0)) or None
+app.config['FRAME_QUEUE_SIZE'] = int(os.getenv('FRAME_QUEUE_SIZE', 2))
+# How process backend workers start: 'spawn' imports everything per worker,
+# 'forkserver' forks them from a process with the tracker stack preloaded
+app.config['INFERENCE_START_METHOD'] = os.getenv(
+    'INFERENCE_START_METHOD', 'spawn')
+# Run one inference on a blank frame before accepting connections
+app.config['INFERENCE_WARMUP'] = os.getenv('INFERENCE_WARMUP', '1') == '1'
+# Track a cropped region around the last hand instead of the full frame.
+# Off by default: MediaPipe already tracks its own region between frames,
+# so measure with benchmarks/bench_roi.py on real footage before enabling
+app.config['TRACKER_ROI'] = os.getenv('TRACKER_ROI', '0') == '1'
+# MediaPipe landmark model (0 = lite, 1 = full) and confidence thresholds
+app.config['TRACKER_MODEL_COMPLEXITY'] = int(
+    os.getenv('TRACKER_MODEL_COMPLEXITY', 1))
+app.config['TRACKER_MIN_DETECTION_CONFIDENCE'] = float(
+    os.getenv('TRACKER_MIN_DETECTION_CONFIDENCE', 0.7))
+app.config['TRACKER_MIN_TRACKING_CONFIDENCE'] = float(
+    os.getenv('TRACKER_MIN_TRACKING_CONFIDENCE', 0.7))
+# Default pointer smoothing and inference rate cap (Hz, 0 = every frame);
+# clients can change both for their session with 'tracking_options'
+app.config['TRACKER_SMOOTHING'] = os.getenv('TRACKER_SMOOTHING', '0') == '1'
+app.config['TRACKER_INFERENCE_HZ'] = float(
+    os.getenv('TRACKER_INFERENCE_HZ', 0)) or None
+# Message queue relaying emits between server processes: redis://, amqp://
+# and the other Flask-SocketIO backends, or local:// for an in-process
+# stand-in in tests; unset when running a single process
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+app.config['SOCKETIO_CHANNEL'] = os.getenv('SOCKETIO_CHANNEL', 'flaskhand')
+# Sessions served at once (0 = unlimited); further connections are refused
+app.config['MAX_CONNECTIONS'] = int(os.getenv('MAX_CONNECTIONS', 0))
+# Per-session limits, 0 = unlimited: frames per second in bursts of up to
+# CLIENT_FRAME_BURST, answered as dropped beyond that, and saves per minute
+app.config['CLIENT_FRAME_RATE'] = float(os.getenv('CLIENT_FRAME_RATE', 0))
+app.config['CLIENT_FRAME_BURST'] = int(os.getenv('CLIENT_FRAME_BURST', 5))
+app.config['CLIENT_SAVE_RATE'] = float(os.getenv('CLIENT_SAVE_RATE', 0))
+# Threads the async server (asgi_app.py) runs decoding, inference and
+# database work on, so its event loop never blocks
+app.config['ASYNC_EXECUTOR_WORKERS'] = int(
+    os.getenv('ASYNC_EXECUTOR_WORKERS', 32))
+socketio = SocketIO(
+    app, cors_allowed_origins="*", ping_timeout=600,
+    **message_queue_options(app.config['SOCKETIO_MESSAGE_QUEUE'],
+                            app.config['SOCKETIO_CHANNEL']))
+
+# Created on first use so that spawned worker processes importing this
+# module do not start a backend of their own
+inference_backend = None
+inference_backend_lock = threading.Lock()
+
+
+def get_inference_backend():
+    global inference_backend
+    with inference_backend_lock:
+        if inference_backend is None:
+            inference_backend = create_backend(app.config)
+        return inference_backend
+
+
+def open_database():
+    """A DrawingDatabase on the configured DATABASE_PATH."""
+    return DrawingDatabase(app.config['DATABASE_PATH'])
+
+
+def create_gemini_helper(config):
+    if config.get('GEMINI_BACKEND') == 'stub':
+        return GeminiHelper(model=StubModel())
+    return GeminiHelper(config.get('GEMINI_API_KEY'))
+
+
+def notify_analysis(drawing_id, sid, payload):
+    """Push a finished analysis to the saving client and any watchers."""
+    if sid:
+        socketio.emit('drawing_analyzed', payload, room=sid)
+    socketio.emit('drawing_analyzed', payload, room=f'drawing-{drawing_id}')
+
+
+# The Gemini client, its scheduler, the analysis cache and queue. Set up by
+# init_services() rather than at import: process backend workers started
+# with spawn or forkserver re-import the main module (app.py itself under
+# `python app.py`) and must not open the database or start analysis threads
+gemini = None
+gemini_scheduler = None
+analysis_cache = None
+analysis_queue = None
+services_lock = threading.Lock()
+
+
+def init_services():
+    """
+    Set up the database schema and the analysis services, once per server
+    process. run_server and asgi_app call it before serving; other servers
+    must call it before the first request.
+    """
+    global gemini, gemini_scheduler, analysis_cache, analysis_queue
+    with services_lock:
+        if gemini is not None:
+            return
+        # Set up the schema once; open_database() then borrows pooled
+        # connections
+        get_pool(app.config['DATABASE_PATH'],
+                 max_idle=app.config['DB_POOL_SIZE'])
+
+        # One shared Gemini client behind a rate-limited scheduler; analyses
+        # run in the background after saving
+        helper = create_gemini_helper(app.config)
+        if helper.enabled:
+            gemini_scheduler = AnalysisScheduler(
+                helper,
+                requests_per_minute=app.config['GEMINI_RPM'],
+                burst=app.config['GEMINI_BURST'],
+                max_batch=app.config['GEMINI_MAX_BATCH'],
+                concurrency=app.config['GEMINI_CONCURRENCY'],
+                quota_backoff=app.config['GEMINI_QUOTA_BACKOFF']
+            )
+            analysis_cache = AnalysisCache(
+                db_path=app.config['DATABASE_PATH'],
+                prompt_version=helper.prompt_version,
+                max_distance=app.config['ANALYSIS_CACHE_DISTANCE'],
+                max_entries=app.config['ANALYSIS_CACHE_SIZE'],
+                ttl=app.config['ANALYSIS_CACHE_TTL']
+            ) if app.config['ANALYSIS_CACHE'] else None
+            analysis_queue = AnalysisQueue(
+                gemini_scheduler,
+                notify=notify_analysis,
+                max_workers=app.config['ANALYSIS_WORKERS'],
+                max_retries=app.config['ANALYSIS_MAX_RETRIES'],
+                db_factory=open_database,
+                cache=analysis_cache
+            )
+        gemini = helper
+
+
+# Per-transport frame size and decode time counters
+transport_stats = TransportStats()
+
+# Newest frame id answered per session, to drop out-of-order results
+frame_sequencer = FrameSequencer()
+
+# Connection cap and per-session rate limits
+client_limits = ClientLimits(
+    max_connections=app.config['MAX_CONNECTIONS'],
+    rates={
+        'process_frame': (app.config['CLIENT_FRAME_RATE'],
+                          app.config['CLIENT_FRAME_BURST']),
+        'save_drawing': (app.config['CLIENT_SAVE_RATE'] / 60, 1),
+    })
+
+# Per-frame stage timings as JSON lines, when METRICS_TRACE names a file
+frame_tracer = FrameTracer(app.config['METRICS_TRACE']) \
+    if app.config['METRICS_TRACE'] else None
+
+# Queue depths are read when /metrics is scraped
+FRAME_QUEUE_DEPTH.set_function(
+    lambda: inference_backend.queue_depth() if inference_backend else 0)
+ANALYSIS_QUEUE_DEPTH.set_function(
+    lambda: analysis_queue.pending if analysis_queue else 0)
+GEMINI_QUEUE_DEPTH.set_function(
+    lambda: gemini_scheduler.snapshot()['queued'] if gemini_scheduler else 0)
+
+# Strokes recorded server-side for each session, keyed by request.sid
+stroke_recorders = {}
+
+
+def get_stroke_recorder(sid):
+    return stroke_recorders.setdefault(sid, StrokeRecorder())
+
+
+# Each session's canvas, built from the patches its client streams
+canvas_sessions = {}
+
+
+def get_canvas_session(sid):
+    return canvas_sessions.setdefault(sid, CanvasSession())
+
+
+def record_hand_data(sid, hand_data, timestamp):
+    """Feed a process_frame result, in frame pixels, to sid's recorder."""
+    if hand_data.get('has_hand') and hand_data.get('frame_size'):
+        width, height = hand_data['frame_size']
+
+        def to_canvas(pos):
+            # Landmarks of a hand partly out of frame can lie outside it
+            return (
+                max(0, min(int(pos[0] * CANVAS_WIDTH / width),
+                           CANVAS_WIDTH - 1)),
+                max(0, min(int(pos[1] * CANVAS_HEIGHT / height),
+                           CANVAS_HEIGHT - 1)))
+
+        thumb_pos = to_canvas(hand_data['thumb_pos'])
+        index_pos = to_canvas(hand_data['index_pos'])
+    else:
+        thumb_pos = index_pos = None
+    get_stroke_recorder(sid).update(
+        int(timestamp * 1000), thumb_pos, index_pos, source='frames')
 
 
 def process_base64_image(base64_string, flip_horizontal=True):
     """Process and optionally flip a base64 encoded image."""
-    # Remove data URL prefix if present
-    if ',' in base64_string:
-        base64_string = base64_string.split(',')[1]
-
-    # Decode base64 to bytes
-    image_bytes = base64.b64decode(base64_string)
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    return decode_image(decode_base64(base64_string), flip_horizontal)
 
-    # Flip the image horizontally if needed
-    if flip_horizontal and image is not None:
-        image = cv2.flip(image, 1)
 
-    return image
+def encode_image_to_png(image):
+    """Convert an OpenCV image to PNG bytes."""
+    return encode_image(image, 'png')[0]
 
 
-def encode_image_to_base64(image):
-    """Convert an OpenCV image to base64 string."""
-    _, buffer = cv2.imencode('.png', image)
-    return base64.b64encode(buffer).decode('utf-8')
+def encode_drawing(image):
+    """Encode a drawing for storage in the configured format."""
+    return encode_image(image, app.config['IMAGE_FORMAT'],
+                        app.config['PNG_COMPRESSION'])[0]
 
 
 @app.route('/')
@@ -59,19 +307,220 @@ def index():
 
 @app.route('/drawings')
 def drawings_list():
-    db = DrawingDatabase()
+    before = request.args.get('before', type=int)
+    db = open_database()
+    try:
+        drawings, next_before = db.list_drawings(
+            app.config['DRAWINGS_PAGE_SIZE'], before)
+        return render_template('drawings.html', drawings=drawings,
+                               next_before=next_before)
+    finally:
+        db.close()
+
+
+def parse_timestamp(timestamp):
+    """Drawing timestamps are stored as naive local ISO strings."""
+    try:
+        return datetime.fromisoformat(timestamp).astimezone(timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+# Stored images are cached for a year
+IMAGE_MAX_AGE = 31536000
+
+
+def send_image(etag, last_modified, load):
+    """
+    Send stored image bytes with HTTP caching.
+
+    Stored images never change, so the content hash is a strong ETag and
+    responses are cacheable forever. load() returns (bytes, mime_type) and is
+    only called when the client doesn't already have the image; Range
+    requests are answered by send_file.
+    """
+    if etag and request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+    else:
+        loaded = load()
+        if loaded is None:
+            return "Image not found", 404
+        data, mime_type = loaded
+        response = send_file(
+            io.BytesIO(data),
+            mimetype=mime_type,
+            etag=etag or image_hash(data),
+            last_modified=last_modified,
+            conditional=True,
+            # Without max_age send_file marks the response no-cache
+            max_age=IMAGE_MAX_AGE
+        )
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+def load_legacy_image(db, drawing_id):
+    """Image bytes of a drawing saved before content-addressed storage."""
+    drawing = db.get_drawing(drawing_id)
+    if drawing is None or not drawing['image_data']:
+        return None
+    return decode_base64(drawing['image_data'])
+
+
+@app.route('/drawings/<int:drawing_id>/image')
+def drawing_image(drawing_id):
+    db = open_database()
+    try:
+        info = db.get_image_info(drawing_id)
+        if info is None:
+            return "Drawing not found", 404
+        digest = info['image_hash']
+
+        def load():
+            data = db.get_image(digest) if digest else \
+                load_legacy_image(db, drawing_id)
+            return (data, image_mime_type(data)) if data else None
+
+        return send_image(digest, parse_timestamp(info['timestamp']), load)
+    finally:
+        db.close()
+
+
+@app.route('/drawings/<int:drawing_id>/thumbnail')
+def drawing_thumbnail(drawing_id):
+    db = open_database()
+    try:
+        info = db.get_image_info(drawing_id)
+        if info is None:
+            return "Drawing not found", 404
+        digest = info['image_hash']
+
+        def load():
+            thumbnail = db.get_thumbnail(digest) if digest else None
+            if thumbnail is None:
+                # Drawings saved before thumbnails existed get one on first view
+                data = db.get_image(digest) if digest else \
+                    load_legacy_image(db, drawing_id)
+                if not data:
+                    return None
+                image = decode_image(data)
+                thumbnail = make_thumbnail(
+                    image, app.config['THUMBNAIL_MAX_SIDE'])
+                if digest:
+                    db.store_thumbnail(digest, *thumbnail)
+            return thumbnail
+
+        etag = f'thumb-{digest}' if digest else None
+        return send_image(etag, parse_timestamp(info['timestamp']), load)
+    finally:
+        db.close()
+
+
+def load_stroke_data(drawing_id):
+    db = open_database()
     try:
-        drawings = db.get_all_drawings()
-        return render_template('drawings.html', drawings=drawings)
+        return db.get_image_info(drawing_id), db.get_stroke_data(drawing_id)
     finally:
         db.close()
 
 
+@app.route('/drawings/<int:drawing_id>/strokes')
+def drawing_strokes(drawing_id):
+    """The drawing's strokes in the binary format of strokes.py."""
+    info, stroke_data = load_stroke_data(drawing_id)
+    if info is None:
+        return "Drawing not found", 404
+    if stroke_data is None:
+        return "Drawing has no strokes", 404
+    return send_image(f'strokes-{image_hash(stroke_data)}',
+                      parse_timestamp(info['timestamp']),
+                      lambda: (stroke_data, 'application/octet-stream'))
+
+
+@app.route('/drawings/<int:drawing_id>/render')
+def drawing_render(drawing_id):
+    """Rasterize the strokes as a PNG of ?width and/or ?height pixels."""
+    info, stroke_data = load_stroke_data(drawing_id)
+    if info is None:
+        return "Drawing not found", 404
+    if stroke_data is None:
+        return "Drawing has no strokes", 404
+
+    width = request.args.get('width', type=int)
+    height = request.args.get('height', type=int)
+    if width and not height:
+        height = round(width * CANVAS_HEIGHT / CANVAS_WIDTH)
+    elif height and not width:
+        width = round(height * CANVAS_WIDTH / CANVAS_HEIGHT)
+    width, height = width or CANVAS_WIDTH, height or CANVAS_HEIGHT
+    max_side = app.config['RENDER_MAX_SIDE']
+    if not (0 < width <= max_side and 0 < height <= max_side):
+        return f"Size must be between 1 and {max_side} pixels", 400
+
+    def load():
+        image = render_strokes(stroke_data, width, height, flip_horizontal=True)
+        return encode_image_to_png(image), 'image/png'
+
+    etag = f'render-{image_hash(stroke_data)}-{width}x{height}'
+    return send_image(etag, parse_timestamp(info['timestamp']), load)
+
+
+@app.route('/drawings/<int:drawing_id>/replay')
+def drawing_replay(drawing_id):
+    """
+    Stream the strokes as newline-delimited JSON, one stroke per line, in
+    canvas coordinates (before the mirroring applied to saved images).
+    """
+    info, stroke_data = load_stroke_data(drawing_id)
+    if info is None:
+        return "Drawing not found", 404
+    if stroke_data is None:
+        return "Drawing has no strokes", 404
+
+    def generate():
+        for stroke in iter_strokes(stroke_data):
+            yield json.dumps(stroke, separators=(',', ':')) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/metrics')
+def metrics_view():
+    response = make_response(REGISTRY.render())
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+@app.route('/stats/transport')
+def transport_stats_view():
+    return jsonify(transport_stats.snapshot())
+
+
+@app.route('/stats/analysis_cache')
+def analysis_cache_stats_view():
+    if analysis_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(analysis_cache.snapshot(), enabled=True))
+
+
+@app.route('/stats/gemini')
+def gemini_stats_view():
+    if gemini_scheduler is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(gemini_scheduler.snapshot(), enabled=True))
+
+
 @app.route('/drawings/<int:drawing_id>')
 def drawing_detail(drawing_id):
-    db = DrawingDatabase()
+    db = open_database()
     try:
-        drawing = db.get_drawing(drawing_id)
+        drawing = db.get_drawing(drawing_id, include_image=False)
         if drawing is None:
             return "Drawing not found", 404
         return render_template('drawing_detail.html', drawing=drawing)
@@ -79,87 +528,377 @@ def drawing_detail(drawing_id):
         db.close()
 
 
+def frame_id_of(data):
+    frame_id = data.get('frame_id') if isinstance(data, dict) else None
+    return frame_id if isinstance(frame_id, int) else None
+
+
+def decode_frame(data, timings):
+    """
+    Encoded image bytes of a process_frame event, unflipped, with its
+    transport and wire size; the decode time goes into timings.
+    """
+    payload = data['frame']
+    (frame_bytes, transport), payload_decode = timed(
+        decode_frame_payload, payload)
+    timings[f'{transport}_decode'] = payload_decode
+    return frame_bytes, transport, len(payload)
+
+
+def accept_frame_result(sid, frame_id, received, result, transport,
+                        wire_bytes, timings):
+    """The (reply, outcome) for a frame the inference backend returned."""
+    # A newer frame from this client superseded this one
+    if result is None:
+        return {'dropped': True}, 'dropped'
+
+    hand_data, stage_timings = result
+    timings.update(stage_timings)
+    transport_stats.record(transport, wire_bytes,
+                           timings[f'{transport}_decode'],
+                           stage_timings.get('imdecode', 0.0))
+
+    # A newer frame was already answered while this one was processed
+    if not frame_sequencer.accept(sid, frame_id):
+        return {'dropped': True, 'stale': True}, 'stale'
+
+    # Record strokes from the same positions the client draws with
+    record_hand_data(sid, hand_data, received)
+    return ({'hand_data': hand_data},
+            'predicted' if hand_data.get('predicted') else 'processed')
+
+
+def frame_error(error):
+    """The (reply, outcome) for a frame that raised error."""
+    if isinstance(error, PoolFullError):
+        print(f"Rejected frame: {error}")
+        return {'error': 'Server is busy, too many active sessions'}, 'rejected'
+    print(f"Error processing frame: {error}")
+    return {'error': str(error)}, 'error'
+
+
+def rate_limited_frame():
+    """The (reply, outcome) for a frame over the client's rate limit."""
+    return {'dropped': True, 'rate_limited': True}, 'rate_limited'
+
+
+def stamp_frame_reply(payload, frame_id, received, timings):
+    # Echo the frame id and time spent on the server for client pacing
+    timings['frame_total'] = time.perf_counter() - received
+    payload['frame_id'] = frame_id
+    payload['server_ms'] = round(timings['frame_total'] * 1000, 2)
+
+
+def record_frame(sid, frame_id, timings, outcome):
+    FRAMES.inc(result=outcome)
+    observe_stages(timings)
+    if frame_tracer is not None:
+        frame_tracer.trace(sid, frame_id, timings, result=outcome)
+
+
 @socketio.on('process_frame')
 def handle_frame(data):
+    sid = request.sid
+    received = time.perf_counter()
+    frame_id = frame_id_of(data)
+    timings = {}
+    if not client_limits.allow(sid, 'process_frame'):
+        payload, outcome = rate_limited_frame()
+    else:
+        try:
+            # Get encoded frame data - the backend decodes it, unflipped
+            frame_bytes, transport, wire_bytes = decode_frame(data, timings)
+
+            # Process with this client's hand tracker
+            result, timings['backend'] = timed(
+                get_inference_backend().process, sid, frame_bytes)
+            payload, outcome = accept_frame_result(
+                sid, frame_id, received, result, transport, wire_bytes,
+                timings)
+        except Exception as e:
+            payload, outcome = frame_error(e)
+
+    # Send processed data back to client
+    stamp_frame_reply(payload, frame_id, received, timings)
+    emit_start = time.perf_counter()
+    socketio.emit('frame_processed', payload, room=sid)
+    timings['emit'] = time.perf_counter() - emit_start
+    record_frame(sid, frame_id, timings, outcome)
+
+
+def record_landmarks(sid, packet):
+    """Feed a landmark packet to sid's recorder; an error reply or None."""
     try:
-        # Get frame data - don't flip for live preview
-        frame = process_base64_image(data['frame'], flip_horizontal=False)
-        if frame is None:
-            raise ValueError("Invalid frame data")
+        timestamp, thumb_pos, index_pos = parse_landmark_packet(packet)
+        get_stroke_recorder(sid).update(
+            timestamp, thumb_pos, index_pos, source='landmarks')
+    except ValueError as ve:
+        print(f"Rejected landmark packet: {ve}")
+        return {'message': str(ve)}
+    return None
 
-        # Process with hand tracker
-        hand_data = hand_tracker.process_and_encode_frame(frame)
 
-        # Send processed data back to client
-        socketio.emit('frame_processed', {
-            'hand_data': hand_data
-        }, room=request.sid)
+@socketio.on('landmarks')
+def handle_landmarks(packet):
+    """Ingest a landmark packet from a client running the hand model."""
+    rejected = record_landmarks(request.sid, packet)
+    if rejected is not None:
+        socketio.emit('landmarks_rejected', rejected, room=request.sid)
 
-    except Exception as e:
-        print(f"Error processing frame: {e}")
-        socketio.emit('frame_processed', {
-            'error': str(e)
-        }, room=request.sid)
 
+def apply_tracking_options(sid, data):
+    try:
+        get_stroke_recorder(sid).set_options(
+            min_distance=data.get('min_distance'),
+            color=data.get('color'),
+            thickness=data.get('thickness')
+        )
+
+        tracker_options = {}
+        if 'smoothing' in data:
+            tracker_options['smoothing'] = bool(data['smoothing'])
+        if 'inference_hz' in data:
+            inference_hz = float(data['inference_hz'])
+            if not 0 <= inference_hz <= 60:
+                raise ValueError("inference_hz must be between 0 and 60")
+            tracker_options['inference_hz'] = inference_hz
+        if tracker_options:
+            # Kept by the backend until the session's first frame builds
+            # its tracker
+            get_inference_backend().configure(sid, **tracker_options)
+    except (AttributeError, TypeError, ValueError) as e:
+        print(f"Invalid tracking options: {e}")
+
+
+@socketio.on('tracking_options')
+def handle_tracking_options(data):
+    apply_tracking_options(request.sid, data)
+
+
+def clear_session(sid, data=None):
+    get_stroke_recorder(sid).clear()
+    seq = data.get('seq') if isinstance(data, dict) else None
+    get_canvas_session(sid).clear(seq if isinstance(seq, int) else None)
+
+
+@socketio.on('clear_canvas')
+def handle_clear_canvas(data=None):
+    clear_session(request.sid, data)
+
+
+def apply_canvas_patch(sid, data):
+    """Paste a dirty-rectangle patch into sid's canvas; returns the ack."""
+    seq = data.get('seq') if isinstance(data, dict) else None
+    try:
+        if not isinstance(data, dict):
+            raise ValueError("Invalid canvas patch")
+        applied = get_canvas_session(sid).apply_patch(
+            seq, data.get('x'), data.get('y'), data.get('patch'))
+        return {'seq': seq, 'applied': applied}
+    except ValueError as ve:
+        print(f"Rejected canvas patch: {ve}")
+        return {'seq': seq, 'error': str(ve)}
 
-@socketio.on('save_drawing')
-def handle_save_drawing(data):
+
+@socketio.on('canvas_patch')
+def handle_canvas_patch(data):
+    socketio.emit('canvas_patch_ack', apply_canvas_patch(request.sid, data),
+                  room=request.sid)
+
+
+def open_session(sid):
+    """Admit a new connection, or refuse it when the server is full."""
+    if not client_limits.connect(sid):
+        print(f"Refused connection: {app.config['MAX_CONNECTIONS']} "
+              f"sessions already open")
+        raise ConnectionRefusedError('Server is full, try again later')
+    CONNECTED_SESSIONS.inc()
+
+
+def close_session(sid):
+    """Drop everything kept for a disconnected session."""
+    CONNECTED_SESSIONS.dec()
+    client_limits.disconnect(sid)
+    if inference_backend is not None:
+        inference_backend.release(sid)
+    stroke_recorders.pop(sid, None)
+    canvas_sessions.pop(sid, None)
+    frame_sequencer.release(sid)
+
+
+@socketio.on('connect')
+def handle_connect():
+    open_session(request.sid)
+
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    close_session(request.sid)
+
+
+def watch_id_of(data):
     try:
-        if not data or 'image' not in data:
-            raise ValueError("No image data received")
+        return int(data['drawing_id'])
+    except (KeyError, TypeError, ValueError):
+        return None
 
-        image_data = data.get('image')
-        if not image_data:
+
+def finished_analysis(drawing_id):
+    """The drawing_analyzed payload if the analysis already finished."""
+    db = open_database()
+    try:
+        drawing = db.get_drawing(drawing_id, include_image=False)
+    finally:
+        db.close()
+    if drawing and drawing['analysis_status'] in ('done', 'failed'):
+        return {
+            'drawing_id': drawing_id,
+            'status': drawing['analysis_status'],
+            'analysis': drawing['analysis']
+        }
+    return None
+
+
+@socketio.on('watch_drawing')
+def handle_watch_drawing(data):
+    """Subscribe to drawing_analyzed events for a drawing's detail page."""
+    drawing_id = watch_id_of(data)
+    if drawing_id is None:
+        return
+    join_room(f'drawing-{drawing_id}')
+
+    # The analysis may have landed before the page subscribed
+    payload = finished_analysis(drawing_id)
+    if payload is not None:
+        socketio.emit('drawing_analyzed', payload, room=request.sid)
+
+
+def save_drawing(sid, data):
+    """
+    Store sid's drawing from a save_drawing event. Returns the
+    drawing_saved reply and, if an analysis should follow, the
+    (drawing_id, image_bytes, image) to pass to submit_analysis once the
+    reply is sent.
+    """
+    received = time.perf_counter()
+    if not client_limits.allow(sid, 'save_drawing'):
+        SAVES.inc(result='rate_limited')
+        return {
+            'status': 'error',
+            'message': 'Saving too often, try again shortly'
+        }, None
+    try:
+        recorder = get_stroke_recorder(sid)
+        strokes = recorder.export()
+        try:
+            stroke_data = encode_strokes(strokes) if strokes else None
+        except (KeyError, TypeError, ValueError) as e:
+            # The strokes are a bonus; the image alone is still saved
+            print(f"Dropping strokes that could not be encoded: {e}")
+            stroke_data = None
+
+        image = None
+        source_start = time.perf_counter()
+        if data and data.get('image'):
+            # Process the image and flip it horizontally
+            image = process_base64_image(data['image'], flip_horizontal=True)
+            if image is None:
+                raise ValueError("Failed to process image")
+        elif data and 'commit' in data:
+            # The canvas was streamed as patches; commit names its state
+            image = get_canvas_session(sid).snapshot(
+                data['commit'], flip_horizontal=True)
+        elif data and 'image' in data:
             raise ValueError("Empty image data received")
 
-        # Process the image and flip it horizontally
-        image = process_base64_image(image_data, flip_horizontal=True)
+        if image is None and stroke_data is not None:
+            # Render the recorded strokes, mirrored like the client canvas
+            image = render_strokes(stroke_data, flip_horizontal=True)
         if image is None:
-            raise ValueError("Failed to process image")
+            raise ValueError("Nothing to save: the canvas is empty")
+        STAGE_SECONDS.observe(time.perf_counter() - source_start,
+                              stage='save_image')
 
-        # Convert back to base64
-        image_data = encode_image_to_base64(image)
+        # Encode once; the database and Gemini share the encoded bytes and
+        # the cache hashes the decoded image
+        with STAGE_SECONDS.time(stage='encode'):
+            image_bytes = encode_drawing(image)
+        with STAGE_SECONDS.time(stage='thumbnail'):
+            thumbnail = make_thumbnail(image, app.config['THUMBNAIL_MAX_SIDE'])
 
-        # Initialize components
-        db = DrawingDatabase()
-        gemini = GeminiHelper(app.config.get('GEMINI_API_KEY'))
+        # Analysis runs after the save if a Gemini backend is configured
+        analysis_status = 'pending' if analysis_queue is not None else None
 
+        db = open_database()
         try:
-            # Get analysis if API key is configured
-            analysis = None
-            if app.config.get('GEMINI_API_KEY'):
-                try:
-                    analysis = gemini.analyze_image(image_data)
-                except Exception as e:
-                    print(f"Gemini analysis failed: {str(e)}")
-
-            # Save to database
-            drawing_id = db.save_drawing(image_data, analysis)
-
-            # Return success response
-            socketio.emit('drawing_saved', {
-                'status': 'success',
-                'drawing_id': drawing_id,
-                'image_data': image_data,
-                'analysis': analysis
-            }, room=request.sid)
-
+            # Save to database along with any server-recorded strokes
+            with STAGE_SECONDS.time(stage='db_write'):
+                drawing_id = db.save_drawing(
+                    image_bytes, None, stroke_data, thumbnail=thumbnail,
+                    analysis_status=analysis_status)
+            recorder.clear()
         finally:
             db.close()
 
+        SAVES.inc(result='saved')
+        STAGE_SECONDS.observe(time.perf_counter() - received,
+                              stage='save_total')
+        analysis = (drawing_id, image_bytes, image) \
+            if analysis_queue is not None else None
+        return {
+            'status': 'success',
+            'drawing_id': drawing_id,
+            'analysis': None,
+            'analysis_status': analysis_status
+        }, analysis
+
     except ValueError as ve:
+        SAVES.inc(result='invalid')
         print(f"Validation error: {str(ve)}")
-        socketio.emit('drawing_saved', {
+        return {
             'status': 'error',
             'message': str(ve)
-        }, room=request.sid)
+        }, None
     except Exception as e:
+        SAVES.inc(result='error')
         print(f"Error handling drawing data: {str(e)}")
-        socketio.emit('drawing_saved', {
+        return {
             'status': 'error',
             'message': 'Failed to process drawing'
-        }, room=request.sid)
+        }, None
+
+
+def submit_analysis(sid, analysis):
+    drawing_id, image_bytes, image = analysis
+    analysis_queue.submit(drawing_id, image_bytes, sid, image=image)
+
+
+@socketio.on('save_drawing')
+def handle_save_drawing(data):
+    response, analysis = save_drawing(request.sid, data)
+    socketio.emit('drawing_saved', response, room=request.sid)
+    if analysis is not None:
+        submit_analysis(request.sid, analysis)
+
+
+def run_server(host='127.0.0.1', port=5001, debug=False):
+    """
+    Serve the app from this process with Werkzeug, a thread per connection;
+    serve.py runs one per worker. asgi_app.run_server is the async server.
+    """
+    # With debug on, only the reloader's child process serves requests
+    serving = not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    if serving:
+        init_services()
+    if (serving and analysis_queue is not None
+            and app.config['ANALYSIS_RESUME']):
+        analysis_queue.resume_pending()
+    if serving and app.config['INFERENCE_WARMUP']:
+        seconds = get_inference_backend().warm_up()
+        print(f"Inference backend warmed up in {seconds:.2f}s")
+    socketio.run(app, host=host, port=port, debug=debug,
+                 allow_unsafe_werkzeug=True)
 
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True, allow_unsafe_werkzeug=True, port=5001)
+    run_server(debug=True)
@@ -0,0 +1,211 @@
+"""
+Serve the app from an asyncio event loop with uvicorn instead of Werkzeug.
+
+    pip install "uvicorn[standard]" a2wsgi
+    python asgi_app.py --port 5001
+    uvicorn asgi_app:application --port 5001
+
+app.run_server() runs Werkzeug, which holds a thread for every connection.
+Here a single event loop holds all Socket.IO sessions and the handlers only
+await. Payload decoding, handing frames to the inference backend, canvas
+patches, saves and database reads run on a pool of ASYNC_EXECUTOR_WORKERS
+threads. The thread and process backends' results are awaited as futures,
+so a frame holds no thread while it waits for its tracker; the inline
+backend infers on the executor thread. Gemini analyses run on the analysis
+queue's workers as before, and their results are emitted from the loop.
+
+The handlers share app.py's per-session state and logic, including the
+MAX_CONNECTIONS, CLIENT_FRAME_RATE and CLIENT_SAVE_RATE limits. HTTP routes
+run on the Flask app through a2wsgi. SOCKETIO_MESSAGE_QUEUE may be a
+redis:// or amqp:// url, e.g. for serve.py --server asgi.
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import socketio
+import uvicorn
+from a2wsgi import WSGIMiddleware
+
+import app as app_module
+from message_queue import async_client_manager
+
+config = app_module.app.config
+
+sio = socketio.AsyncServer(
+    async_mode='asgi', cors_allowed_origins='*', ping_timeout=600,
+    client_manager=async_client_manager(config['SOCKETIO_MESSAGE_QUEUE'],
+                                        config['SOCKETIO_CHANNEL']))
+
+# Blocking work of the event handlers
+executor = ThreadPoolExecutor(config['ASYNC_EXECUTOR_WORKERS'],
+                              thread_name_prefix='async-worker')
+
+# The serving event loop, set at startup, for emits from other threads
+loop = None
+
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, func, *args)
+
+
+async def emit_analysis(drawing_id, sid, payload):
+    if sid:
+        await sio.emit('drawing_analyzed', payload, room=sid)
+    await sio.emit('drawing_analyzed', payload, room=f'drawing-{drawing_id}')
+
+
+def notify_analysis(drawing_id, sid, payload):
+    """AnalysisQueue callback; schedules the emits on the event loop."""
+    asyncio.run_coroutine_threadsafe(
+        emit_analysis(drawing_id, sid, payload), loop)
+
+
+def start_frame(sid, data, timings):
+    """
+    Decode a process_frame payload and hand it to the inference backend.
+    Runs on the executor: a session's first frame creates its tracker, and
+    the inline backend infers right away. Returns the transport, wire size,
+    submit time and a concurrent.futures.Future of the backend's result.
+    """
+    frame_bytes, transport, wire_bytes = app_module.decode_frame(data, timings)
+    backend = app_module.get_inference_backend()
+    submitted = time.perf_counter()
+    future = backend.submit(sid, frame_bytes)
+    if future is None:
+        future = Future()
+        try:
+            future.set_result(backend.process(sid, frame_bytes))
+        except Exception as e:
+            future.set_exception(e)
+    return transport, wire_bytes, submitted, future
+
+
+async def infer_frame(sid, frame_id, data, received, timings):
+    transport, wire_bytes, submitted, future = await run_blocking(
+        start_frame, sid, data, timings)
+    # Shielded: cancelling a queued frame's future on timeout would break
+    # the tracker thread that later completes it
+    result = await asyncio.wait_for(
+        asyncio.shield(asyncio.wrap_future(future)),
+        app_module.inference_backend.frame_timeout)
+    timings['backend'] = time.perf_counter() - submitted
+    return app_module.accept_frame_result(sid, frame_id, received, result,
+                                          transport, wire_bytes, timings)
+
+
+@sio.on('process_frame')
+async def handle_frame(sid, data):
+    received = time.perf_counter()
+    frame_id = app_module.frame_id_of(data)
+    timings = {}
+    if not app_module.client_limits.allow(sid, 'process_frame'):
+        payload, outcome = app_module.rate_limited_frame()
+    else:
+        try:
+            payload, outcome = await infer_frame(sid, frame_id, data,
+                                                 received, timings)
+        except Exception as e:
+            payload, outcome = app_module.frame_error(e)
+
+    app_module.stamp_frame_reply(payload, frame_id, received, timings)
+    emit_start = time.perf_counter()
+    await sio.emit('frame_processed', payload, room=sid)
+    timings['emit'] = time.perf_counter() - emit_start
+    app_module.record_frame(sid, frame_id, timings, outcome)
+
+
+@sio.on('landmarks')
+async def handle_landmarks(sid, packet):
+    rejected = app_module.record_landmarks(sid, packet)
+    if rejected is not None:
+        await sio.emit('landmarks_rejected', rejected, room=sid)
+
+
+@sio.on('tracking_options')
+async def handle_tracking_options(sid, data):
+    await run_blocking(app_module.apply_tracking_options, sid, data)
+
+
+@sio.on('clear_canvas')
+async def handle_clear_canvas(sid, data=None):
+    app_module.clear_session(sid, data)
+
+
+@sio.on('canvas_patch')
+async def handle_canvas_patch(sid, data):
+    ack = await run_blocking(app_module.apply_canvas_patch, sid, data)
+    await sio.emit('canvas_patch_ack', ack, room=sid)
+
+
+@sio.on('connect')
+async def handle_connect(sid, environ):
+    app_module.open_session(sid)
+
+
+@sio.on('disconnect')
+async def handle_disconnect(sid):
+    await run_blocking(app_module.close_session, sid)
+
+
+@sio.on('watch_drawing')
+async def handle_watch_drawing(sid, data):
+    drawing_id = app_module.watch_id_of(data)
+    if drawing_id is None:
+        return
+    await sio.enter_room(sid, f'drawing-{drawing_id}')
+
+    # The analysis may have landed before the page subscribed
+    payload = await run_blocking(app_module.finished_analysis, drawing_id)
+    if payload is not None:
+        await sio.emit('drawing_analyzed', payload, room=sid)
+
+
+@sio.on('save_drawing')
+async def handle_save_drawing(sid, data):
+    response, analysis = await run_blocking(app_module.save_drawing, sid, data)
+    await sio.emit('drawing_saved', response, room=sid)
+    if analysis is not None:
+        await run_blocking(app_module.submit_analysis, sid, analysis)
+
+
+async def startup():
+    global loop
+    loop = asyncio.get_running_loop()
+    await run_blocking(app_module.init_services)
+    analysis_queue = app_module.analysis_queue
+    if analysis_queue is not None:
+        analysis_queue.notify = notify_analysis
+        if config['ANALYSIS_RESUME']:
+            await run_blocking(analysis_queue.resume_pending)
+    backend = await run_blocking(app_module.get_inference_backend)
+    if config['INFERENCE_WARMUP']:
+        seconds = await run_blocking(backend.warm_up)
+        print(f"Inference backend warmed up in {seconds:.2f}s")
+
+
+def shutdown():
+    executor.shutdown(wait=False)
+
+
+application = socketio.ASGIApp(
+    sio,
+    other_asgi_app=WSGIMiddleware(app_module.app,
+                                  workers=config['ASYNC_EXECUTOR_WORKERS']),
+    on_startup=startup,
+    on_shutdown=shutdown)
+
+
+def run_server(host='127.0.0.1', port=5001):
+    """Serve the app with uvicorn; the async counterpart of app.run_server."""
+    uvicorn.run(application, host=host, port=port, log_level='warning')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
+    run_server(args.host, args.port)
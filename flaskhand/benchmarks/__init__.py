@@ -0,0 +1,5 @@
+"""
+Offline benchmarks for the hand drawing server.
+
+Run them from the flaskhand directory, e.g. python -m benchmarks.bench_roi
+"""
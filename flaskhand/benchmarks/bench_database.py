@@ -0,0 +1,163 @@
+"""
+Mixed gallery reads and saves against DrawingDatabase, per-request
+connections versus the pooled WAL setup.
+
+    python -m benchmarks.bench_database --threads 8 --seconds 5
+
+Each run gets a fresh database seeded with --seed-drawings drawings.
+Worker threads then loop for --seconds, either saving a drawing (with
+probability --write-ratio) or loading a gallery page the way /drawings
+does, followed by a thumbnail and image lookup. The "per_request" run
+reproduces the old behaviour: a new connection per operation, the schema
+re-checked every time, default rollback journal. The "pooled" run uses the
+shared ConnectionPool.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from benchmarks.clips import latency_summary
+from database import ConnectionPool, DrawingDatabase, connect, create_tables
+
+# A short stroke, so saves write stroke data as the app's do
+STROKES = [{'color': '#FF0000', 'thickness': 5,
+            'points': [[100, 100, 0], [110, 104, 16], [121, 109, 33]]}]
+
+
+class PerRequestConnections:
+    """Pool stand-in that opens and closes a connection per operation."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.opened = 0
+        conn = connect(db_path, pragmas=(('journal_mode', 'DELETE'),))
+        self.has_legacy_images = create_tables(conn)
+        conn.close()
+
+    def acquire(self):
+        self.opened += 1
+        conn = connect(self.db_path, pragmas=())
+        create_tables(conn)
+        return conn
+
+    def release(self, conn):
+        conn.close()
+
+
+def seed(pool, count, image_size):
+    db = DrawingDatabase(pool=pool)
+    try:
+        for _ in range(count):
+            save(db, image_size)
+    finally:
+        db.close()
+
+
+def save(db, image_size):
+    image = os.urandom(image_size)
+    db.save_drawing(image, strokes=STROKES,
+                    thumbnail=(image[:image_size // 20], 'image/webp'),
+                    analysis_status='pending')
+
+
+def browse(db, rng):
+    drawings, next_before = db.list_drawings(24)
+    if next_before is not None and rng.random() < 0.5:
+        drawings, _ = db.list_drawings(24, next_before)
+    if drawings:
+        drawing = rng.choice(drawings)
+        info = db.get_image_info(drawing['id'])
+        db.get_thumbnail(info['image_hash'])
+        db.get_image(info['image_hash'])
+
+
+def run(pool, threads, seconds, write_ratio, image_size):
+    timings = {'read': [], 'write': []}
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(index):
+        rng = random.Random(index)
+        local = {'read': [], 'write': []}
+        while time.perf_counter() < deadline:
+            kind = 'write' if rng.random() < write_ratio else 'read'
+            start = time.perf_counter()
+            db = DrawingDatabase(pool=pool)
+            try:
+                if kind == 'write':
+                    save(db, image_size)
+                else:
+                    browse(db, rng)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            finally:
+                db.close()
+            local[kind].append(time.perf_counter() - start)
+        with lock:
+            for kind, durations in local.items():
+                timings[kind].extend(durations)
+
+    workers = [threading.Thread(target=worker, args=(index,))
+               for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    operations = len(timings['read']) + len(timings['write'])
+    return {
+        'ops_per_s': operations / seconds,
+        'reads': latency_summary(timings['read']),
+        'writes': latency_summary(timings['write']),
+        'errors': len(errors),
+        'connections_opened': pool.opened,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    parser.add_argument('--seed-drawings', type=int, default=500)
+    parser.add_argument('--image-size', type=int, default=40_000,
+                        help='bytes per stored image')
+    args = parser.parse_args()
+
+    report = {}
+    workdir = tempfile.mkdtemp(prefix='bench_database_')
+    try:
+        setups = (
+            ('per_request', PerRequestConnections),
+            ('pooled', lambda path: ConnectionPool(path, max_idle=args.threads)),
+        )
+        for name, make_pool in setups:
+            db_path = os.path.join(workdir, f'{name}.db')
+            pool = make_pool(db_path)
+            seed(pool, args.seed_drawings, args.image_size)
+            pool.opened = 0
+            report[name] = run(pool, args.threads, args.seconds,
+                               args.write_ratio, args.image_size)
+            if hasattr(pool, 'close'):
+                pool.close()
+            result = report[name]
+            print(f"{name}: {result['ops_per_s']:.0f} ops/s, "
+                  f"read p95 {result['reads'].get('p95_ms', 0):.2f} ms, "
+                  f"write p95 {result['writes'].get('p95_ms', 0):.2f} ms, "
+                  f"{result['errors']} errors")
+    finally:
+        shutil.rmtree(workdir)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Compare direct and scheduled Gemini calls against the local stub model.
+
+    python -m benchmarks.bench_gemini_scheduler --drawings 60 --rpm 120
+
+A burst of saves (a share of them exact duplicates) is analyzed once by
+calling GeminiHelper.analyze from one thread per drawing, as before the
+scheduler, and once through an AnalysisScheduler. The stub model enforces
+--rpm like the real quota, so the direct run shows the 429s the scheduler
+is meant to avoid. Both runs retry quota errors the way AnalysisQueue does.
+"""
+import argparse
+import io
+import json
+import random
+import threading
+import time
+
+from PIL import Image, ImageDraw
+
+from benchmarks.clips import latency_summary
+from gemini_helper import (AnalysisScheduler, GeminiHelper, StubModel,
+                           is_quota_error)
+
+
+def make_drawings(count, duplicate_rate, seed=0):
+    """Random line drawings as PNG bytes; duplicate_rate of them repeat."""
+    rng = random.Random(seed)
+    drawings = []
+    for _ in range(count):
+        if drawings and rng.random() < duplicate_rate:
+            drawings.append(rng.choice(drawings))
+            continue
+        image = Image.new('RGB', (640, 480), 'white')
+        draw = ImageDraw.Draw(image)
+        for _ in range(rng.randint(3, 12)):
+            points = [(rng.randrange(640), rng.randrange(480))
+                      for _ in range(rng.randint(2, 6))]
+            draw.line(points, fill='black', width=5)
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        drawings.append(buffer.getvalue())
+    return drawings
+
+
+def run(analyze, drawings, retries, retry_delay, arrival_interval):
+    """Analyze each drawing on its own thread; return timings and failures."""
+    durations = []
+    failures = []
+    lock = threading.Lock()
+
+    def job(image_bytes):
+        start = time.perf_counter()
+        for attempt in range(retries + 1):
+            try:
+                analyze(image_bytes)
+                break
+            except Exception as e:
+                if attempt == retries or not is_quota_error(e):
+                    with lock:
+                        failures.append(str(e))
+                    return
+                time.sleep(retry_delay * 2 ** attempt)
+        with lock:
+            durations.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = []
+    for image_bytes in drawings:
+        thread = threading.Thread(target=job, args=(image_bytes,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(arrival_interval)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    summary = latency_summary(durations)
+    summary.update({
+        'completed': len(durations),
+        'failed': len(failures),
+        'elapsed_s': elapsed,
+        'throughput_per_s': len(durations) / elapsed,
+    })
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--drawings', type=int, default=60)
+    parser.add_argument('--duplicates', type=float, default=0.2,
+                        help='share of saves repeating an earlier drawing')
+    parser.add_argument('--rpm', type=int, default=120,
+                        help='requests per minute the stub model accepts')
+    parser.add_argument('--latency', type=float, default=0.8,
+                        help='stub seconds per request')
+    parser.add_argument('--per-image-latency', type=float, default=0.2,
+                        help='extra stub seconds per image in a request')
+    parser.add_argument('--arrival-ms', type=float, default=20,
+                        help='gap between saves')
+    parser.add_argument('--max-batch', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--retry-delay', type=float, default=1.0)
+    args = parser.parse_args()
+
+    drawings = make_drawings(args.drawings, args.duplicates)
+    options = (args.retries, args.retry_delay, args.arrival_ms / 1000)
+
+    def stub_model():
+        return StubModel(latency=args.latency,
+                         per_image_latency=args.per_image_latency,
+                         requests_per_minute=args.rpm)
+
+    direct_model = stub_model()
+    direct = run(GeminiHelper(model=direct_model).analyze, drawings, *options)
+    direct.update(api_calls=direct_model.calls,
+                  quota_errors=direct_model.quota_errors)
+
+    scheduled_model = stub_model()
+    # Stay just under the stub's quota, as GEMINI_RPM should for the API
+    scheduler = AnalysisScheduler(
+        GeminiHelper(model=scheduled_model),
+        requests_per_minute=args.rpm * 0.9,
+        burst=max(1, args.rpm // 60),
+        max_batch=args.max_batch,
+        concurrency=args.concurrency,
+        quota_backoff=args.retry_delay)
+    try:
+        scheduled = run(scheduler.analyze, drawings, *options)
+    finally:
+        scheduler.shutdown()
+    scheduled.update(api_calls=scheduled_model.calls,
+                     quota_errors=scheduled_model.quota_errors,
+                     scheduler=scheduler.snapshot())
+
+    for name, result in (('direct', direct), ('scheduled', scheduled)):
+        print(f"{name}: {result['completed']}/{args.drawings} done, "
+              f"{result['failed']} failed, {result['api_calls']} calls, "
+              f"{result['quota_errors']} quota errors, "
+              f"p50 {result.get('p50_ms', 0):.0f} ms, "
+              f"p95 {result.get('p95_ms', 0):.0f} ms")
+    print(json.dumps({'direct': direct, 'scheduled': scheduled}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
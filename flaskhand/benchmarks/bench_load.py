@@ -0,0 +1,472 @@
+"""
+Load test the server with simulated drawing clients over Socket.IO.
+
+    python -m benchmarks.bench_load --serve --clients 10 50 100 200 --fps 15
+    python -m benchmarks.bench_load --url http://localhost:5001 --clients 50
+
+Each simulated client speaks the drawing.js protocol: it streams
+pre-encoded JPEG frames as binary process_frame events at --fps, with at
+most --inflight frames unanswered and frames expiring after --frame-timeout
+seconds; every --save-interval seconds it sends a canvas patch and commits
+a save_drawing, and every --browse-interval seconds it loads /drawings.
+
+Client counts in --clients are run one after another for --seconds each,
+so the report shows where the server saturates: the first step whose
+clients fall short of the target frame rate by more than --tolerance,
+drop more than --max-drop-rate of their frames or see a p95 round trip
+above --max-rtt-ms. Queue depth gauges are sampled from /metrics.
+
+--serve starts the app in a subprocess with the stub Gemini backend and a
+database in a temporary directory, so nothing leaves the machine, on
+Werkzeug or with --server asgi on the async server (asgi_app.py); when
+pointing --url at a running server, start it with GEMINI_BACKEND=stub.
+Without the websocket-client package, clients fall back to long polling.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import cv2
+import numpy as np
+import socketio
+
+from benchmarks.clips import latency_summary, load_clip
+from strokes import CANVAS_HEIGHT, CANVAS_WIDTH
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GAUGES = ('flaskhand_connected_sessions', 'flaskhand_frame_queue_depth',
+          'flaskhand_analysis_queue_depth', 'flaskhand_gemini_queue_depth')
+
+# What --serve runs per --server: Werkzeug threads or the async server
+SERVE = {
+    'threading': 'import app; app.run_server(port={port})',
+    'asgi': 'import asgi_app; asgi_app.run_server(port={port})',
+}
+
+
+def synthetic_frames(count, size):
+    """Frames of a bright blob moving over a dark background."""
+    width, height = size
+    frames = []
+    for index in range(count):
+        frame = np.full((height, width, 3), 40, np.uint8)
+        angle = 2 * np.pi * index / count
+        center = (int(width / 2 + width / 4 * np.cos(angle)),
+                  int(height / 2 + height / 4 * np.sin(angle)))
+        cv2.circle(frame, center, height // 8, (180, 200, 230), -1)
+        frames.append(frame)
+    return frames
+
+
+def encode_frames(frames, quality):
+    return [cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1]
+            .tobytes() for frame in frames]
+
+
+def make_patch(rng, size=96):
+    patch = np.zeros((size, size, 3), np.uint8)
+    points = np.array([[rng.randrange(size), rng.randrange(size)]
+                       for _ in range(8)], np.int32)
+    cv2.polylines(patch, [points], False, (0, 0, 255), 5, cv2.LINE_AA)
+    return cv2.imencode('.png', patch)[1].tobytes()
+
+
+def http_get(url, timeout=10.0):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.status, response.read()
+
+
+class SimulatedClient:
+    """One drawing client; run() streams frames until the deadline."""
+
+    def __init__(self, index, args, payloads):
+        self.index = index
+        self.args = args
+        self.payloads = payloads
+        self.rng = random.Random(index)
+        self.sio = socketio.Client(reconnection=False)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.counts = dict.fromkeys(
+            ('sent', 'processed', 'dropped', 'stale', 'errors', 'timeouts',
+             'saves', 'save_errors', 'browses', 'browse_errors'), 0)
+        self.rtts = []
+        self.server_ms = []
+        self.save_times = []
+        self.browse_times = []
+        self.connect_error = None
+        self.patch_seq = 0
+        self.save_started = None
+
+        self.sio.on('frame_processed', self.on_frame_processed)
+        self.sio.on('canvas_patch_ack', self.on_canvas_patch_ack)
+        self.sio.on('drawing_saved', self.on_drawing_saved)
+
+    def on_frame_processed(self, data):
+        now = time.perf_counter()
+        with self.lock:
+            sent_at = self.pending.pop(data.get('frame_id'), None)
+            if sent_at is None:
+                return
+            if 'error' in data:
+                self.counts['errors'] += 1
+            elif data.get('stale'):
+                self.counts['stale'] += 1
+            elif data.get('dropped'):
+                self.counts['dropped'] += 1
+            else:
+                self.counts['processed'] += 1
+                self.rtts.append(now - sent_at)
+                self.server_ms.append(data.get('server_ms', 0.0) / 1000)
+
+    def on_canvas_patch_ack(self, data):
+        if data.get('seq') != self.patch_seq:
+            return
+        if 'error' in data:
+            with self.lock:
+                self.counts['save_errors'] += 1
+                self.save_started = None
+            return
+        self.sio.emit('save_drawing', {'commit': self.patch_seq})
+
+    def on_drawing_saved(self, response):
+        with self.lock:
+            if self.save_started is None:
+                return
+            if response.get('status') == 'success':
+                self.counts['saves'] += 1
+                self.save_times.append(time.perf_counter() - self.save_started)
+            else:
+                self.counts['save_errors'] += 1
+            self.save_started = None
+        # Start the next drawing, like the client's clear button
+        self.patch_seq += 1
+        self.sio.emit('clear_canvas', {'seq': self.patch_seq})
+
+    def save(self):
+        with self.lock:
+            if self.save_started is not None:
+                return
+            self.save_started = time.perf_counter()
+        self.patch_seq += 1
+        self.sio.emit('canvas_patch', {
+            'seq': self.patch_seq,
+            'x': self.rng.randrange(CANVAS_WIDTH - 96),
+            'y': self.rng.randrange(CANVAS_HEIGHT - 96),
+            'patch': make_patch(self.rng),
+        })
+
+    def browse(self):
+        start = time.perf_counter()
+        try:
+            http_get(self.args.url + '/drawings')
+        except (OSError, urllib.error.URLError):
+            with self.lock:
+                self.counts['browse_errors'] += 1
+            return
+        with self.lock:
+            self.counts['browses'] += 1
+            self.browse_times.append(time.perf_counter() - start)
+
+    def send_frame(self, frame_id):
+        with self.lock:
+            self.pending[frame_id] = time.perf_counter()
+            self.counts['sent'] += 1
+        payload = self.payloads[frame_id % len(self.payloads)]
+        self.sio.emit('process_frame', {'frame_id': frame_id, 'frame': payload})
+
+    def expire(self, now):
+        with self.lock:
+            expired = [frame_id for frame_id, sent_at in self.pending.items()
+                       if now - sent_at > self.args.frame_timeout]
+            for frame_id in expired:
+                del self.pending[frame_id]
+            self.counts['timeouts'] += len(expired)
+
+    def run(self, start_at, deadline):
+        time.sleep(max(0.0, start_at - time.perf_counter()))
+        try:
+            self.sio.connect(self.args.url, wait_timeout=10)
+        except Exception as e:
+            self.connect_error = str(e)
+            return
+        self.started = time.perf_counter()
+        interval = 1.0 / self.args.fps
+        # Spread periodic work so clients don't save in lockstep
+        next_save = self.started + self.rng.uniform(0, self.args.save_interval)
+        next_browse = self.started + self.rng.uniform(
+            0, self.args.browse_interval)
+        next_frame = self.started
+        frame_id = 0
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                self.expire(now)
+                if now >= next_frame:
+                    next_frame += interval
+                    with self.lock:
+                        room = len(self.pending) < self.args.inflight
+                    if room:
+                        self.send_frame(frame_id)
+                        frame_id += 1
+                if self.args.save_interval and now >= next_save:
+                    next_save += self.args.save_interval
+                    self.save()
+                if self.args.browse_interval and now >= next_browse:
+                    next_browse += self.args.browse_interval
+                    threading.Thread(target=self.browse, daemon=True).start()
+                time.sleep(max(0.0, min(next_frame, deadline)
+                               - time.perf_counter()))
+            # Let the last replies arrive before counting them as lost
+            time.sleep(min(self.args.frame_timeout, 1.0))
+            self.expire(float('inf'))
+        finally:
+            self.stopped = time.perf_counter()
+            self.sio.disconnect()
+
+
+class MetricsSampler(threading.Thread):
+    """Polls /metrics and keeps the maximum of each queue gauge."""
+
+    def __init__(self, url, interval=1.0):
+        super().__init__(daemon=True)
+        self.url = url + '/metrics'
+        self.interval = interval
+        self.maxima = {}
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                _, body = http_get(self.url, timeout=self.interval * 5)
+            except (OSError, urllib.error.URLError):
+                continue
+            for line in body.decode().splitlines():
+                name, _, value = line.partition(' ')
+                if name in GAUGES:
+                    self.maxima[name] = max(self.maxima.get(name, 0.0),
+                                            float(value))
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+def run_step(args, payloads, clients):
+    simulated = [SimulatedClient(index, args, payloads)
+                 for index in range(clients)]
+    ramp = args.ramp / clients if clients else 0.0
+    begin = time.perf_counter() + 0.5
+    deadline = begin + args.ramp + args.seconds
+    sampler = MetricsSampler(args.url)
+    sampler.start()
+    threads = [threading.Thread(target=client.run,
+                                args=(begin + index * ramp, deadline))
+               for index, client in enumerate(simulated)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sampler.stop()
+
+    connected = [client for client in simulated if client.connect_error is None]
+    counts = dict.fromkeys(simulated[0].counts, 0)
+    rtts, server_ms, save_times, browse_times = [], [], [], []
+    client_fps, client_p95 = [], []
+    for client in connected:
+        for name, value in client.counts.items():
+            counts[name] += value
+        rtts.extend(client.rtts)
+        server_ms.extend(client.server_ms)
+        save_times.extend(client.save_times)
+        browse_times.extend(client.browse_times)
+        client_fps.append(client.counts['processed']
+                          / (client.stopped - client.started))
+        if client.rtts:
+            client_p95.append(latency_summary(client.rtts)['p95_ms'])
+
+    lost = sum(counts[name]
+               for name in ('dropped', 'stale', 'errors', 'timeouts'))
+    step = {
+        'clients': clients,
+        'connected': len(connected),
+        'connect_errors': sorted({client.connect_error for client in simulated
+                                  if client.connect_error}),
+        'frames': {name: counts[name] for name in
+                   ('sent', 'processed', 'dropped', 'stale', 'errors',
+                    'timeouts')},
+        'drop_rate': lost / counts['sent'] if counts['sent'] else 0.0,
+        'throughput_fps': sum(client_fps),
+        'client_fps': spread(client_fps),
+        'rtt': latency_summary(rtts),
+        'server': latency_summary(server_ms),
+        'client_rtt_p95_ms': spread(client_p95),
+        'saves': {'ok': counts['saves'], 'errors': counts['save_errors'],
+                  'latency': latency_summary(save_times)},
+        'browse': {'ok': counts['browses'], 'errors': counts['browse_errors'],
+                   'latency': latency_summary(browse_times)},
+        'server_gauges_max': sampler.maxima,
+    }
+    step['saturated'] = saturation_reasons(step, args)
+    return step
+
+
+def spread(values):
+    if not values:
+        return {}
+    return {'min': min(values), 'median': statistics.median(values),
+            'max': max(values)}
+
+
+def saturation_reasons(step, args):
+    reasons = []
+    if step['connected'] < step['clients']:
+        reasons.append(f"{step['clients'] - step['connected']} clients "
+                       f"failed to connect")
+    median_fps = step['client_fps'].get('median', 0.0)
+    if median_fps < args.fps * (1 - args.tolerance):
+        reasons.append(f"median client rate {median_fps:.1f} fps "
+                       f"below target {args.fps:g}")
+    if step['drop_rate'] > args.max_drop_rate:
+        reasons.append(f"{step['drop_rate']:.1%} of frames dropped")
+    p95 = step['rtt'].get('p95_ms')
+    if p95 is not None and p95 > args.max_rtt_ms:
+        reasons.append(f"p95 round trip {p95:.0f} ms")
+    return reasons
+
+
+def start_server(port, server_env, server='threading'):
+    workdir = tempfile.mkdtemp(prefix='bench_load_')
+    env = dict(os.environ, GEMINI_BACKEND='stub',
+               DATABASE_PATH=os.path.join(workdir, 'drawings.db'))
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [APP_DIR, env.get('PYTHONPATH')]))
+    env.update(server_env)
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVE[server].format(port=port)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            http_get(url + '/metrics', timeout=1.0)
+            return process, workdir, url
+        except (OSError, urllib.error.URLError):
+            time.sleep(0.25)
+    process.terminate()
+    shutil.rmtree(workdir, ignore_errors=True)
+    raise RuntimeError("Server did not start within 60 s")
+
+
+def add_load_arguments(parser):
+    """Options shaping the simulated clients and saturation thresholds."""
+    parser.add_argument('--seconds', type=float, default=20.0,
+                        help='steady-state duration of each step')
+    parser.add_argument('--ramp', type=float, default=5.0,
+                        help='seconds over which clients connect')
+    parser.add_argument('--fps', type=float, default=15.0)
+    parser.add_argument('--inflight', type=int, default=2)
+    parser.add_argument('--frame-timeout', type=float, default=2.0)
+    parser.add_argument('--save-interval', type=float, default=30.0,
+                        help='seconds between saves per client, 0 to disable')
+    parser.add_argument('--browse-interval', type=float, default=20.0,
+                        help='seconds between /drawings loads, 0 to disable')
+    parser.add_argument('--clip', help='video or image directory to stream '
+                                       'instead of synthetic frames')
+    parser.add_argument('--clip-frames', type=int, default=90)
+    parser.add_argument('--size', default='320x240', help='frame WxH')
+    parser.add_argument('--jpeg-quality', type=int, default=70)
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--max-drop-rate', type=float, default=0.05)
+    parser.add_argument('--max-rtt-ms', type=float, default=250.0)
+    parser.add_argument('--stop-on-saturation', action='store_true')
+
+
+def make_payloads(args):
+    size = tuple(int(part) for part in args.size.lower().split('x'))
+    if args.clip:
+        frames = load_clip(args.clip, max_frames=args.clip_frames, size=size)
+    else:
+        frames = synthetic_frames(args.clip_frames, size)
+    return encode_frames(frames, args.jpeg_quality)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default='http://localhost:5001')
+    parser.add_argument('--serve', action='store_true',
+                        help='start a local server with the stub Gemini backend')
+    parser.add_argument('--port', type=int, default=5055,
+                        help='port for --serve')
+    parser.add_argument('--server', default='threading', choices=SERVE,
+                        help='server --serve starts')
+    parser.add_argument('--server-env', nargs='+', default=[],
+                        metavar='KEY=VALUE',
+                        help='extra environment for --serve, '
+                             'e.g. INFERENCE_BACKEND=process')
+    parser.add_argument('--clients', nargs='+', type=int, default=[10, 50, 100])
+    add_load_arguments(parser)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    payloads = make_payloads(args)
+
+    server = workdir = None
+    if args.serve:
+        server_env = dict(item.split('=', 1) for item in args.server_env)
+        server, workdir, args.url = start_server(args.port, server_env,
+                                                 args.server)
+    args.url = args.url.rstrip('/')
+
+    report = {
+        'url': args.url,
+        'target_fps': args.fps,
+        'frame_size': args.size,
+        'mean_payload_bytes': sum(map(len, payloads)) / len(payloads),
+        'steps': [],
+        'saturation_point': None,
+    }
+    try:
+        for clients in args.clients:
+            step = run_step(args, payloads, clients)
+            report['steps'].append(step)
+            print(f"{clients} clients: {step['throughput_fps']:.0f} fps total, "
+                  f"rtt p95 {step['rtt'].get('p95_ms', 0):.1f} ms, "
+                  f"{step['drop_rate']:.1%} dropped, "
+                  f"{step['saves']['ok']} saves"
+                  + (f" - saturated: {'; '.join(step['saturated'])}"
+                     if step['saturated'] else ''))
+            if step['saturated'] and report['saturation_point'] is None:
+                report['saturation_point'] = clients
+                if args.stop_on_saturation:
+                    break
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+"""
+Replay recorded clips through HandTracker and the Socket.IO frame handler.
+
+    python -m benchmarks.bench_replay clips/pinch.mp4 clips/frames_dir \\
+        --configs default lite roi --sizes 640x480 320x240 --output run.json
+
+Every clip is replayed at each --sizes resolution for each tracker
+configuration, along two paths: "tracker" calls
+HandTracker.process_and_encode_frame directly, "socketio" emits the frames
+as JPEG to the app's process_frame handler through a Socket.IO test client,
+adding payload decoding, the inference backend, stroke recording and the
+reply. Each run reports FPS, latency percentiles, the share of frames with
+a hand, mean stage times, process CPU use and resident memory.
+
+The app is imported with the stub Gemini backend and a database in a
+temporary directory. With --baseline, runs present in an earlier --output
+file whose FPS or p95 latency got worse by more than --tolerance are
+listed and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import cv2
+
+from benchmarks.clips import latency_summary, load_clip
+from hand_tracker import HandTracker
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CONFIGS = {
+    'default': {},
+    'lite': {'model_complexity': 0},
+    'low_confidence': {'min_detection_confidence': 0.5,
+                       'min_tracking_confidence': 0.5},
+    'roi': {'roi_mode': True},
+    'roi_lite': {'roi_mode': True, 'model_complexity': 0},
+}
+
+# Tracker options the socketio path can set through app.config
+CONFIG_KEYS = {
+    'roi_mode': 'TRACKER_ROI',
+    'smoothing': 'TRACKER_SMOOTHING',
+    'inference_hz': 'TRACKER_INFERENCE_HZ',
+    'model_complexity': 'TRACKER_MODEL_COMPLEXITY',
+    'min_detection_confidence': 'TRACKER_MIN_DETECTION_CONFIDENCE',
+    'min_tracking_confidence': 'TRACKER_MIN_TRACKING_CONFIDENCE',
+}
+
+
+def parse_size(value):
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected WIDTHxHEIGHT, got {value!r}")
+    return width, height
+
+
+def memory_mb():
+    """Current and peak resident set size in MiB, where the OS reports them."""
+    current = peak = None
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        current = pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS bytes
+        peak = maxrss / 2 ** 20 if sys.platform == 'darwin' else maxrss / 1024
+    return current, peak
+
+
+class Measurement:
+    """Wall time, process CPU time and memory around a replay."""
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        rss, peak_rss = memory_mb()
+        self.result = {
+            'wall_s': wall,
+            'cpu_s': cpu,
+            # Across all threads, so can exceed 100 on several cores
+            'cpu_percent': 100 * cpu / wall if wall else 0.0,
+            'rss_mb': rss,
+            'peak_rss_mb': peak_rss,
+        }
+
+
+def summarize(durations, detections, measurement, stage_totals=None):
+    summary = {
+        'frames': len(durations),
+        'fps': len(durations) / measurement.result['wall_s'],
+        'latency': latency_summary(durations),
+        'detection_rate': detections / len(durations) if durations else 0.0,
+    }
+    if stage_totals:
+        summary['stages_mean_ms'] = {
+            stage: 1000 * total / len(durations)
+            for stage, total in sorted(stage_totals.items())}
+    summary.update(measurement.result)
+    return summary
+
+
+def run_tracker(frames, options):
+    tracker = HandTracker(**options)
+    durations = []
+    detections = 0
+    stage_totals = {}
+    try:
+        with Measurement() as measurement:
+            for frame in frames:
+                start = time.perf_counter()
+                hand_data = tracker.process_and_encode_frame(frame)
+                durations.append(time.perf_counter() - start)
+                if hand_data['has_hand']:
+                    detections += 1
+                for stage, seconds in tracker.timings.items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+    finally:
+        tracker.close()
+    return summarize(durations, detections, measurement, stage_totals)
+
+
+def load_app(backend):
+    """Import the app with a stub Gemini backend and a throwaway database."""
+    os.environ['GEMINI_BACKEND'] = 'stub'
+    os.environ['INFERENCE_BACKEND'] = backend
+    os.environ['DATABASE_PATH'] = os.path.join(
+        tempfile.mkdtemp(prefix='bench_replay_'), 'drawings.db')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    import app as app_module
+    defaults = {key: app_module.app.config[key] for key in CONFIG_KEYS.values()}
+    return app_module, defaults
+
+
+def use_tracker_options(app_module, defaults, options):
+    """Restart the app's inference backend with the given tracker options."""
+    unsupported = set(options) - set(CONFIG_KEYS)
+    if unsupported:
+        raise ValueError(f"Not configurable through app.config: "
+                         f"{', '.join(sorted(unsupported))}")
+    with app_module.inference_backend_lock:
+        if app_module.inference_backend is not None:
+            app_module.inference_backend.close()
+            app_module.inference_backend = None
+        for option, key in CONFIG_KEYS.items():
+            app_module.app.config[key] = options.get(option, defaults[key])
+
+
+def run_socketio(app_module, defaults, frames, options, jpeg_quality):
+    use_tracker_options(app_module, defaults, options)
+    payloads = [cv2.imencode('.jpg', frame,
+                             [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1]
+                .tobytes() for frame in frames]
+    client = app_module.socketio.test_client(app_module.app)
+    client.get_received()
+    durations = []
+    detections = 0
+    outcomes = {}
+    try:
+        with Measurement() as measurement:
+            for frame_id, payload in enumerate(payloads):
+                start = time.perf_counter()
+                client.emit('process_frame',
+                            {'frame_id': frame_id, 'frame': payload})
+                received = client.get_received()
+                durations.append(time.perf_counter() - start)
+                for packet in received:
+                    if packet['name'] != 'frame_processed':
+                        continue
+                    reply = packet['args'][0]
+                    if 'error' in reply:
+                        outcome = 'error'
+                    elif reply.get('dropped'):
+                        outcome = 'dropped'
+                    else:
+                        outcome = 'processed'
+                        if reply['hand_data'].get('has_hand'):
+                            detections += 1
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    finally:
+        client.disconnect()
+    summary = summarize(durations, detections, measurement)
+    summary['outcomes'] = outcomes
+    summary['mean_payload_bytes'] = sum(map(len, payloads)) / len(payloads)
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """Runs that regressed against a baseline report, as printable lines."""
+    def key(run):
+        return run['path'], run['clip'], run['size'], run['config']
+
+    previous = {key(run): run for run in baseline['results']}
+    regressions = []
+    for run in results:
+        old = previous.get(key(run))
+        if old is None:
+            continue
+        fps_change = run['fps'] / old['fps'] - 1
+        p95_change = (run['latency']['p95_ms'] / old['latency']['p95_ms'] - 1
+                      if old['latency'].get('p95_ms') else 0.0)
+        run['baseline'] = {'fps_change': fps_change, 'p95_change': p95_change}
+        if fps_change < -tolerance or p95_change > tolerance:
+            regressions.append(
+                f"{'/'.join(map(str, key(run)))}: fps {fps_change:+.1%}, "
+                f"p95 {p95_change:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('clips', nargs='+',
+                        help='video files or directories of images')
+    parser.add_argument('--configs', nargs='+', default=['default', 'roi'],
+                        choices=sorted(CONFIGS))
+    parser.add_argument('--config', nargs=2, action='append', default=[],
+                        metavar=('NAME', 'JSON'),
+                        help='extra configuration as HandTracker options, '
+                             'e.g. fast \'{"model_complexity": 0}\'')
+    parser.add_argument('--sizes', nargs='+', type=parse_size,
+                        default=[None], metavar='WxH',
+                        help='resize frames (default: as recorded)')
+    parser.add_argument('--paths', nargs='+', default=['tracker', 'socketio'],
+                        choices=['tracker', 'socketio'])
+    parser.add_argument('--backend', default='inline',
+                        choices=['inline', 'thread'],
+                        help='inference backend for the socketio path')
+    parser.add_argument('--jpeg-quality', type=int, default=70)
+    parser.add_argument('--max-frames', type=int, default=None)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--baseline', help='earlier --output to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative slowdown against --baseline')
+    args = parser.parse_args()
+
+    configs = {name: CONFIGS[name] for name in args.configs}
+    for name, options in args.config:
+        configs[name] = json.loads(options)
+    clips = [os.path.abspath(clip) for clip in args.clips]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+
+    app_module = defaults = None
+    if 'socketio' in args.paths:
+        app_module, defaults = load_app(args.backend)
+
+    results = []
+    for clip in clips:
+        for size in args.sizes:
+            frames = load_clip(clip, max_frames=args.max_frames, size=size)
+            height, width = frames[0].shape[:2]
+            for name, options in configs.items():
+                for path in args.paths:
+                    if path == 'tracker':
+                        summary = run_tracker(frames, options)
+                    else:
+                        summary = run_socketio(app_module, defaults, frames,
+                                               options, args.jpeg_quality)
+                    run = {'path': path, 'clip': clip,
+                           'size': f'{width}x{height}', 'config': name,
+                           'options': options}
+                    run.update(summary)
+                    results.append(run)
+                    print(f"{path} {os.path.basename(clip)} {run['size']} "
+                          f"{name}: {run['fps']:.1f} fps, "
+                          f"p50 {run['latency']['p50_ms']:.2f} ms, "
+                          f"p95 {run['latency']['p95_ms']:.2f} ms, "
+                          f"{run['detection_rate']:.1%} detected, "
+                          f"{run['cpu_percent']:.0f}% CPU")
+
+    report = {
+        'environment': {
+            'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'mediapipe': getattr(sys.modules.get('mediapipe'),
+                                 '__version__', None),
+            'socketio_backend': args.backend if app_module else None,
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        report['regressions'] = regressions
+        for line in regressions:
+            print(f"Regression: {line}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+    if app_module is not None:
+        use_tracker_options(app_module, defaults, {})
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare full-frame and ROI hand tracking on recorded clips.
+
+    python -m benchmarks.bench_roi clips/pinch.mp4 clips/frames_dir
+
+For each clip, every frame is fed through a fresh HandTracker with ROI mode
+off and on; per-frame latency, the share of frames with a detected hand
+and MediaPipe runs per frame are reported side by side. More than one run
+per frame means crops missed the hand and fell back to the full frame.
+"""
+import argparse
+import json
+import time
+
+from benchmarks.clips import latency_summary, load_clip
+from hand_tracker import HandTracker
+
+
+def run_tracker(frames, **tracker_options):
+    tracker = HandTracker(**tracker_options)
+    durations = []
+    detections = 0
+    inferences = 0
+
+    def counted(process):
+        def run(image):
+            nonlocal inferences
+            inferences += 1
+            return process(image)
+        return run
+
+    for graph in (tracker.hands, tracker.roi_hands):
+        if graph is not None:
+            graph.process = counted(graph.process)
+    try:
+        for frame in frames:
+            start = time.perf_counter()
+            results = tracker.process_frame(frame)
+            durations.append(time.perf_counter() - start)
+            if results.multi_hand_landmarks:
+                detections += 1
+    finally:
+        tracker.close()
+
+    summary = latency_summary(durations)
+    summary['detection_rate'] = detections / len(frames)
+    summary['inferences_per_frame'] = inferences / len(frames)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('clips', nargs='+',
+                        help='video files or directories of images')
+    parser.add_argument('--max-frames', type=int, default=None)
+    parser.add_argument('--roi-max-side', type=int, default=256)
+    parser.add_argument('--roi-padding', type=float, default=0.75)
+    args = parser.parse_args()
+
+    report = {}
+    for clip in args.clips:
+        frames = load_clip(clip, max_frames=args.max_frames)
+        full = run_tracker(frames)
+        roi = run_tracker(frames, roi_mode=True,
+                          roi_max_side=args.roi_max_side,
+                          roi_padding=args.roi_padding)
+        report[clip] = {
+            'frames': len(frames),
+            'full_frame': full,
+            'roi': roi,
+            'speedup': full['mean_ms'] / roi['mean_ms'],
+            'detection_rate_delta': roi['detection_rate'] - full['detection_rate'],
+        }
+        print(f"{clip}: full {full['mean_ms']:.2f} ms "
+              f"({full['detection_rate']:.1%} detected), "
+              f"roi {roi['mean_ms']:.2f} ms "
+              f"({roi['detection_rate']:.1%} detected, "
+              f"{roi['inferences_per_frame']:.2f} runs per frame)")
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
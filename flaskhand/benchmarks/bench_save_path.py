@@ -0,0 +1,148 @@
+"""
+Per-stage time and allocations of the save path, before and after sharing
+one decoded image between flip, storage, thumbnail and analysis.
+
+    python -m benchmarks.bench_save_path --repeat 50 --format png webp
+
+A synthetic 640x480 drawing is sent through the old pipeline (decode, flip
+into a copy, PNG encode, base64 echo, then a base64 decode and PIL decode
+for Gemini and a third decode for the perceptual hash) and through the
+current one for each storage format. Times are medians over --repeat runs;
+allocations are peak and retained bytes per stage measured with
+tracemalloc in a separate pass.
+"""
+import argparse
+import base64
+import io
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from analysis_cache import perceptual_hash
+from gemini_helper import image_part
+from image_pipeline import decode_image, encode_image, make_thumbnail
+from strokes import encode_strokes, render_strokes
+
+
+def make_data_url(seed=0):
+    """A canvas-like drawing as the PNG data URL the client used to send."""
+    rng = random.Random(seed)
+    strokes = []
+    t = 0
+    for _ in range(12):
+        x, y = rng.randrange(640), rng.randrange(480)
+        points = []
+        for _ in range(rng.randint(20, 80)):
+            x = min(639, max(0, x + rng.randint(-12, 12)))
+            y = min(479, max(0, y + rng.randint(-12, 12)))
+            t += 30
+            points.append([x, y, t])
+        strokes.append({'color': '#FF0000', 'thickness': 5, 'points': points})
+    image = render_strokes(encode_strokes(strokes))
+    _, buffer = cv2.imencode('.png', image)
+    return 'data:image/png;base64,' + base64.b64encode(buffer).decode('ascii')
+
+
+def old_stages():
+    def pil_decode(state):
+        try:
+            from PIL import Image
+        except ImportError:
+            return
+        Image.open(io.BytesIO(base64.b64decode(state['echo']))).load()
+
+    return [
+        ('base64_decode', lambda s: s.update(
+            raw=base64.b64decode(s['data_url'].split(',')[1]))),
+        ('imdecode', lambda s: s.update(
+            image=cv2.imdecode(np.frombuffer(s['raw'], np.uint8),
+                               cv2.IMREAD_COLOR))),
+        ('flip', lambda s: s.update(image=cv2.flip(s['image'], 1))),
+        ('encode', lambda s: s.update(
+            stored=cv2.imencode('.png', s['image'])[1].tobytes())),
+        ('thumbnail', lambda s: make_thumbnail(s['image'], 240)),
+        ('base64_echo', lambda s: s.update(
+            echo=base64.b64encode(s['stored']).decode('utf-8'))),
+        ('gemini_decode', pil_decode),
+        ('phash', lambda s: perceptual_hash(s['stored'])),
+    ]
+
+
+def new_stages(image_format, png_compression):
+    return [
+        ('base64_decode', lambda s: s.update(
+            raw=base64.b64decode(s['data_url'].split(',')[1]))),
+        ('imdecode_flip', lambda s: s.update(
+            image=decode_image(s['raw'], flip_horizontal=True))),
+        ('encode', lambda s: s.update(stored=encode_image(
+            s['image'], image_format, png_compression)[0])),
+        ('thumbnail', lambda s: make_thumbnail(s['image'], 240)),
+        ('gemini_part', lambda s: image_part(s['stored'])),
+        ('phash', lambda s: perceptual_hash(s['image'])),
+    ]
+
+
+def run(stages, data_url, repeat):
+    timings = {name: [] for name, _ in stages}
+    for _ in range(repeat):
+        state = {'data_url': data_url}
+        for name, stage in stages:
+            start = time.perf_counter()
+            stage(state)
+            timings[name].append(time.perf_counter() - start)
+
+    report = {}
+    state = {'data_url': data_url}
+    tracemalloc.start()
+    try:
+        for name, stage in stages:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            stage(state)
+            after, peak = tracemalloc.get_traced_memory()
+            report[name] = {
+                'median_ms': statistics.median(timings[name]) * 1000,
+                'peak_kb': (peak - before) / 1024,
+                'retained_kb': (after - before) / 1024,
+            }
+    finally:
+        tracemalloc.stop()
+
+    report['total'] = {
+        key: sum(stage[key] for stage in report.values())
+        for key in ('median_ms', 'peak_kb', 'retained_kb')
+    }
+    report['total']['stored_bytes'] = len(state['stored'])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--format', nargs='+', default=['png', 'webp'],
+                        choices=['png', 'webp'])
+    parser.add_argument('--png-compression', type=int, default=1)
+    args = parser.parse_args()
+
+    data_url = make_data_url()
+    report = {'old': run(old_stages(), data_url, args.repeat)}
+    for image_format in args.format:
+        report[f'new_{image_format}'] = run(
+            new_stages(image_format, args.png_compression),
+            data_url, args.repeat)
+
+    for name, stages in report.items():
+        total = stages['total']
+        print(f"{name}: {total['median_ms']:.2f} ms, "
+              f"{total['peak_kb']:.0f} KiB peak allocations, "
+              f"{total['stored_bytes']} bytes stored")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Compare the Werkzeug and async servers under the same simulated load.
+
+    python -m benchmarks.bench_servers --clients 10 100 500 --seconds 20
+
+Each server in --servers is started the way bench_load --serve does, with
+the stub Gemini backend and a database in a temporary directory, and runs
+every --clients step with bench_load's simulated drawing clients; the
+client options are the same as there. TRACKER_POOL_SIZE is raised to the
+largest step so neither server turns sessions away for lack of trackers;
+--server-env changes that or any other setting for both servers.
+
+For each step the report lists, per server, the clients that connected,
+total frame throughput, round-trip p50 and p95, the drop rate and any
+saturation reasons, plus each server's throughput and p95 relative to
+the first one in --servers. Several hundred clients also mean several
+hundred sockets and threads in this process; raise the open file limit
+(ulimit -n 4096) before the 500 client step.
+"""
+import argparse
+import json
+import shutil
+
+from benchmarks.bench_load import (SERVE, add_load_arguments, make_payloads,
+                                   run_step, start_server)
+
+
+def run_steps(args, payloads, server, server_env):
+    """Run every --clients step against a fresh server; returns the steps."""
+    process, workdir, args.url = start_server(args.port, server_env, server)
+    steps = []
+    try:
+        for clients in args.clients:
+            step = run_step(args, payloads, clients)
+            steps.append(step)
+            print(f"{server}, {clients} clients: {step['connected']} "
+                  f"connected, {step['throughput_fps']:.0f} fps total, "
+                  f"rtt p95 {step['rtt'].get('p95_ms', 0):.1f} ms, "
+                  f"{step['drop_rate']:.1%} dropped"
+                  + (f" - saturated: {'; '.join(step['saturated'])}"
+                     if step['saturated'] else ''))
+            if step['saturated'] and args.stop_on_saturation:
+                break
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return steps
+
+
+def summarize_step(step):
+    return {
+        'connected': step['connected'],
+        'throughput_fps': step['throughput_fps'],
+        'rtt_p50_ms': step['rtt'].get('p50_ms'),
+        'rtt_p95_ms': step['rtt'].get('p95_ms'),
+        'drop_rate': step['drop_rate'],
+        'saturated': step['saturated'],
+    }
+
+
+def compare(results, servers, clients):
+    """One row per client count with every server's summary side by side."""
+    baseline = servers[0]
+    rows = []
+    for count in clients:
+        row = {'clients': count}
+        for server in servers:
+            step = next((step for step in results[server]
+                         if step['clients'] == count), None)
+            if step is not None:
+                row[server] = summarize_step(step)
+        base = row.get(baseline)
+        for server in servers[1:]:
+            if base is None or server not in row:
+                continue
+            summary = row[server]
+            if base['throughput_fps']:
+                summary['throughput_ratio'] = (summary['throughput_fps']
+                                               / base['throughput_fps'])
+            if base['rtt_p95_ms'] and summary['rtt_p95_ms'] is not None:
+                summary['rtt_p95_ratio'] = (summary['rtt_p95_ms']
+                                            / base['rtt_p95_ms'])
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--servers', nargs='+', default=['threading', 'asgi'],
+                        choices=SERVE)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--server-env', nargs='+', default=[],
+                        metavar='KEY=VALUE',
+                        help='extra environment for both servers, '
+                             'e.g. INFERENCE_BACKEND=process')
+    parser.add_argument('--clients', nargs='+', type=int,
+                        default=[10, 100, 500])
+    add_load_arguments(parser)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    payloads = make_payloads(args)
+    server_env = {'TRACKER_POOL_SIZE': str(max(args.clients))}
+    server_env.update(item.split('=', 1) for item in args.server_env)
+
+    results = {}
+    for server in args.servers:
+        results[server] = run_steps(args, payloads, server, server_env)
+
+    comparison = compare(results, args.servers, args.clients)
+    for row in comparison:
+        cells = []
+        for server in args.servers:
+            summary = row.get(server)
+            if summary is None:
+                cells.append(f"{server} -")
+                continue
+            cell = (f"{server} {summary['throughput_fps']:.0f} fps, "
+                    f"p95 {summary['rtt_p95_ms'] or 0:.1f} ms")
+            if 'throughput_ratio' in summary:
+                cell += f" ({summary['throughput_ratio']:.2f}x)"
+            cells.append(cell)
+        print(f"{row['clients']} clients: {' | '.join(cells)}")
+
+    report = {
+        'servers': args.servers,
+        'target_fps': args.fps,
+        'frame_size': args.size,
+        'server_env': server_env,
+        'comparison': comparison,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Server boot time, broken down by imported package, and worker warm-up.
+
+    python -m benchmarks.bench_startup --repeat 3 --workers 2
+
+Each measurement runs in a fresh interpreter with a database in a
+temporary directory. The import breakdown runs `import app` under
+python -X importtime and attributes each module's own import time to its
+top-level package, so mediapipe, cv2 or google.generativeai show up as
+one line each; the median over --repeat runs is reported, with the bare
+interpreter start subtracted from the wall time.
+
+The warm-up runs import the app the way `python app.py` does, so spawned
+workers re-import it, then time creating each inference backend and two
+warm_up() calls: the first one pays for loading the tracker stack, the
+second shows what a warmed server costs per new session. The process
+backend is measured with both the spawn and forkserver start methods.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WARM_UP_SCRIPT = """
+import json
+import time
+
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+
+if __name__ == '__main__':
+    backend = app.get_inference_backend()
+    created = time.perf_counter()
+    first = backend.warm_up()
+    second = backend.warm_up()
+    backend.close()
+    print(json.dumps({
+        'import_s': imported - start,
+        'create_s': created - imported,
+        'first_warm_up_s': first,
+        'second_warm_up_s': second,
+    }))
+"""
+
+BACKENDS = (
+    ('inline', {'INFERENCE_BACKEND': 'inline'}),
+    ('thread', {'INFERENCE_BACKEND': 'thread'}),
+    ('process_spawn', {'INFERENCE_BACKEND': 'process',
+                       'INFERENCE_START_METHOD': 'spawn'}),
+    ('process_forkserver', {'INFERENCE_BACKEND': 'process',
+                            'INFERENCE_START_METHOD': 'forkserver'}),
+)
+
+
+def run_python(args, workdir, env=None):
+    """Run the interpreter in workdir; returns (stdout, stderr, seconds)."""
+    full_env = dict(os.environ, **(env or {}))
+    full_env['DATABASE_PATH'] = os.path.join(workdir, 'drawings.db')
+    full_env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [APP_DIR, os.environ.get('PYTHONPATH')]))
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, *args], cwd=workdir,
+                               env=full_env, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed:\n{completed.stderr}")
+    return completed.stdout, completed.stderr, seconds
+
+
+def parse_importtime(stderr):
+    """Own import time in seconds per top-level package."""
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        own_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0.0) + int(own_us) / 1e6
+    return packages
+
+
+def import_breakdown(workdir, repeat, env):
+    runs, walls = [], []
+    _, _, baseline = run_python(['-c', 'pass'], workdir)
+    for _ in range(repeat):
+        _, stderr, seconds = run_python(
+            ['-X', 'importtime', '-c', 'import app'], workdir, env)
+        runs.append(parse_importtime(stderr))
+        walls.append(seconds)
+
+    packages = {}
+    for package in set().union(*runs):
+        packages[package] = statistics.median(
+            run.get(package, 0.0) for run in runs)
+    total = sum(packages.values())
+    return {
+        'wall_s': statistics.median(walls),
+        'interpreter_s': baseline,
+        'app_s': statistics.median(walls) - baseline,
+        'imports_s': total,
+        'packages': {
+            package: {'ms': seconds * 1000, 'share': seconds / total}
+            for package, seconds in sorted(packages.items(),
+                                           key=lambda item: -item[1])
+        },
+    }
+
+
+def warm_up(workdir, repeat, env):
+    script = os.path.join(workdir, 'warm_up.py')
+    with open(script, 'w') as f:
+        f.write(WARM_UP_SCRIPT)
+    runs = []
+    for _ in range(repeat):
+        stdout, _, seconds = run_python([script], workdir, env)
+        run = json.loads(stdout.strip().splitlines()[-1])
+        run['wall_s'] = seconds
+        runs.append(run)
+    return {key: statistics.median(run[key] for run in runs)
+            for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=2,
+                        help='process backend workers')
+    parser.add_argument('--top', type=int, default=15,
+                        help='packages printed in the summary')
+    parser.add_argument('--backends', nargs='+',
+                        default=[name for name, _ in BACKENDS],
+                        choices=[name for name, _ in BACKENDS])
+    args = parser.parse_args()
+
+    # No Gemini key, so the SDK is never imported
+    env = {'GEMINI_API': '', 'GEMINI_BACKEND': 'gemini',
+           'INFERENCE_WORKERS': str(args.workers)}
+    report = {}
+    with tempfile.TemporaryDirectory(prefix='bench_startup_') as workdir:
+        report['import'] = import_breakdown(workdir, args.repeat, env)
+        imports = report['import']
+        print(f"import app: {imports['app_s']:.2f} s over interpreter start, "
+              f"{imports['imports_s']:.2f} s in imports")
+        for package, stats in list(imports['packages'].items())[:args.top]:
+            print(f"  {package:<24} {stats['ms']:8.1f} ms "
+                  f"{stats['share']:6.1%}")
+
+        report['warm_up'] = {}
+        for name, backend_env in BACKENDS:
+            if name not in args.backends:
+                continue
+            result = warm_up(workdir, args.repeat, dict(env, **backend_env))
+            report['warm_up'][name] = result
+            print(f"{name}: backend {result['create_s']:.2f} s, "
+                  f"first warm-up {result['first_warm_up_s']:.2f} s, "
+                  f"second {result['second_warm_up_s'] * 1000:.0f} ms")
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Helpers shared by the benchmarks: recorded clip loading and statistics.
+
+A clip is either a video file readable by OpenCV or a directory of image
+files, which are replayed in name order.
+"""
+import os
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def load_clip(path, max_frames=None, size=None):
+    """Load the frames of a clip as a list of BGR arrays."""
+    frames = []
+    for frame in iter_clip(path):
+        if size is not None:
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        frames.append(frame)
+        if max_frames and len(frames) >= max_frames:
+            break
+    if not frames:
+        raise ValueError(f"No frames could be read from {path}")
+    return frames
+
+
+def iter_clip(path):
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                frame = cv2.imread(os.path.join(path, name))
+                if frame is not None:
+                    yield frame
+        return
+
+    capture = cv2.VideoCapture(path)
+    try:
+        while True:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def latency_summary(seconds):
+    """Summarize a list of durations in seconds as milliseconds."""
+    if not seconds:
+        return {'count': 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        'count': len(ms),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+    }
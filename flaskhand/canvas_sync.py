@@ -0,0 +1,78 @@
+"""
+Server-side copy of each client's drawing canvas.
+
+While drawing, the client sends the dirty rectangle of its canvas as a
+small PNG patch, one at a time, each tagged with an increasing sequence
+number. The server pastes patches into its copy, so saving only needs to
+name the sequence number the client last had acknowledged.
+"""
+import threading
+
+import cv2
+import numpy as np
+
+from strokes import CANVAS_HEIGHT, CANVAS_WIDTH
+
+
+class CanvasSession:
+    """A client's canvas as a BGR image on black, like a decoded save."""
+
+    def __init__(self, width=CANVAS_WIDTH, height=CANVAS_HEIGHT):
+        self.width = width
+        self.height = height
+        self.image = np.zeros((height, width, 3), np.uint8)
+        self.seq = -1
+        self.patches = 0
+        self._lock = threading.Lock()
+
+    def apply_patch(self, seq, x, y, patch_bytes):
+        """
+        Paste an encoded patch at (x, y). Returns False for a patch older
+        than the canvas state, e.g. one overtaken by a clear.
+        """
+        for name, value in (('seq', seq), ('x', x), ('y', y)):
+            if not isinstance(value, int) or value < 0:
+                raise ValueError(f"Invalid patch {name}")
+        if not isinstance(patch_bytes, (bytes, bytearray, memoryview)):
+            raise ValueError("Invalid patch data")
+
+        patch = cv2.imdecode(np.frombuffer(patch_bytes, np.uint8),
+                             cv2.IMREAD_COLOR)
+        if patch is None:
+            raise ValueError("Invalid patch image")
+        height, width = patch.shape[:2]
+        if x + width > self.width or y + height > self.height:
+            raise ValueError("Patch outside of canvas")
+
+        with self._lock:
+            if seq <= self.seq:
+                return False
+            self.image[y:y + height, x:x + width] = patch
+            self.seq = seq
+            self.patches += 1
+            return True
+
+    def clear(self, seq):
+        with self._lock:
+            if seq is not None and seq <= self.seq:
+                return
+            self.image[:] = 0
+            if seq is not None:
+                self.seq = seq
+            self.patches = 0
+
+    def snapshot(self, seq, flip_horizontal=False):
+        """
+        Copy of the canvas as of patch seq, mirrored in the same pass if
+        flip_horizontal. Raises ValueError if the server has not seen
+        exactly that state.
+        """
+        with self._lock:
+            if seq != self.seq:
+                raise ValueError(
+                    f"Canvas out of sync: client at {seq}, server at {self.seq}")
+            if not self.patches:
+                return None
+            if flip_horizontal:
+                return cv2.flip(self.image, 1)
+            return self.image.copy()
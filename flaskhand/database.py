@@ -1,69 +1,430 @@
 import sqlite3
 from datetime import datetime
+import base64
+import hashlib
 import json
+import os
+import threading
+
+from strokes import decode_strokes, encode_strokes
+
+
+def image_hash(image_bytes):
+    """Content address of an encoded image."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def image_mime_type(image_bytes):
+    """Sniff the MIME type of an encoded image from its magic bytes."""
+    if image_bytes[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    if image_bytes[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    return 'application/octet-stream'
+
+
+def image_dimensions(image_bytes):
+    """(width, height) from a PNG or WebP header, or None."""
+    if image_bytes[:8] == b'\x89PNG\r\n\x1a\n' and len(image_bytes) >= 24:
+        return (int.from_bytes(image_bytes[16:20], 'big'),
+                int.from_bytes(image_bytes[20:24], 'big'))
+    if image_mime_type(image_bytes) == 'image/webp' and len(image_bytes) >= 30:
+        chunk = image_bytes[12:16]
+        if chunk == b'VP8L':
+            bits = int.from_bytes(image_bytes[21:25], 'little')
+            return (bits & 0x3FFF) + 1, (bits >> 14 & 0x3FFF) + 1
+        if chunk == b'VP8X':
+            return (int.from_bytes(image_bytes[24:27], 'little') + 1,
+                    int.from_bytes(image_bytes[27:30], 'little') + 1)
+        if chunk == b'VP8 ':
+            return (int.from_bytes(image_bytes[26:28], 'little') & 0x3FFF,
+                    int.from_bytes(image_bytes[28:30], 'little') & 0x3FFF)
+    return None
+
+
+def to_image_bytes(image_data):
+    """Accept raw image bytes or a base64 string / data URL."""
+    if isinstance(image_data, (bytes, bytearray, memoryview)):
+        return bytes(image_data)
+    # Remove the data:image/png;base64 prefix if present
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data)
+
+
+# Applied to every pooled connection. WAL lets gallery reads run while a
+# save is being written; with WAL, synchronous=NORMAL only risks the last
+# commits on power loss, never corruption.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),  # KiB, so 16 MB of page cache per connection
+    ('mmap_size', 64 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),
+)
+
+# Compiled statements kept per connection, keyed by SQL text
+STATEMENT_CACHE_SIZE = 128
+
+
+def connect(db_path, pragmas=PRAGMAS):
+    conn = sqlite3.connect(db_path, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    for name, value in pragmas:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def create_tables(conn):
+    """Create or upgrade the schema; returns whether legacy images remain."""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS drawings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        image_hash TEXT,
+        gemini_analysis TEXT,
+        timestamp DATETIME,
+        analysis_status TEXT,
+        stroke_data BLOB
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS images (
+        hash TEXT PRIMARY KEY,
+        data BLOB NOT NULL,
+        size INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS thumbnails (
+        image_hash TEXT PRIMARY KEY,
+        data BLOB NOT NULL,
+        mime_type TEXT NOT NULL
+    )
+    ''')
+    # Backs keyset pagination of the gallery, newest first
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_drawings_timestamp_id '
+        'ON drawings (timestamp DESC, id DESC)')
+
+    # Databases from before the images table, background analysis and
+    # binary strokes lack columns
+    cursor.execute('PRAGMA table_info(drawings)')
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'image_hash' not in columns:
+        cursor.execute('ALTER TABLE drawings ADD COLUMN image_hash TEXT')
+    if 'analysis_status' not in columns:
+        cursor.execute(
+            'ALTER TABLE drawings ADD COLUMN analysis_status TEXT')
+    if 'stroke_data' not in columns:
+        cursor.execute('ALTER TABLE drawings ADD COLUMN stroke_data BLOB')
+    conn.commit()
+    return 'image_data' in columns
+
+
+class ConnectionPool:
+    """
+    Reusable connections to one database file.
+
+    The schema is set up once, when the pool is created. acquire() hands
+    out an idle connection or opens a new one, so callers never wait on the
+    pool itself; at most max_idle connections are kept open for reuse, each
+    with its prepared statements still cached.
+    """
+
+    def __init__(self, db_path, max_idle=8, pragmas=PRAGMAS):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.pragmas = pragmas
+        self.opened = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+        conn = self._connect()
+        self.has_legacy_images = create_tables(conn)
+        self.release(conn)
+
+    def _connect(self):
+        conn = connect(self.db_path, self.pragmas)
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def release(self, conn):
+        # Never hand a half-finished transaction to the next caller
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path='drawings.db', max_idle=8):
+    """The process-wide pool for db_path, created on first use."""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(db_path, max_idle)
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
 
 
 class DrawingDatabase:
-    def __init__(self):
-        self.conn = sqlite3.connect('drawings.db', check_same_thread=False)
-        self.create_tables()
+    """
+    Drawing metadata plus content-addressed image blobs.
 
-    def create_tables(self):
+    Encoded images live once per SHA-256 hash in the images table; drawings
+    only reference them. Databases created before this layout still carry
+    base64 PNGs in drawings.image_data, which are read as a fallback until
+    migrate_legacy_images() has moved them over.
+
+    Instances are cheap: they borrow a connection from the shared pool for
+    db_path and close() gives it back.
+    """
+
+    def __init__(self, db_path='drawings.db', pool=None):
+        self.pool = pool if pool is not None else get_pool(db_path)
+        self.conn = self.pool.acquire()
+        self.has_legacy_images = self.pool.has_legacy_images
+
+    def store_image(self, image_bytes):
+        """Store an encoded image once and return its hash."""
+        digest = image_hash(image_bytes)
+        self.conn.execute(
+            'INSERT OR IGNORE INTO images (hash, data, size) VALUES (?, ?, ?)',
+            (digest, sqlite3.Binary(image_bytes), len(image_bytes))
+        )
+        return digest
+
+    def get_image(self, digest):
         cursor = self.conn.cursor()
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS drawings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            image_data TEXT,
-            gemini_analysis TEXT,
-            timestamp DATETIME
+        cursor.execute('SELECT data FROM images WHERE hash = ?', (digest,))
+        row = cursor.fetchone()
+        return bytes(row[0]) if row else None
+
+    def store_thumbnail(self, digest, thumbnail, mime_type):
+        self.conn.execute(
+            'INSERT OR IGNORE INTO thumbnails (image_hash, data, mime_type) VALUES (?, ?, ?)',
+            (digest, sqlite3.Binary(thumbnail), mime_type)
         )
-        ''')
         self.conn.commit()
 
-    def save_drawing(self, image_data, gemini_analysis=None):
+    def get_thumbnail(self, digest):
+        """Return (data, mime_type) of an image's thumbnail, or None."""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT data, mime_type FROM thumbnails WHERE image_hash = ?',
+            (digest,))
+        row = cursor.fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def save_drawing(self, image_data, gemini_analysis=None, strokes=None,
+                     thumbnail=None, analysis_status=None):
+        """
+        Save a drawing. strokes are encoded stroke data or a list of stroke
+        dicts to encode. thumbnail, if given, is a (data, mime_type) pair
+        generated from the same image. analysis_status is 'pending' when an
+        analysis job will fill in gemini_analysis later.
+        """
+        if strokes and not isinstance(strokes, (bytes, bytearray)):
+            strokes = encode_strokes(strokes)
         cursor = self.conn.cursor()
-        # Remove the data:image/png;base64 prefix if present
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
+        digest = self.store_image(to_image_bytes(image_data))
+        if thumbnail is not None:
+            cursor.execute(
+                'INSERT OR IGNORE INTO thumbnails (image_hash, data, mime_type) VALUES (?, ?, ?)',
+                (digest, sqlite3.Binary(thumbnail[0]), thumbnail[1])
+            )
 
         cursor.execute(
-            'INSERT INTO drawings (image_data, gemini_analysis, timestamp) VALUES (?, ?, ?)',
-            (image_data, json.dumps(gemini_analysis)
-             if gemini_analysis else None, datetime.now())
+            'INSERT INTO drawings (image_hash, gemini_analysis, timestamp, stroke_data, analysis_status) VALUES (?, ?, ?, ?, ?)',
+            (digest, json.dumps(gemini_analysis)
+             if gemini_analysis else None, datetime.now(),
+             sqlite3.Binary(strokes) if strokes else None, analysis_status)
         )
         self.conn.commit()
         return cursor.lastrowid
 
-    def get_all_drawings(self):
+    def update_analysis(self, drawing_id, status, analysis=None):
+        """Record an analysis job's status and, once done, its result."""
+        self.conn.execute(
+            'UPDATE drawings SET analysis_status = ?, '
+            'gemini_analysis = COALESCE(?, gemini_analysis) WHERE id = ?',
+            (status, json.dumps(analysis) if analysis else None, drawing_id)
+        )
+        self.conn.commit()
+
+    def get_pending_analyses(self):
+        """(id, image_hash) of drawings whose analysis never finished."""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT id, image_hash FROM drawings "
+            "WHERE analysis_status IN ('pending', 'running') ORDER BY id")
+        return cursor.fetchall()
+
+    def _drawing_columns(self, include_image=True, include_strokes=False):
+        image = 'i.data' if include_image else 'NULL'
+        legacy = 'd.image_data' \
+            if self.has_legacy_images and include_image else 'NULL'
+        strokes = 'd.stroke_data' if include_strokes else 'NULL'
+        return (f'd.id, d.image_hash, {image}, {legacy}, d.gemini_analysis, '
+                f'd.timestamp, {strokes}, d.analysis_status')
+
+    def _parse_drawing(self, row):
+        (drawing_id, digest, data, legacy_data, analysis, timestamp,
+         stroke_data, analysis_status) = row
+        image_data = base64.b64encode(data).decode('utf-8') \
+            if data is not None else legacy_data
+        return {
+            'id': drawing_id,
+            'image_hash': digest,
+            'image_data': image_data,
+            'analysis': json.loads(analysis) if analysis else None,
+            'timestamp': timestamp,
+            'strokes': decode_strokes(bytes(stroke_data))
+            if stroke_data is not None else None,
+            'analysis_status': analysis_status
+        }
+
+    def get_all_drawings(self, include_strokes=False):
         cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM drawings ORDER BY timestamp DESC')
-        drawings = cursor.fetchall()
-
-        # Parse JSON gemini_analysis back to string
-        parsed_drawings = []
-        for drawing in drawings:
-            gemini_analysis = json.loads(drawing[2]) if drawing[2] else None
-            parsed_drawings.append({
-                'id': drawing[0],
-                'image_data': drawing[1],
-                'analysis': gemini_analysis,
-                'timestamp': drawing[3]
-            })
-        return parsed_drawings
-
-    def get_drawing(self, drawing_id):
+        cursor.execute(
+            f'SELECT {self._drawing_columns(include_strokes=include_strokes)} '
+            'FROM drawings d '
+            'LEFT JOIN images i ON i.hash = d.image_hash '
+            'ORDER BY d.timestamp DESC')
+        return [self._parse_drawing(row) for row in cursor.fetchall()]
+
+    def list_drawings(self, limit=24, before=None):
+        """
+        One page of drawing metadata, newest first, without image data.
+
+        before is the id of the last drawing on the previous page. Returns
+        (drawings, next_before) where next_before is None on the last page.
+        """
         cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM drawings WHERE id = ?', (drawing_id,))
+        query = ('SELECT id, image_hash, timestamp, '
+                 'gemini_analysis IS NOT NULL FROM drawings')
+        params = []
+        if before is not None:
+            query += (' WHERE (timestamp, id) < '
+                      '(SELECT timestamp, id FROM drawings WHERE id = ?)')
+            params.append(before)
+        query += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+        drawings = [{
+            'id': row[0],
+            'image_hash': row[1],
+            'timestamp': row[2],
+            'has_analysis': bool(row[3])
+        } for row in rows[:limit]]
+        next_before = drawings[-1]['id'] if len(rows) > limit else None
+        return drawings, next_before
+
+    def get_image_info(self, drawing_id):
+        """Image hash and timestamp of a drawing, without loading the image."""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT image_hash, timestamp FROM drawings WHERE id = ?',
+                       (drawing_id,))
+        row = cursor.fetchone()
+        return {'image_hash': row[0], 'timestamp': row[1]} if row else None
+
+    def get_stroke_data(self, drawing_id):
+        """Encoded strokes of a drawing, or None if it has none."""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT stroke_data FROM drawings WHERE id = ?',
+                       (drawing_id,))
+        row = cursor.fetchone()
+        return bytes(row[0]) if row and row[0] is not None else None
+
+    def get_drawing(self, drawing_id, include_image=True,
+                    include_strokes=False):
+        """A drawing's row; strokes are decoded only with include_strokes."""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f'SELECT {self._drawing_columns(include_image, include_strokes)} '
+            'FROM drawings d '
+            'LEFT JOIN images i ON i.hash = d.image_hash WHERE d.id = ?',
+            (drawing_id,))
         drawing = cursor.fetchone()
 
         if drawing:
-            return {
-                'id': drawing[0],
-                'image_data': drawing[1],
-                'analysis': json.loads(drawing[2]) if drawing[2] else None,
-                'timestamp': drawing[3]
-            }
+            return self._parse_drawing(drawing)
         return None
 
+    def migrate_legacy_images(self, batch_size=100):
+        """
+        Move base64 image_data into the images table in batches.
+
+        Yields the number of drawings converted per batch. Once every row is
+        converted the image_data column is dropped and the file vacuumed.
+        """
+        if not self.has_legacy_images:
+            return
+
+        cursor = self.conn.cursor()
+        last_id = 0
+        while True:
+            cursor.execute(
+                'SELECT id, image_data FROM drawings '
+                'WHERE id > ? AND image_data IS NOT NULL ORDER BY id LIMIT ?',
+                (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            for drawing_id, image_data in rows:
+                digest = self.store_image(to_image_bytes(image_data))
+                cursor.execute(
+                    'UPDATE drawings SET image_hash = ?, image_data = NULL '
+                    'WHERE id = ?', (digest, drawing_id))
+            self.conn.commit()
+            last_id = rows[-1][0]
+            yield len(rows)
+
+        try:
+            cursor.execute('ALTER TABLE drawings DROP COLUMN image_data')
+            self.conn.commit()
+            self.has_legacy_images = False
+            self.pool.has_legacy_images = False
+        except sqlite3.OperationalError:
+            # SQLite < 3.35 can't drop columns; the emptied one stays behind
+            pass
+        self.conn.execute('VACUUM')
+
     def close(self):
-        self.conn.close()
+        if self.conn is not None:
+            self.pool.release(self.conn)
+            self.conn = None
@@ -1,24 +1,180 @@
-import google.generativeai as genai
-from PIL import Image
-import io
 import base64
+import hashlib
+import heapq
+import itertools
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from database import image_dimensions, image_mime_type
+from metrics import GEMINI_REQUESTS, STAGE_SECONDS
+
+PROMPT = """
+            Analyze this hand-drawn image and provide:
+            1. A description of what's drawn
+            2. Identify any geometric shapes, patterns, or symbols
+            3. If there are any mathematical expressions, solve them
+            4. Provide any insights about the drawing style or technique
+            Keep the analysis concise but informative.
+            """
+
+# Cached analyses are only reused for the prompt that produced them
+PROMPT_VERSION = hashlib.sha256(PROMPT.encode('utf-8')).hexdigest()[:12]
+
+BATCH_PROMPT = PROMPT + """
+            You are given {count} separate drawings. Analyze each one on its
+            own and start each analysis with a line "### Drawing N", where N
+            is the position of the drawing, counting from 1.
+            """
+
+BATCH_HEADER = re.compile(r'^#+\s*Drawing\s+(\d+)\s*:?\s*$', re.MULTILINE)
+
+
+class QuotaExceededError(Exception):
+    """The model refused a request because a rate limit or quota was hit."""
+
+
+class BatchResponseError(ValueError):
+    """A batched response could not be split into one analysis per drawing."""
+
+
+def is_quota_error(error):
+    """
+    True for 429 / resource-exhausted errors from the API or the stub,
+    judged by exception type or HTTP status, never by message text.
+    """
+    if isinstance(error, QuotaExceededError):
+        return True
+    # google.api_core.exceptions, matched by name since the SDK is optional
+    if any(cls.__name__ in ('ResourceExhausted', 'TooManyRequests')
+           for cls in type(error).__mro__):
+        return True
+    return 429 in (getattr(error, 'code', None),
+                   getattr(error, 'status_code', None))
+
+
+def image_part(image_bytes):
+    """
+    Inline request part for encoded image bytes. The API takes PNG and
+    WebP as they are, so nothing is decoded or re-encoded to send them.
+    """
+    return {'mime_type': image_mime_type(image_bytes), 'data': image_bytes}
+
+
+def split_batch_response(text, count):
+    """Split a batched response into count analyses, in drawing order."""
+    parts = BATCH_HEADER.split(text)
+    analyses = {}
+    for number, body in zip(parts[1::2], parts[2::2]):
+        analyses[int(number)] = body.strip()
+    if sorted(analyses) != list(range(1, count + 1)):
+        raise BatchResponseError(
+            f"Expected {count} analyses, got sections {sorted(analyses)}")
+    return [analyses[number] for number in range(1, count + 1)]
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """
+    Local stand-in for genai.GenerativeModel, for tests and offline runs.
+
+    Each call sleeps latency plus per_image_latency for every image. With
+    requests_per_minute set, calls beyond that rate within a sliding minute
+    raise QuotaExceededError like the real API's 429s.
+    """
+
+    def __init__(self, latency=0.0, per_image_latency=0.0,
+                 requests_per_minute=None):
+        self.latency = latency
+        self.per_image_latency = per_image_latency
+        self.requests_per_minute = requests_per_minute
+        self.calls = 0
+        self.quota_errors = 0
+        self._lock = threading.Lock()
+        self._recent = deque()
+
+    def _check_quota(self):
+        if not self.requests_per_minute:
+            return
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.requests_per_minute:
+                self.quota_errors += 1
+                raise QuotaExceededError(
+                    "429 Resource has been exhausted (e.g. check quota).")
+            self._recent.append(now)
+
+    def generate_content(self, contents):
+        with self._lock:
+            self.calls += 1
+        self._check_quota()
+        images = [part['data'] for part in contents if isinstance(part, dict)]
+        time.sleep(self.latency + self.per_image_latency * len(images))
+
+        def describe(image_bytes):
+            size = image_dimensions(image_bytes)
+            size = f"{size[0]}x{size[1]} " if size else ''
+            return f"Stub analysis of a {size}drawing."
+
+        if len(images) == 1:
+            return StubResponse(describe(images[0]))
+        return StubResponse('\n'.join(
+            f"### Drawing {number}\n{describe(image_bytes)}"
+            for number, image_bytes in enumerate(images, 1)))
 
 
 class GeminiHelper:
-    def __init__(self, api_key=None):
+    prompt_version = PROMPT_VERSION
+
+    def __init__(self, api_key=None, model=None):
         self.api_key = api_key
-        self.model = None
-        if api_key:
+        self.model = model
+        if api_key and model is None:
             self.setup_model()
 
     def setup_model(self):
         try:
+            # The SDK is only imported when a key is configured
+            import google.generativeai as genai
             genai.configure(api_key=self.api_key)
             self.model = genai.GenerativeModel('gemini-2.0-flash')
         except Exception as e:
             print(f"Error setting up Gemini model: {e}")
             self.model = None
 
+    @property
+    def enabled(self):
+        return self.model is not None
+
+    def analyze(self, image_bytes):
+        """Analyze encoded image bytes; errors are raised to the caller."""
+        if not self.model:
+            raise RuntimeError("Gemini API key not configured")
+
+        response = self.model.generate_content([PROMPT, image_part(image_bytes)])
+        return response.text
+
+    def analyze_batch(self, images_bytes):
+        """
+        Analyze several drawings in one request, returning one analysis
+        per image. Raises BatchResponseError if the reply can't be split.
+        """
+        if not self.model:
+            raise RuntimeError("Gemini API key not configured")
+
+        parts = [image_part(image_bytes) for image_bytes in images_bytes]
+        response = self.model.generate_content(
+            [BATCH_PROMPT.format(count=len(parts)), *parts])
+        return split_batch_response(response.text, len(parts))
+
     def analyze_image(self, image_data):
         if not self.model:
             return "Gemini API key not configured"
@@ -28,21 +184,224 @@ class GeminiHelper:
             if ',' in image_data:
                 image_data = image_data.split(',')[1]
 
-            # Convert base64 to PIL Image
+            # Convert base64 to bytes
             image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
-
-            prompt = """
-            Analyze this hand-drawn image and provide:
-            1. A description of what's drawn
-            2. Identify any geometric shapes, patterns, or symbols
-            3. If there are any mathematical expressions, solve them
-            4. Provide any insights about the drawing style or technique
-            Keep the analysis concise but informative.
-            """
-
-            response = self.model.generate_content([prompt, image])
-            return response.text
+            return self.analyze(image_bytes)
         except Exception as e:
             print(f"Error analyzing image: {e}")
             return f"Error analyzing image: {str(e)}"
+
+
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens per second, up to capacity."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self._lock:
+                self._refill_locked()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back every caller for about seconds, e.g. after a 429."""
+        with self._lock:
+            self._refill_locked()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class _Request:
+    __slots__ = ('digest', 'image_bytes', 'future')
+
+    def __init__(self, digest, image_bytes):
+        self.digest = digest
+        self.image_bytes = image_bytes
+        self.future = Future()
+
+
+class AnalysisScheduler:
+    """
+    Rate-limited front end to a GeminiHelper shared by all analysis jobs.
+
+    Requests wait in a priority queue (lower number first) and every model
+    call takes a token from a TokenBucket sized to the API quota. Requests
+    for an image already queued or in flight share its result instead of
+    calling the model again. Requests that piled up while waiting for a
+    token are sent together in one batched call of up to max_batch images.
+    A quota error empties the bucket for quota_backoff seconds and is
+    raised to the caller, whose retry then waits for the bucket.
+    """
+
+    def __init__(self, helper, requests_per_minute=15, burst=3, max_batch=4,
+                 concurrency=2, quota_backoff=30.0):
+        self.helper = helper
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self.max_batch = max_batch
+        self.quota_backoff = quota_backoff
+        self.stats = {
+            'requests': 0,
+            'coalesced': 0,
+            'api_calls': 0,
+            'batched_calls': 0,
+            'batch_fallbacks': 0,
+            'quota_errors': 0,
+            'errors': 0,
+        }
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._inflight = {}
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._dispatch, daemon=True,
+                             name=f'gemini-scheduler-{index}')
+            for index in range(concurrency)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def enabled(self):
+        return self.helper.enabled
+
+    @property
+    def prompt_version(self):
+        return self.helper.prompt_version
+
+    def submit(self, image_bytes, priority=10):
+        """Queue an analysis and return a Future of its text."""
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Scheduler is shut down")
+            self.stats['requests'] += 1
+            request = self._inflight.get(digest)
+            if request is not None:
+                self.stats['coalesced'] += 1
+                return request.future
+
+            request = _Request(digest, image_bytes)
+            self._inflight[digest] = request
+            heapq.heappush(self._heap,
+                           (priority, next(self._sequence), request))
+            self._cond.notify()
+        return request.future
+
+    def analyze(self, image_bytes, priority=10, timeout=None):
+        """Blocking analyze(), so the scheduler can stand in for the helper."""
+        return self.submit(image_bytes, priority).result(timeout)
+
+    def _take(self, count, block):
+        with self._cond:
+            while block and not self._heap and not self._closed:
+                self._cond.wait()
+            taken = []
+            while self._heap and len(taken) < count:
+                taken.append(heapq.heappop(self._heap)[2])
+            return taken
+
+    def _dispatch(self):
+        while True:
+            batch = self._take(1, block=True)
+            if not batch:
+                return
+            self.bucket.acquire()
+            # Whatever queued up while we waited for the token rides along
+            if self.max_batch > 1:
+                batch += self._take(self.max_batch - 1, block=False)
+            self._call(batch)
+
+    def _request(self, method, payload):
+        """One model call through the helper, timed and counted."""
+        self._count('api_calls')
+        start = time.perf_counter()
+        try:
+            result = method(payload)
+        except BatchResponseError:
+            GEMINI_REQUESTS.inc(result='unparseable')
+            raise
+        except Exception as e:
+            GEMINI_REQUESTS.inc(result='quota' if is_quota_error(e) else 'error')
+            raise
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start,
+                                  stage='gemini_call')
+        GEMINI_REQUESTS.inc(result='ok')
+        return result
+
+    def _call(self, batch):
+        try:
+            if len(batch) == 1:
+                self._finish(batch[0], self._request(
+                    self.helper.analyze, batch[0].image_bytes))
+                return
+            try:
+                self._count('batched_calls')
+                analyses = self._request(
+                    self.helper.analyze_batch,
+                    [request.image_bytes for request in batch])
+            except BatchResponseError as e:
+                print(f"Batched Gemini response unusable, retrying singly: {e}")
+                self._count('batch_fallbacks')
+                for request in batch:
+                    self.bucket.acquire()
+                    self._finish(request, self._request(
+                        self.helper.analyze, request.image_bytes))
+                return
+            for request, analysis in zip(batch, analyses):
+                self._finish(request, analysis)
+        except Exception as e:
+            if is_quota_error(e):
+                self._count('quota_errors')
+                self.bucket.pause(self.quota_backoff)
+            else:
+                self._count('errors')
+            for request in batch:
+                if not request.future.done():
+                    self._finish(request, error=e)
+
+    def _finish(self, request, analysis=None, error=None):
+        with self._cond:
+            self._inflight.pop(request.digest, None)
+        if error is not None:
+            request.future.set_exception(error)
+        else:
+            request.future.set_result(analysis)
+
+    def _count(self, key):
+        with self._cond:
+            self.stats[key] += 1
+
+    def snapshot(self):
+        with self._cond:
+            return dict(self.stats, queued=len(self._heap),
+                        inflight=len(self._inflight))
+
+    def shutdown(self, wait=True):
+        """Stop dispatching; queued requests fail with RuntimeError."""
+        with self._cond:
+            self._closed = True
+            pending = [item[2] for item in self._heap]
+            self._heap.clear()
+            self._cond.notify_all()
+        for request in pending:
+            self._finish(request, error=RuntimeError("Scheduler is shut down"))
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -1,25 +1,253 @@
+import math
+import time
+
 import cv2
-import mediapipe as mp
 import numpy as np
 
+_mp_hands = None
+
+
+def mediapipe_hands():
+    """MediaPipe's hands solution, imported on first use (it loads slowly)."""
+    global _mp_hands
+    if _mp_hands is None:
+        import mediapipe as mp
+        _mp_hands = mp.solutions.hands
+    return _mp_hands
+
+
+class OneEuroFilter:
+    """
+    One-Euro low-pass filter for a 2D point.
+
+    Jitter is smoothed heavily while the point is slow, and the cutoff rises
+    with speed so fast strokes don't lag (Casiez et al., CHI 2012).
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=5.0, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.velocity = np.zeros(2)
+        self.timestamp = None
+
+    @staticmethod
+    def _alpha(dt, cutoff):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, timestamp, point):
+        point = np.asarray(point, dtype=float)
+        if self.value is None:
+            self.value = point
+            self.timestamp = timestamp
+            return self.value
+
+        dt = timestamp - self.timestamp
+        if dt <= 0:
+            return self.value
+
+        alpha_d = self._alpha(dt, self.d_cutoff)
+        velocity = (point - self.value) / dt
+        self.velocity = alpha_d * velocity + (1 - alpha_d) * self.velocity
+
+        cutoff = self.min_cutoff + self.beta * np.linalg.norm(self.velocity)
+        alpha = self._alpha(dt, cutoff)
+        self.value = alpha * point + (1 - alpha) * self.value
+        self.timestamp = timestamp
+        return self.value
+
+
+class PointerSmoother:
+    """
+    Filters thumb and index positions and predicts them between inferences.
+
+    Positions are normalized to the frame so they survive resolution changes.
+    Predictions extrapolate the filtered velocity for at most max_prediction
+    seconds past the last observation.
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=5.0, max_prediction=0.15):
+        self.max_prediction = max_prediction
+        self.filters = [OneEuroFilter(min_cutoff, beta),
+                        OneEuroFilter(min_cutoff, beta)]
+
+    @property
+    def has_hand(self):
+        return self.filters[0].value is not None
+
+    def update(self, timestamp, thumb_pos, index_pos):
+        if thumb_pos is None or index_pos is None:
+            for point_filter in self.filters:
+                point_filter.reset()
+            return None, None
+        return tuple(point_filter(timestamp, point) for point_filter, point
+                     in zip(self.filters, (thumb_pos, index_pos)))
+
+    def predict(self, timestamp):
+        if not self.has_hand:
+            return None, None
+        return tuple(
+            point_filter.value + point_filter.velocity * min(
+                max(timestamp - point_filter.timestamp, 0), self.max_prediction)
+            for point_filter in self.filters)
+
 
 class HandTracker:
-    def __init__(self):
-        self.mp_hands = mp.solutions.hands
+    def __init__(self, roi_mode=False, roi_padding=0.75, roi_max_side=256,
+                 roi_min_side=96, smoothing=False, inference_hz=None,
+                 model_complexity=1, min_detection_confidence=0.7,
+                 min_tracking_confidence=0.7):
+        self.mp_hands = mediapipe_hands()
+        # model_complexity 0 is the lighter landmark model, 1 the full one
         self.hands = self.mp_hands.Hands(
             static_image_mode=False,
             max_num_hands=1,
-            min_detection_confidence=0.7,
-            min_tracking_confidence=0.7
+            model_complexity=model_complexity,
+            min_detection_confidence=min_detection_confidence,
+            min_tracking_confidence=min_tracking_confidence
         )
+        # ROI mode: after a detection, only a padded box around the last
+        # landmarks is fed to MediaPipe, downscaled to roi_max_side. Crops
+        # get their own graph: MediaPipe tracks from the previous frame's
+        # landmarks in normalized image coordinates, which differ between a
+        # crop and the full frame
+        self.roi_hands = self.mp_hands.Hands(
+            static_image_mode=False,
+            max_num_hands=1,
+            model_complexity=model_complexity,
+            min_detection_confidence=min_detection_confidence,
+            min_tracking_confidence=min_tracking_confidence
+        ) if roi_mode else None
+        self.roi_mode = roi_mode
+        self.roi_padding = roi_padding
+        self.roi_max_side = roi_max_side
+        self.roi_min_side = roi_min_side
+        self.roi = None
+
+        # Smoothing filters the pointer; inference_hz caps how often MediaPipe
+        # runs, frames in between are answered with predicted positions
+        self.smoothing = smoothing
+        self.inference_hz = inference_hz
+        self.smoother = PointerSmoother()
+        self.last_inference = None
+        self.last_frame_shape = None
+        # Seconds per stage of the last process_frame call
+        self.timings = {}
+
+    def configure(self, smoothing=None, inference_hz=None):
+        if smoothing is not None:
+            self.smoothing = smoothing
+        if inference_hz is not None:
+            # 0 means run inference on every frame
+            self.inference_hz = inference_hz or None
+
+    def needs_inference(self, timestamp):
+        if not self.inference_hz or self.last_inference is None:
+            return True
+        return timestamp - self.last_inference >= 1.0 / self.inference_hz
+
+    def predict_hand_data(self, timestamp):
+        """Hand data for a frame skipped by the inference rate limit."""
+        thumb_pos, index_pos = self.smoother.predict(timestamp)
+        return self._encode_hand_data(thumb_pos, index_pos,
+                                      self.last_frame_shape, predicted=True)
+
+    def _encode_hand_data(self, thumb_pos, index_pos, frame_shape,
+                          predicted=False):
+        if thumb_pos is None or index_pos is None:
+            return {
+                'has_hand': False,
+                'thumb_pos': None,
+                'index_pos': None,
+                'predicted': predicted
+            }
+
+        height, width = frame_shape[:2]
+
+        def to_pixels(point):
+            return (int(point[0] * width), int(point[1] * height))
+
+        return {
+            'has_hand': True,
+            'thumb_pos': to_pixels(thumb_pos),
+            'index_pos': to_pixels(index_pos),
+            'frame_size': (width, height),
+            'predicted': predicted
+        }
+
+    def _timed(self, stage, func, *args, **kwargs):
+        """Call func, adding its duration to self.timings[stage]."""
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.timings[stage] = self.timings.get(stage, 0.0) + \
+            time.perf_counter() - start
+        return result
 
     def process_frame(self, frame):
+        self.timings = {}
+        if self.roi_mode and self.roi is not None:
+            results = self._process_roi(frame)
+            if results.multi_hand_landmarks:
+                self._update_roi(results, frame.shape)
+                return results
+
         # Convert the BGR image to RGB
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        frame_rgb = self._timed('cvt_color', cv2.cvtColor,
+                                frame, cv2.COLOR_BGR2RGB)
         # Process the frame and detect hands
-        results = self.hands.process(frame_rgb)
+        results = self._timed('inference', self.hands.process, frame_rgb)
+        if self.roi_mode:
+            self._update_roi(results, frame.shape)
+        return results
+
+    def _process_roi(self, frame):
+        """Run MediaPipe on the ROI crop; landmarks come back full-frame."""
+        x0, y0, x1, y1 = self.roi
+        crop = frame[y0:y1, x0:x1]
+        scale = self.roi_max_side / max(crop.shape[:2])
+        if scale < 1:
+            crop = self._timed('resize', cv2.resize, crop, None,
+                               fx=scale, fy=scale,
+                               interpolation=cv2.INTER_AREA)
+
+        crop_rgb = self._timed('cvt_color', cv2.cvtColor,
+                               crop, cv2.COLOR_BGR2RGB)
+        results = self._timed('inference', self.roi_hands.process, crop_rgb)
+        if results.multi_hand_landmarks:
+            # Normalized crop coordinates don't depend on the downscale
+            height, width = frame.shape[:2]
+            for hand_landmarks in results.multi_hand_landmarks:
+                for landmark in hand_landmarks.landmark:
+                    landmark.x = (x0 + landmark.x * (x1 - x0)) / width
+                    landmark.y = (y0 + landmark.y * (y1 - y0)) / height
         return results
 
+    def _update_roi(self, results, frame_shape):
+        """Center a padded square box on the detected hand, or clear it."""
+        if not results.multi_hand_landmarks:
+            self.roi = None
+            return
+
+        height, width = frame_shape[:2]
+        landmarks = results.multi_hand_landmarks[0].landmark
+        xs = [landmark.x * width for landmark in landmarks]
+        ys = [landmark.y * height for landmark in landmarks]
+        side = max(max(xs) - min(xs), max(ys) - min(ys))
+        side = max(side * (1 + 2 * self.roi_padding), self.roi_min_side)
+        center_x = (max(xs) + min(xs)) / 2
+        center_y = (max(ys) + min(ys)) / 2
+
+        x0 = max(int(center_x - side / 2), 0)
+        y0 = max(int(center_y - side / 2), 0)
+        x1 = min(int(center_x + side / 2), width)
+        y1 = min(int(center_y + side / 2), height)
+        self.roi = (x0, y0, x1, y1) if x1 > x0 and y1 > y0 else None
+
     def get_finger_positions(self, results, frame_shape):
         if not results.multi_hand_landmarks:
             return None, None
@@ -39,23 +267,42 @@ class HandTracker:
 
         return thumb_pos, index_pos
 
-    def process_and_encode_frame(self, frame):
+    def process_and_encode_frame(self, frame, timestamp=None):
         """Process a frame and return hand tracking data"""
+        timestamp = time.monotonic() if timestamp is None else timestamp
         try:
             # Process the frame
             results = self.process_frame(frame)
             frame_shape = frame.shape
+            self.last_inference = timestamp
+            self.last_frame_shape = frame_shape
 
             # Get finger positions
             thumb_pos, index_pos = self.get_finger_positions(
                 results, frame_shape)
 
             # Return processed data
-            return {
+            hand_data = {
                 'has_hand': thumb_pos is not None and index_pos is not None,
                 'thumb_pos': thumb_pos,
-                'index_pos': index_pos
+                'index_pos': index_pos,
+                'frame_size': (frame_shape[1], frame_shape[0])
             }
+            if not (self.smoothing or self.inference_hz):
+                return hand_data
+
+            # Filter in normalized coordinates; the filter also tracks the
+            # velocity used to predict skipped frames
+            if hand_data['has_hand']:
+                height, width = frame_shape[:2]
+                thumb_pos = (thumb_pos[0] / width, thumb_pos[1] / height)
+                index_pos = (index_pos[0] / width, index_pos[1] / height)
+            thumb_pos, index_pos = self.smoother.update(
+                timestamp, thumb_pos, index_pos)
+            if not self.smoothing:
+                hand_data['predicted'] = False
+                return hand_data
+            return self._encode_hand_data(thumb_pos, index_pos, frame_shape)
         except Exception as e:
             print(f"Error processing frame in hand tracker: {e}")
             return {
@@ -63,3 +310,9 @@ class HandTracker:
                 'thumb_pos': None,
                 'index_pos': None
             }
+
+    def close(self):
+        """Release the MediaPipe graphs held by this tracker."""
+        self.hands.close()
+        if self.roi_hands is not None:
+            self.roi_hands.close()
@@ -0,0 +1,64 @@
+"""
+Decoding and encoding of saved drawings.
+
+A save decodes its image at most once into a BGR array, which is flipped
+in place and then shared: it is encoded once for storage, downscaled for
+the thumbnail and hashed for the analysis cache. Gemini receives the
+stored bytes as they are, so nothing is decoded again for analysis.
+"""
+import cv2
+import numpy as np
+
+IMAGE_FORMATS = ('png', 'webp')
+
+
+def decode_image(image_bytes, flip_horizontal=False):
+    """Decode encoded image bytes to BGR, optionally mirrored in place."""
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8),
+                         cv2.IMREAD_COLOR)
+    if image is not None and flip_horizontal:
+        cv2.flip(image, 1, dst=image)
+    return image
+
+
+def encode_image(image, image_format='png', png_compression=1):
+    """
+    Encode a BGR image for storage; returns (bytes, mime_type).
+
+    'png' uses png_compression (0-9, OpenCV's default is 1); 'webp' is
+    lossless WebP, which is smaller for flat drawings but slower to write.
+    """
+    if image_format == 'webp':
+        # WebP quality above 100 selects lossless mode; builds without a
+        # WebP encoder fall back to PNG
+        try:
+            ok, buffer = cv2.imencode('.webp', image,
+                                      [cv2.IMWRITE_WEBP_QUALITY, 101])
+            if ok:
+                return buffer.tobytes(), 'image/webp'
+        except cv2.error:
+            pass
+    elif image_format != 'png':
+        raise ValueError(f"Unknown image format {image_format!r}")
+    ok, buffer = cv2.imencode('.png', image,
+                              [cv2.IMWRITE_PNG_COMPRESSION, png_compression])
+    if not ok:
+        raise ValueError("Failed to encode image")
+    return buffer.tobytes(), 'image/png'
+
+
+def make_thumbnail(image, max_side):
+    """Downscale a BGR image; returns (bytes, mime_type), WebP if available."""
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (int(width * scale), int(height * scale)),
+                           interpolation=cv2.INTER_AREA)
+    try:
+        ok, buffer = cv2.imencode('.webp', image, [cv2.IMWRITE_WEBP_QUALITY, 80])
+        if ok:
+            return buffer.tobytes(), 'image/webp'
+    except cv2.error:
+        pass
+    _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return buffer.tobytes(), 'image/jpeg'
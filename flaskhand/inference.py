@@ -0,0 +1,434 @@
+"""
+Pluggable inference backends for the process_frame handler.
+
+- inline:  decode and run MediaPipe on the Socket.IO handler thread
+- thread:  one worker thread per session, fed from a bounded frame queue
+- process: a pool of worker processes, each owning its own HandTrackers;
+           encoded frames are handed over through shared memory
+
+All backends keep one tracker per session and share the same interface,
+so INFERENCE_BACKEND can be switched to compare throughput on one box.
+A backend's process() returns (hand_data, timings) as produced by
+run_inference, or None when the frame was dropped because newer frames
+arrived for the same client.
+"""
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from tracker_pool import FrameQueue, PoolFullError, TrackerPool, run_inference
+
+
+# Imported once by the fork server; process workers fork from it with the
+# tracker stack already loaded instead of importing it from scratch
+FORKSERVER_PRELOAD = ['numpy', 'cv2', 'mediapipe', 'hand_tracker',
+                      'tracker_pool']
+
+
+def blank_frame(width=640, height=480):
+    """An encoded black frame, for warm-up inferences."""
+    _, buffer = cv2.imencode('.jpg', np.zeros((height, width, 3), np.uint8))
+    return buffer.tobytes()
+
+
+class InferenceBackend:
+    name = None
+    # Sessions needed for warm_up() to reach every tracker host
+    warm_up_sessions = 1
+
+    def process(self, sid, buffer):
+        raise NotImplementedError
+
+    def submit(self, sid, buffer):
+        """
+        Queue a frame without waiting for its result. Returns a
+        concurrent.futures.Future of what process() returns, or None if the
+        backend infers on the caller's thread and process() has to be used.
+        """
+        return None
+
+    def configure(self, sid, **options):
+        """
+        Change HandTracker.configure options for one session. A session
+        without a tracker keeps them until its first frame creates one.
+        """
+        raise NotImplementedError
+
+    def release(self, sid):
+        raise NotImplementedError
+
+    def evict_idle(self):
+        raise NotImplementedError
+
+    def queue_depth(self):
+        """Frames queued or in flight, for the metrics gauge."""
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def warm_up(self):
+        """
+        Run an inference on a blank frame, so MediaPipe is imported and its
+        models loaded before the first client connects. Returns the seconds
+        it took.
+        """
+        frame = blank_frame()
+        sids = [f'__warm_up_{index}' for index in range(self.warm_up_sessions)]
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(len(sids)) as executor:
+                list(executor.map(lambda sid: self.process(sid, frame), sids))
+        finally:
+            for sid in sids:
+                self.release(sid)
+        return time.perf_counter() - start
+
+    def start_reaper(self, interval):
+        """Start a daemon thread that periodically evicts idle sessions."""
+        def reap():
+            while True:
+                time.sleep(interval)
+                evicted = self.evict_idle()
+                if evicted:
+                    print(f"Evicted {evicted} idle inference session(s)")
+
+        thread = threading.Thread(target=reap, name='inference-reaper',
+                                  daemon=True)
+        thread.start()
+        return thread
+
+
+class InlineBackend(InferenceBackend):
+    name = 'inline'
+
+    def __init__(self, max_sessions=32, idle_timeout=60.0, frame_timeout=10.0,
+                 queue_size=2, tracker_options=None):
+        self.pool = TrackerPool(
+            max_size=max_sessions,
+            idle_timeout=idle_timeout,
+            frame_timeout=frame_timeout,
+            queue_size=queue_size,
+            tracker_options=tracker_options
+        )
+
+    @property
+    def frame_timeout(self):
+        return self.pool.frame_timeout
+
+    def process(self, sid, buffer):
+        return self.pool.acquire(sid).process(buffer)
+
+    def configure(self, sid, **options):
+        self.pool.configure(sid, **options)
+
+    def release(self, sid):
+        self.pool.release(sid)
+
+    def evict_idle(self):
+        return self.pool.evict_idle()
+
+    def queue_depth(self):
+        return self.pool.queue_depth()
+
+    def close(self):
+        self.pool.close()
+
+
+class ThreadBackend(InlineBackend):
+    name = 'thread'
+
+    def submit(self, sid, buffer):
+        return self.pool.acquire(sid).submit(buffer)
+
+    def process(self, sid, buffer):
+        return self.submit(sid, buffer).result(timeout=self.frame_timeout)
+
+
+def _worker_main(shm_name, slot_size, tasks, results, tracker_options):
+    """Entry point of a process-backend worker."""
+    from hand_tracker import HandTracker
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    trackers = {}
+    try:
+        while True:
+            message = tasks.get()
+            if message[0] == 'stop':
+                break
+            if message[0] == 'release':
+                tracker = trackers.pop(message[1], None)
+                if tracker is not None:
+                    tracker.close()
+                continue
+            if message[0] == 'configure':
+                _, sid, options = message
+                tracker = trackers.get(sid)
+                if tracker is None:
+                    tracker = trackers[sid] = HandTracker(**tracker_options)
+                tracker.configure(**options)
+                continue
+
+            _, job_id, sid, slot, length, payload = message
+            buffer = payload
+            try:
+                if buffer is None:
+                    buffer = np.frombuffer(shm.buf, np.uint8, count=length,
+                                           offset=slot * slot_size)
+                tracker = trackers.get(sid)
+                if tracker is None:
+                    tracker = trackers[sid] = HandTracker(**tracker_options)
+                results.put((job_id, run_inference(tracker, buffer), None))
+            except Exception as e:
+                results.put((job_id, None, str(e)))
+            finally:
+                # Drop the view so the shared memory block can be closed
+                buffer = None
+    finally:
+        for tracker in trackers.values():
+            tracker.close()
+        shm.close()
+
+
+class _Worker:
+    """Main-process handle to one worker process and its shared memory."""
+
+    def __init__(self, ctx, results, slot_size, slots, tracker_options):
+        self.slot_size = slot_size
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=slot_size * slots)
+        self.free_slots = list(range(slots))
+        self.sessions = 0
+        self.tasks = ctx.Queue()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(self.shm.name, slot_size, self.tasks, results,
+                  tracker_options),
+            daemon=True
+        )
+        self.process.start()
+
+    def send_frame(self, job_id, sid, buffer):
+        """Copy a frame into a free slot and hand it to the worker."""
+        length = len(buffer)
+        if self.free_slots and length <= self.slot_size:
+            slot = self.free_slots.pop()
+            offset = slot * self.slot_size
+            self.shm.buf[offset:offset + length] = buffer
+            self.tasks.put(('frame', job_id, sid, slot, length, None))
+        else:
+            # Oversized frame or no free slot: fall back to pickling
+            slot = None
+            self.tasks.put(('frame', job_id, sid, None, length, bytes(buffer)))
+        return slot
+
+    def stop(self):
+        self.tasks.put(('stop',))
+        self.process.join(timeout=5)
+        self.shm.close()
+        self.shm.unlink()
+
+
+class _RemoteSession:
+    def __init__(self, sid, worker, queue_size):
+        self.sid = sid
+        self.worker = worker
+        self.frames = FrameQueue(queue_size)
+        self.in_flight = False
+        self.closed = False
+        self.last_used = time.monotonic()
+
+
+class ProcessBackend(InferenceBackend):
+    """
+    Runs inference in worker processes, sidestepping the GIL entirely.
+
+    Sessions are pinned to one worker so its tracker keeps state between
+    frames. Each session has at most one frame in flight; newer frames wait
+    in the session's bounded queue and stale ones are dropped.
+    """
+    name = 'process'
+
+    def __init__(self, workers=None, max_sessions=32, idle_timeout=60.0,
+                 frame_timeout=10.0, queue_size=2, tracker_options=None,
+                 slot_size=1 << 20, slots_per_worker=8, start_method='spawn'):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.frame_timeout = frame_timeout
+        self.queue_size = queue_size
+
+        if start_method not in ('spawn', 'forkserver'):
+            raise ValueError(f"Unknown start method: {start_method}")
+        if start_method not in multiprocessing.get_all_start_methods():
+            print(f"{start_method} is not available, starting workers with spawn")
+            start_method = 'spawn'
+        ctx = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            ctx.set_forkserver_preload(FORKSERVER_PRELOAD)
+        self.start_method = start_method
+        self._results = ctx.Queue()
+        self._workers = [
+            _Worker(ctx, self._results, slot_size, slots_per_worker,
+                    tracker_options or {})
+            for _ in range(workers or os.cpu_count() or 1)
+        ]
+        self._sessions = {}
+        # configure() options per session, sent whenever it is opened
+        self._session_options = {}
+        self._jobs = {}
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector = threading.Thread(
+            target=self._collect, name='inference-collector', daemon=True)
+        self._collector.start()
+
+    @property
+    def warm_up_sessions(self):
+        # Sessions go to the least loaded worker, so one each
+        return len(self._workers)
+
+    def submit(self, sid, buffer):
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is None:
+                session = self._open_session_locked(sid)
+            session.last_used = time.monotonic()
+            future = session.frames.put(buffer)
+            self._dispatch_locked(session)
+        return future
+
+    def process(self, sid, buffer):
+        return self.submit(sid, buffer).result(timeout=self.frame_timeout)
+
+    def configure(self, sid, **options):
+        with self._lock:
+            self._session_options.setdefault(sid, {}).update(options)
+            session = self._sessions.get(sid)
+            if session is not None:
+                session.worker.tasks.put(('configure', sid, options))
+
+    def _open_session_locked(self, sid):
+        if len(self._sessions) >= self.max_sessions:
+            self._evict_idle_locked()
+        if len(self._sessions) >= self.max_sessions:
+            raise PoolFullError(
+                f"Inference pool is full ({self.max_sessions} sessions)")
+        worker = min(self._workers, key=lambda w: w.sessions)
+        worker.sessions += 1
+        session = self._sessions[sid] = _RemoteSession(
+            sid, worker, self.queue_size)
+        options = self._session_options.get(sid)
+        if options:
+            worker.tasks.put(('configure', sid, dict(options)))
+        return session
+
+    def _dispatch_locked(self, session):
+        if session.in_flight or session.closed:
+            return
+        item = session.frames.get_nowait()
+        if item is None:
+            return
+        buffer, future = item
+        job_id = next(self._job_ids)
+        slot = session.worker.send_frame(job_id, session.sid, buffer)
+        self._jobs[job_id] = (session, future, slot)
+        session.in_flight = True
+
+    def _collect(self):
+        while True:
+            job_id, result, error = self._results.get()
+            if job_id is None:
+                break
+            with self._lock:
+                session, future, slot = self._jobs.pop(job_id)
+                if slot is not None:
+                    session.worker.free_slots.append(slot)
+                session.in_flight = False
+                self._dispatch_locked(session)
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
+
+    def release(self, sid):
+        with self._lock:
+            self._session_options.pop(sid, None)
+            self._close_session_locked(sid)
+
+    def _close_session_locked(self, sid):
+        session = self._sessions.pop(sid, None)
+        if session is None:
+            return
+        session.closed = True
+        session.frames.close()
+        session.worker.sessions -= 1
+        session.worker.tasks.put(('release', sid))
+
+    def evict_idle(self):
+        with self._lock:
+            return self._evict_idle_locked()
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(len(session.frames) + session.in_flight
+                       for session in self._sessions.values())
+
+    def _evict_idle_locked(self):
+        now = time.monotonic()
+        idle = [sid for sid, session in self._sessions.items()
+                if now - session.last_used > self.idle_timeout]
+        for sid in idle:
+            self._close_session_locked(sid)
+        return len(idle)
+
+    def close(self):
+        with self._lock:
+            for sid in list(self._sessions):
+                self._close_session_locked(sid)
+        for worker in self._workers:
+            worker.stop()
+        self._results.put((None, None, None))
+
+
+BACKENDS = {
+    InlineBackend.name: InlineBackend,
+    ThreadBackend.name: ThreadBackend,
+    ProcessBackend.name: ProcessBackend,
+}
+
+
+def create_backend(config):
+    """Build the inference backend selected by a Flask config mapping."""
+    name = config.get('INFERENCE_BACKEND', 'thread')
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {name}")
+
+    options = {
+        'max_sessions': config.get('TRACKER_POOL_SIZE', 32),
+        'idle_timeout': config.get('TRACKER_IDLE_TIMEOUT', 60.0),
+        'queue_size': config.get('FRAME_QUEUE_SIZE', 2),
+        'tracker_options': {
+            'roi_mode': config.get('TRACKER_ROI', False),
+            'smoothing': config.get('TRACKER_SMOOTHING', False),
+            'inference_hz': config.get('TRACKER_INFERENCE_HZ'),
+            'model_complexity': config.get('TRACKER_MODEL_COMPLEXITY', 1),
+            'min_detection_confidence': config.get(
+                'TRACKER_MIN_DETECTION_CONFIDENCE', 0.7),
+            'min_tracking_confidence': config.get(
+                'TRACKER_MIN_TRACKING_CONFIDENCE', 0.7),
+        },
+    }
+    if name == ProcessBackend.name:
+        options['workers'] = config.get('INFERENCE_WORKERS')
+        options['start_method'] = config.get('INFERENCE_START_METHOD', 'spawn')
+
+    backend = BACKENDS[name](**options)
+    backend.start_reaper(max(options['idle_timeout'] / 2, 1.0))
+    return backend
@@ -0,0 +1,80 @@
+"""
+Socket.IO message queue selection for multi-process deployments.
+
+With several server processes, an emit only reaches the clients connected
+to the process that makes it. A message queue relays every emit to all
+processes, each of which delivers it to its own clients. Flask-SocketIO
+has managers for redis://, rediss://, kafka://, zmq+tcp:// and anything
+kombu handles (amqp://...); local:// selects LocalPubSubManager, which
+relays between Socket.IO servers inside one process and stands in for
+Redis in tests. The async server (asgi_app.py) has asyncio managers for
+redis://, rediss:// and amqp:// only.
+"""
+import queue
+import threading
+
+import socketio
+
+LOCAL_SCHEME = 'local://'
+
+# Subscriber queues of every LocalPubSubManager, per channel
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+class LocalPubSubManager(socketio.PubSubManager):
+    """
+    In-process message queue with the semantics of the Redis manager.
+
+    Messages are serialized to JSON like they would be on the wire, and
+    every subscriber on the channel, the publisher included, receives
+    each one.
+    """
+    name = 'local'
+
+    def __init__(self, channel='flaskhand', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._queue = queue.Queue()
+        if not write_only:
+            with _channels_lock:
+                _channels.setdefault(channel, []).append(self._queue)
+
+    def _publish(self, data):
+        message = self.json.dumps(data)
+        with _channels_lock:
+            subscribers = list(_channels.get(self.channel, ()))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def _listen(self):
+        while True:
+            yield self._queue.get()
+
+    def close(self):
+        """Stop receiving messages on the channel."""
+        with _channels_lock:
+            subscribers = _channels.get(self.channel, [])
+            if self._queue in subscribers:
+                subscribers.remove(self._queue)
+
+
+def message_queue_options(url, channel='flaskhand'):
+    """SocketIO() keyword arguments for a SOCKETIO_MESSAGE_QUEUE url."""
+    if not url:
+        return {}
+    if url.startswith(LOCAL_SCHEME):
+        return {'client_manager': LocalPubSubManager(
+            channel=url[len(LOCAL_SCHEME):] or channel)}
+    return {'message_queue': url, 'channel': channel}
+
+
+def async_client_manager(url, channel='flaskhand'):
+    """socketio.AsyncServer client_manager for a SOCKETIO_MESSAGE_QUEUE url."""
+    if not url:
+        return None
+    if url.startswith(('redis://', 'rediss://')):
+        return socketio.AsyncRedisManager(url, channel=channel)
+    if url.startswith('amqp://'):
+        return socketio.AsyncAioPikaManager(url, channel=channel)
+    raise ValueError(f"The async server has no message queue for {url}; "
+                     f"use redis:// or amqp://")
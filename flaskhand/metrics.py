@@ -0,0 +1,255 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Counters, gauges and histograms are registered once at import time and
+updated from any thread; /metrics renders them with REGISTRY.render().
+Gauges can also be backed by a function that is called at scrape time,
+for values such as queue depths that are cheaper to read than to track.
+
+With METRICS_TRACE set, a FrameTracer also writes every frame's stage
+timings as one JSON line, for looking at individual slow frames.
+"""
+import bisect
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; spans sub-millisecond decodes up to multi-second Gemini calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"'
+                          for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} '
+                f'{_format_value(value)}' for key, value in items]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Read the (unlabelled) value from function() at scrape time."""
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception as e:
+                print(f"Error reading gauge {self.name}: {e}")
+                return []
+            return [f'{self.name} {_format_value(value)}']
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count))
+                           for key, (counts, total, count)
+                           in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(
+                    self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key,
+                                        [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self._register(
+            Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'flaskhand_stage_seconds',
+    'Time spent per pipeline stage.', ['stage'])
+FRAMES = REGISTRY.counter(
+    'flaskhand_frames_total',
+    'process_frame events by outcome.', ['result'])
+SAVES = REGISTRY.counter(
+    'flaskhand_saves_total', 'save_drawing events by outcome.', ['result'])
+GEMINI_REQUESTS = REGISTRY.counter(
+    'flaskhand_gemini_requests_total',
+    'Model calls made by the analysis scheduler, by outcome.', ['result'])
+CONNECTED_SESSIONS = REGISTRY.gauge(
+    'flaskhand_connected_sessions', 'Connected Socket.IO clients.')
+FRAME_QUEUE_DEPTH = REGISTRY.gauge(
+    'flaskhand_frame_queue_depth',
+    'Frames queued or in flight in the inference backend.')
+ANALYSIS_QUEUE_DEPTH = REGISTRY.gauge(
+    'flaskhand_analysis_queue_depth',
+    'Drawings waiting for or undergoing analysis.')
+GEMINI_QUEUE_DEPTH = REGISTRY.gauge(
+    'flaskhand_gemini_queue_depth',
+    'Requests waiting for a rate-limit token in the Gemini scheduler.')
+
+
+def observe_stages(timings):
+    """Record a {stage: seconds} mapping in the stage histogram."""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+class FrameTracer:
+    """Writes one JSON line of stage timings per frame to path ('-': stdout)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = sys.stdout if path == '-' else open(path, 'a', buffering=1)
+
+    def trace(self, sid, frame_id, timings, **fields):
+        record = {
+            'time': time.time(),
+            'sid': sid,
+            'frame_id': frame_id,
+            'ms': {stage: round(seconds * 1000, 3)
+                   for stage, seconds in timings.items()},
+        }
+        record.update(fields)
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
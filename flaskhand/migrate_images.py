@@ -0,0 +1,44 @@
+"""
+Convert drawings.db files to content-addressed image storage.
+
+    python migrate_images.py drawings.db ../stremlithandapp/drawings.db
+
+Base64 PNGs are moved out of drawings.image_data into the images table in
+batches, each committed separately, so large files never need to be held
+in memory and an interrupted run can simply be restarted.
+"""
+import argparse
+import os
+
+from database import DrawingDatabase
+
+
+def migrate(db_path, batch_size):
+    size_before = os.path.getsize(db_path)
+    db = DrawingDatabase(db_path)
+    try:
+        converted = 0
+        for count in db.migrate_legacy_images(batch_size):
+            converted += count
+            print(f"{db_path}: converted {converted} drawings")
+    finally:
+        db.close()
+    size_after = os.path.getsize(db_path)
+    print(f"{db_path}: {converted} drawings migrated, "
+          f"{size_before} -> {size_after} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('databases', nargs='+', help='drawings.db files')
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    for db_path in args.databases:
+        if not os.path.exists(db_path):
+            parser.error(f"{db_path} does not exist")
+        migrate(db_path, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+"""
+Run several server processes behind a sticky load balancer.
+
+    redis-server &
+    python serve.py --workers 4 --port 5001 \\
+        --message-queue redis://localhost:6379/0
+
+Each worker is a full app process on its own port, counting up from
+--worker-port: app.run_server, or asgi_app.run_server with --server asgi.
+The workers share one DATABASE_PATH. It is a SQLite file in WAL mode,
+which several processes on the same host can use at once. They relay
+Socket.IO emits through --message-queue, so an analysis that finishes on
+one worker still reaches watchers connected to another. More than one
+worker requires a message queue.
+
+A client's tracker, canvas and stroke recorder live in the worker it is
+connected to. Engine.IO long polling also needs every request of a session
+to reach the same worker. The balancer on --port therefore routes each
+HTTP request by its flaskhand_worker cookie, request by request, even
+within one keep-alive connection. A request without the cookie goes to
+the worker its connection was first given, or else to the next worker in
+turn, and the balancer adds the cookie to its response. Browsers and the
+python-socketio client send it back on later requests and on the
+WebSocket upgrade, which is routed the same way and then tunneled. Behind
+a real load balancer, point it at the worker ports with cookie or
+source-IP stickiness instead (e.g. haproxy "cookie flaskhand_worker
+insert", nginx ip_hash).
+
+Each worker's Gemini scheduler gets GEMINI_RPM / --workers requests per
+minute, so the workers together stay within the API quota. Only the first
+worker re-queues pending analyses at startup.
+
+To measure aggregate frame throughput, run the workers with the stub
+Gemini backend and point the load generator at the balancer:
+
+    GEMINI_BACKEND=stub python serve.py --workers 4 \\
+        --message-queue redis://localhost:6379/0
+    python -m benchmarks.bench_load --url http://localhost:5001 \\
+        --clients 20 50 100 200
+
+Then repeat with --workers 1 and compare throughput_fps and the saturation
+point. Each worker serves its own /metrics on its port.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+COOKIE = 'flaskhand_worker'
+COOKIE_PATTERN = re.compile(
+    rb'^cookie:[^\r\n]*\b' + COOKIE.encode() + rb'=(\d+)',
+    re.IGNORECASE | re.MULTILINE)
+# Largest request or response head the balancer reads before routing
+HEAD_LIMIT = 64 * 1024
+LENGTH_PATTERN = re.compile(rb'^content-length:[ \t]*(\d+)',
+                            re.IGNORECASE | re.MULTILINE)
+CHUNKED_PATTERN = re.compile(rb'^transfer-encoding:[^\r\n]*\bchunked\b',
+                             re.IGNORECASE | re.MULTILINE)
+CLOSE_PATTERN = re.compile(rb'^connection:[^\r\n]*\bclose\b',
+                           re.IGNORECASE | re.MULTILINE)
+UPGRADE_PATTERN = re.compile(rb'^upgrade:', re.IGNORECASE | re.MULTILINE)
+BAD_GATEWAY = (b'HTTP/1.1 502 Bad Gateway\r\n'
+               b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+# Module whose run_server() each worker runs, per --server
+SERVERS = {
+    'threading': 'app',
+    'asgi': 'asgi_app',
+}
+
+
+class StickyBalancer:
+    """
+    HTTP/1.1 proxy that routes every request by its worker cookie.
+
+    Requests are routed one at a time, so a keep-alive connection whose
+    requests carry different cookies still reaches the right workers. A
+    request without the cookie goes to the worker its connection was
+    first given, or to the next worker in turn, and its response sets the
+    cookie. WebSocket upgrades are routed the same way and then tunneled.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._next = itertools.cycle(range(len(workers)))
+
+    def choose(self, head):
+        """Worker index from a request head's cookie, or None without one."""
+        match = COOKIE_PATTERN.search(head)
+        if match and int(match.group(1)) < len(self.workers):
+            return int(match.group(1))
+        return None
+
+    async def handle(self, reader, writer):
+        # Connections to the workers this client connection has used
+        upstreams = {}
+        # Worker of the connection's requests without the cookie
+        assigned = None
+        try:
+            while True:
+                head = await read_head(reader)
+                if head is None:
+                    break
+                index = self.choose(head)
+                tag = index is None
+                if tag:
+                    if assigned is None:
+                        assigned = next(self._next)
+                    index = assigned
+
+                upstream = upstreams.get(index)
+                if upstream is None or upstream[0].at_eof():
+                    try:
+                        upstream = await asyncio.open_connection(
+                            *self.workers[index], limit=HEAD_LIMIT)
+                    except OSError as e:
+                        print(f"Worker {index} unreachable: {e}")
+                        writer.write(BAD_GATEWAY)
+                        await writer.drain()
+                        break
+                    upstreams[index] = upstream
+                worker_reader, worker_writer = upstream
+
+                worker_writer.write(head)
+                if UPGRADE_PATTERN.search(head):
+                    await self.tunnel(reader, writer, worker_reader,
+                                      worker_writer, index if tag else None)
+                    break
+                await copy_body(reader, worker_writer, head)
+                if not await self.relay_response(
+                        head, worker_reader, writer, index if tag else None):
+                    break
+                if CLOSE_PATTERN.search(head):
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            for _, worker_writer in upstreams.values():
+                worker_writer.close()
+            writer.close()
+
+    async def relay_response(self, request, reader, writer, index):
+        """
+        Forward one response, adding the cookie of worker index unless it
+        is None. Returns whether the client connection can carry another
+        request.
+        """
+        while True:
+            head = await read_head(reader)
+            if head is None:
+                writer.write(BAD_GATEWAY)
+                await writer.drain()
+                return False
+            status = int(head.split(b' ', 2)[1])
+            if status in (100, 102, 103):
+                # Interim responses come before the real one
+                writer.write(head)
+                continue
+            break
+        if index is not None:
+            head = with_cookie(head, index)
+        writer.write(head)
+        if request.startswith(b'HEAD ') or status in (204, 304):
+            await writer.drain()
+            return not CLOSE_PATTERN.search(head)
+        if not await copy_body(reader, writer, head, until_close=True):
+            return False
+        return not CLOSE_PATTERN.search(head)
+
+    async def tunnel(self, reader, writer, worker_reader, worker_writer,
+                     index):
+        """Pass an upgraded connection through in both directions."""
+        head = await read_head(worker_reader)
+        if head is None:
+            return
+        writer.write(with_cookie(head, index) if index is not None else head)
+        pipes = [asyncio.ensure_future(self.pipe(reader, worker_writer)),
+                 asyncio.ensure_future(self.pipe(worker_reader, writer))]
+        await asyncio.wait(pipes, return_when=asyncio.FIRST_COMPLETED)
+        for task in pipes:
+            task.cancel()
+
+    @staticmethod
+    async def pipe(reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+
+
+async def read_head(reader):
+    """The next request or response head, or None at the end of stream."""
+    try:
+        return await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def with_cookie(head, index):
+    """A response head that also sets the cookie of worker index."""
+    status_end = head.index(b'\r\n') + 2
+    cookie = f'Set-Cookie: {COOKIE}={index}; Path=/; HttpOnly\r\n'
+    return head[:status_end] + cookie.encode() + head[status_end:]
+
+
+async def copy_body(reader, writer, head, until_close=False):
+    """
+    Forward the body that follows head. A message without Content-Length
+    or chunked encoding has no body, or with until_close, runs to the end
+    of the stream; returns False in that case.
+    """
+    if CHUNKED_PATTERN.search(head):
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            writer.write(line)
+            size = int(line.split(b';', 1)[0], 16)
+            if size == 0:
+                # Trailer fields, up to the blank line
+                while line != b'\r\n':
+                    line = await reader.readuntil(b'\r\n')
+                    writer.write(line)
+                break
+            writer.write(await reader.readexactly(size + 2))
+            await writer.drain()
+        await writer.drain()
+        return True
+    match = LENGTH_PATTERN.search(head)
+    if match:
+        remaining = int(match.group(1))
+        while remaining:
+            data = await reader.read(min(remaining, 65536))
+            if not data:
+                raise asyncio.IncompleteReadError(b'', remaining)
+            writer.write(data)
+            await writer.drain()
+            remaining -= len(data)
+        await writer.drain()
+        return True
+    if until_close:
+        await StickyBalancer.pipe(reader, writer)
+        return False
+    return True
+
+
+def start_workers(args):
+    """Start the app processes; returns them with their (host, port)."""
+    rpm = float(os.getenv('GEMINI_RPM', 15)) / args.workers
+    module = SERVERS[args.server]
+    processes, addresses = [], []
+    for index in range(args.workers):
+        port = args.worker_port + index
+        env = dict(os.environ,
+                   DATABASE_PATH=args.database,
+                   GEMINI_RPM=str(rpm),
+                   ANALYSIS_RESUME='1' if index == 0 else '0')
+        if args.message_queue:
+            env['SOCKETIO_MESSAGE_QUEUE'] = args.message_queue
+        processes.append(subprocess.Popen(
+            [sys.executable, '-c',
+             f'import {module}; '
+             f'{module}.run_server(host="127.0.0.1", port={port})'],
+            cwd=APP_DIR, env=env))
+        addresses.append(('127.0.0.1', port))
+    return processes, addresses
+
+
+def wait_for_workers(processes, addresses, timeout):
+    deadline = time.monotonic() + timeout
+    for process, address in zip(processes, addresses):
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"Worker on port {address[1]} exited with "
+                                   f"status {process.returncode}")
+            try:
+                socket.create_connection(address, timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(
+                        f"Worker on port {address[1]} did not start")
+                time.sleep(0.25)
+
+
+async def balance(addresses, host, port):
+    balancer = StickyBalancer(addresses)
+    server = await asyncio.start_server(balancer.handle, host, port,
+                                        limit=HEAD_LIMIT)
+    print(f"Balancing {len(addresses)} workers on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address the balancer listens on')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--worker-port', type=int, default=5101,
+                        help='port of the first worker')
+    parser.add_argument('--message-queue',
+                        default=os.getenv('SOCKETIO_MESSAGE_QUEUE'),
+                        help='e.g. redis://localhost:6379/0')
+    parser.add_argument('--database', default=os.getenv(
+        'DATABASE_PATH', os.path.join(APP_DIR, 'drawings.db')))
+    parser.add_argument('--server', default='threading', choices=SERVERS,
+                        help='Werkzeug threads or the async server')
+    parser.add_argument('--start-timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        if not args.message_queue:
+            parser.error("--message-queue is required for more than one "
+                         "worker")
+        if args.message_queue.startswith('local://'):
+            parser.error("local:// only relays within one process")
+    args.database = os.path.abspath(args.database)
+
+    processes, addresses = start_workers(args)
+    try:
+        wait_for_workers(processes, addresses, args.start_timeout)
+        asyncio.run(balance(addresses, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    main()
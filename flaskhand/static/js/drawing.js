@@ -17,9 +17,54 @@ indicatorCanvas.height = 480;
 // Drawing state
 let isDrawing = false;
 let prevPoint = null;
-let frameProcessing = false;
 let isConnected = false;
 
+// "server" sends video frames; "landmarks" runs the hand model in the browser
+let trackingMode = "server";
+let handLandmarker = null;
+
+// Landmark packet layout, see strokes.py: uint32 ms + four uint16 coordinates
+const NO_HAND = 0xffff;
+const TASKS_VISION_URL = "https://cdn.jsdelivr.net/npm/@mediapipe/tasks-vision@0.10.14";
+const HAND_MODEL_URL =
+    "https://storage.googleapis.com/mediapipe-models/hand_landmarker/hand_landmarker/float16/1/hand_landmarker.task";
+
+// Frame transport: binary JPEG by default, "?transport=base64" for data URLs
+const urlParams = new URLSearchParams(window.location.search);
+const frameTransport = urlParams.get("transport") === "base64" ? "base64" : "binary";
+
+// Canvas sync: dirty rectangles stream to the server as PNG patches while
+// drawing, one in flight at a time, so saving only commits the last patch
+// number. "?save=image" uploads the whole canvas on save instead.
+const uploadCanvasOnSave = urlParams.get("save") === "image";
+const PATCH_INTERVAL_MS = 250;
+const patchCanvas = document.createElement("canvas");
+const patchCtx = patchCanvas.getContext("2d");
+let dirtyRect = null;
+let patchSeq = 0;
+let ackedPatchSeq = -1;
+let patchInFlight = false;
+let savePending = false;
+let canvasHasContent = false;
+
+// Pipelined capture: up to maxFramesInFlight frames await results at once
+// ("?inflight=N"); capture size and JPEG quality adapt to measured latency
+const maxFramesInFlight = Math.max(1, parseInt(urlParams.get("inflight")) || 2);
+const TARGET_LATENCY_MS = 120;
+const FRAME_TIMEOUT_MS = 2000;
+const CAPTURE_SCALES = [0.5, 0.75, 1.0];
+const captureCanvas = document.createElement("canvas");
+const captureCtx = captureCanvas.getContext("2d");
+const pendingFrames = new Map();
+let nextFrameId = 0;
+let lastAppliedFrameId = -1;
+let captureScaleIndex = CAPTURE_SCALES.length - 1;
+let jpegQuality = 0.7;
+let latencyEstimate = null;
+let serverTimeEstimate = null;
+let lastAdaptation = 0;
+let captureLoopRunning = false;
+
 // Socket connection
 const socket = io();
 
@@ -39,18 +84,176 @@ async function setupCamera() {
 }
 
 // Frame capture and processing
+function startCaptureLoop() {
+    if (captureLoopRunning) return;
+    captureLoopRunning = true;
+    requestAnimationFrame(captureFrame);
+}
+
 function captureFrame() {
-    if (!isConnected || frameProcessing) return;
+    if (trackingMode !== "server") {
+        captureLoopRunning = false;
+        return;
+    }
+
+    expirePendingFrames();
+    if (isConnected && video.readyState >= 2 && pendingFrames.size < maxFramesInFlight) {
+        sendFrame();
+    }
+    requestAnimationFrame(captureFrame);
+}
+
+function sendFrame() {
+    const scale = CAPTURE_SCALES[captureScaleIndex];
+    captureCanvas.width = Math.round(video.videoWidth * scale);
+    captureCanvas.height = Math.round(video.videoHeight * scale);
+    captureCtx.drawImage(video, 0, 0, captureCanvas.width, captureCanvas.height);
+
+    const frameId = nextFrameId++;
+    pendingFrames.set(frameId, {
+        sentAt: performance.now(),
+        scaleX: drawingCanvas.width / captureCanvas.width,
+        scaleY: drawingCanvas.height / captureCanvas.height
+    });
+
+    if (frameTransport === "binary" && captureCanvas.toBlob) {
+        captureCanvas.toBlob(async (blob) => {
+            const frame = blob
+                ? await blob.arrayBuffer()
+                : captureCanvas.toDataURL("image/jpeg", jpegQuality);
+            socket.emit("process_frame", { frame_id: frameId, frame: frame });
+        }, "image/jpeg", jpegQuality);
+    } else {
+        socket.emit("process_frame", {
+            frame_id: frameId,
+            frame: captureCanvas.toDataURL("image/jpeg", jpegQuality)
+        });
+    }
+}
+
+function expirePendingFrames() {
+    const now = performance.now();
+    pendingFrames.forEach((pending, frameId) => {
+        if (now - pending.sentAt > FRAME_TIMEOUT_MS) {
+            pendingFrames.delete(frameId);
+        }
+    });
+}
+
+function scaleHandData(handData, pending) {
+    if (!handData.has_hand) return handData;
+    const scale = (pos) => [pos[0] * pending.scaleX, pos[1] * pending.scaleY];
+    return {
+        has_hand: true,
+        thumb_pos: scale(handData.thumb_pos),
+        index_pos: scale(handData.index_pos)
+    };
+}
+
+function adaptCaptureQuality(roundTripMs, serverMs) {
+    latencyEstimate = latencyEstimate === null ? roundTripMs : latencyEstimate * 0.8 + roundTripMs * 0.2;
+    serverTimeEstimate = serverTimeEstimate === null ? serverMs : serverTimeEstimate * 0.8 + serverMs * 0.2;
+
+    const now = performance.now();
+    if (now - lastAdaptation < 1000) return;
+    lastAdaptation = now;
+
+    // Shrink the frame when the server is the bottleneck, else cut bytes first
+    const serverBound = serverTimeEstimate > latencyEstimate / 2;
+    if (latencyEstimate > TARGET_LATENCY_MS) {
+        if ((serverBound || jpegQuality <= 0.5) && captureScaleIndex > 0) {
+            captureScaleIndex--;
+        } else if (jpegQuality > 0.5) {
+            jpegQuality = Math.round((jpegQuality - 0.1) * 10) / 10;
+        }
+    } else if (latencyEstimate < TARGET_LATENCY_MS / 2) {
+        if (captureScaleIndex < CAPTURE_SCALES.length - 1) {
+            captureScaleIndex++;
+        } else if (jpegQuality < 0.8) {
+            jpegQuality = Math.round((jpegQuality + 0.1) * 10) / 10;
+        }
+    }
+}
+
+// In-browser hand tracking
+async function loadHandLandmarker() {
+    const vision = await import(`${TASKS_VISION_URL}/vision_bundle.mjs`);
+    const fileset = await vision.FilesetResolver.forVisionTasks(`${TASKS_VISION_URL}/wasm`);
+    return vision.HandLandmarker.createFromOptions(fileset, {
+        baseOptions: { modelAssetPath: HAND_MODEL_URL, delegate: "GPU" },
+        runningMode: "VIDEO",
+        numHands: 1,
+        minHandDetectionConfidence: 0.7,
+        minTrackingConfidence: 0.7
+    });
+}
 
-    const canvas = document.createElement("canvas");
-    canvas.width = video.videoWidth;
-    canvas.height = video.videoHeight;
-    const ctx = canvas.getContext("2d");
-    ctx.drawImage(video, 0, 0);
+function detectLandmarks() {
+    if (trackingMode !== "landmarks" || !handLandmarker) return;
 
-    frameProcessing = true;
-    socket.emit("process_frame", {
-        frame: canvas.toDataURL("image/jpeg", 0.7)
+    if (video.readyState >= 2) {
+        const timestamp = performance.now();
+        const result = handLandmarker.detectForVideo(video, timestamp);
+        const handData = landmarksToHandData(result.landmarks);
+        handleHandTracking(handData);
+        if (isConnected) {
+            socket.emit("landmarks", encodeLandmarkPacket(timestamp, handData));
+        }
+    }
+    requestAnimationFrame(detectLandmarks);
+}
+
+function landmarksToHandData(landmarks) {
+    if (!landmarks || landmarks.length === 0) {
+        return { has_hand: false, thumb_pos: null, index_pos: null };
+    }
+    const toPixels = (point) => [
+        Math.min(Math.max(Math.round(point.x * drawingCanvas.width), 0), drawingCanvas.width - 1),
+        Math.min(Math.max(Math.round(point.y * drawingCanvas.height), 0), drawingCanvas.height - 1)
+    ];
+    return {
+        has_hand: true,
+        thumb_pos: toPixels(landmarks[0][4]),
+        index_pos: toPixels(landmarks[0][8])
+    };
+}
+
+function encodeLandmarkPacket(timestamp, handData) {
+    const view = new DataView(new ArrayBuffer(12));
+    view.setUint32(0, Math.round(timestamp) >>> 0, true);
+    const coords = handData.has_hand
+        ? [...handData.thumb_pos, ...handData.index_pos]
+        : [NO_HAND, NO_HAND, NO_HAND, NO_HAND];
+    coords.forEach((value, i) => view.setUint16(4 + i * 2, value, true));
+    return view.buffer;
+}
+
+async function setTrackingMode(mode) {
+    trackingMode = mode;
+    if (mode === "landmarks") {
+        try {
+            handLandmarker = handLandmarker || await loadHandLandmarker();
+        } catch (error) {
+            console.error("Error loading hand model:", error);
+            showToast("Could not load the in-browser hand model.", "danger");
+            document.getElementById("trackingMode").value = "server";
+            trackingMode = "server";
+        }
+    }
+    if (trackingMode === "landmarks") {
+        requestAnimationFrame(detectLandmarks);
+    } else {
+        startCaptureLoop();
+    }
+}
+
+function sendTrackingOptions() {
+    socket.emit("tracking_options", {
+        min_distance: parseInt(document.getElementById("minDistance").value),
+        thickness: parseInt(document.getElementById("lineThickness").value),
+        color: document.getElementById("drawingColor").value,
+        inference_hz: parseInt(document.getElementById("inferenceHz").value),
+        smoothing: document.getElementById("smoothing").checked
     });
 }
 
@@ -101,8 +304,51 @@ function drawLine(start, end) {
     drawingCtx.lineWidth = document.getElementById("lineThickness").value;
     drawingCtx.lineCap = "round";
     drawingCtx.stroke();
+
+    canvasHasContent = true;
+    const pad = Math.ceil(drawingCtx.lineWidth / 2) + 1;
+    markDirty(
+        Math.min(start[0], end[0]) - pad, Math.min(start[1], end[1]) - pad,
+        Math.max(start[0], end[0]) + pad, Math.max(start[1], end[1]) + pad
+    );
+}
+
+// Canvas sync
+function markDirty(x0, y0, x1, y1) {
+    x0 = Math.max(0, Math.floor(x0));
+    y0 = Math.max(0, Math.floor(y0));
+    x1 = Math.min(drawingCanvas.width, Math.ceil(x1));
+    y1 = Math.min(drawingCanvas.height, Math.ceil(y1));
+    if (x1 <= x0 || y1 <= y0) return;
+    dirtyRect = dirtyRect
+        ? [Math.min(dirtyRect[0], x0), Math.min(dirtyRect[1], y0),
+           Math.max(dirtyRect[2], x1), Math.max(dirtyRect[3], y1)]
+        : [x0, y0, x1, y1];
 }
 
+function sendPatch() {
+    if (!dirtyRect || patchInFlight || !isConnected) return;
+    const [x0, y0, x1, y1] = dirtyRect;
+    dirtyRect = null;
+    patchInFlight = true;
+
+    patchCanvas.width = x1 - x0;
+    patchCanvas.height = y1 - y0;
+    patchCtx.drawImage(drawingCanvas, x0, y0, patchCanvas.width, patchCanvas.height,
+                       0, 0, patchCanvas.width, patchCanvas.height);
+    const seq = ++patchSeq;
+    patchCanvas.toBlob(async (blob) => {
+        socket.emit("canvas_patch", { seq: seq, x: x0, y: y0, patch: await blob.arrayBuffer() });
+    }, "image/png");
+}
+
+function commitSave() {
+    savePending = false;
+    socket.emit("save_drawing", { commit: ackedPatchSeq });
+}
+
+setInterval(sendPatch, PATCH_INTERVAL_MS);
+
 // UI Helpers
 function showToast(message, type = "success") {
     const toastEl = document.getElementById('successToast');
@@ -112,7 +358,7 @@ function showToast(message, type = "success") {
 }
 
 function updateValueDisplays() {
-    ["minDistance", "lineThickness"].forEach(id => {
+    ["minDistance", "lineThickness", "inferenceHz"].forEach(id => {
         const element = document.getElementById(id + "Value");
         if (element) {
             element.textContent = document.getElementById(id).value;
@@ -124,21 +370,53 @@ function updateValueDisplays() {
 socket.on("connect", () => {
     console.log("Connected to server");
     isConnected = true;
+    sendTrackingOptions();
     setupCamera();
+    // A new session starts with an empty server canvas; resend all of ours
+    patchInFlight = false;
+    ackedPatchSeq = -1;
+    if (canvasHasContent) {
+        markDirty(0, 0, drawingCanvas.width, drawingCanvas.height);
+    }
 });
 
 socket.on("disconnect", () => {
     console.log("Disconnected from server");
     isConnected = false;
+    pendingFrames.clear();
     showToast("Connection lost. Reconnecting...", "danger");
 });
 
 socket.on("frame_processed", (data) => {
-    frameProcessing = false;
-    if (data.hand_data) {
-        handleHandTracking(data.hand_data);
+    const pending = pendingFrames.get(data.frame_id);
+    if (!pending) return;
+    pendingFrames.delete(data.frame_id);
+
+    if (!data.hand_data) return;
+    adaptCaptureQuality(performance.now() - pending.sentAt, data.server_ms || 0);
+
+    // Results can arrive out of order; never apply one older than the last
+    if (data.frame_id > lastAppliedFrameId && trackingMode === "server") {
+        lastAppliedFrameId = data.frame_id;
+        handleHandTracking(scaleHandData(data.hand_data, pending));
+    }
+});
+
+socket.on("canvas_patch_ack", (data) => {
+    if (data.seq !== patchSeq) return;
+    patchInFlight = false;
+    if (data.error) {
+        // Retried with the next interval as a full-canvas patch
+        console.error("Canvas patch rejected:", data.error);
+        markDirty(0, 0, drawingCanvas.width, drawingCanvas.height);
+        return;
+    }
+    ackedPatchSeq = data.seq;
+    if (dirtyRect) {
+        sendPatch();
+    } else if (savePending) {
+        commitSave();
     }
-    requestAnimationFrame(captureFrame);
 });
 
 socket.on("drawing_saved", (response) => {
@@ -153,25 +431,46 @@ socket.on("drawing_saved", (response) => {
 // Event listeners
 document.getElementById("clearCanvas").addEventListener("click", () => {
     drawingCtx.clearRect(0, 0, drawingCanvas.width, drawingCanvas.height);
+    // Numbered like a patch, so a patch still in flight can't undo the clear
+    dirtyRect = null;
+    patchInFlight = false;
+    canvasHasContent = false;
+    ackedPatchSeq = ++patchSeq;
+    socket.emit("clear_canvas", { seq: ackedPatchSeq });
 });
 
 document.getElementById("saveDrawing").addEventListener("click", () => {
-    const drawingData = drawingCanvas.toDataURL("image/png");
-    socket.emit("save_drawing", { image: drawingData });
+    if (uploadCanvasOnSave) {
+        socket.emit("save_drawing", { image: drawingCanvas.toDataURL("image/png") });
+    } else if (dirtyRect || patchInFlight) {
+        // Commit once the server has the latest patch
+        savePending = true;
+        sendPatch();
+    } else {
+        commitSave();
+    }
     showToast("Saving drawing...");
 });
 
 // Range input listeners
-["minDistance", "lineThickness"].forEach(id => {
+["minDistance", "lineThickness", "inferenceHz"].forEach(id => {
     const element = document.getElementById(id);
     if (element) {
         element.addEventListener("input", updateValueDisplays);
+        element.addEventListener("change", sendTrackingOptions);
     }
 });
 
+document.getElementById("drawingColor").addEventListener("change", sendTrackingOptions);
+document.getElementById("smoothing").addEventListener("change", sendTrackingOptions);
+
+document.getElementById("trackingMode").addEventListener("change", (event) => {
+    setTrackingMode(event.target.value);
+});
+
 // Start video feed
 video.addEventListener("play", () => {
-    captureFrame();
+    setTrackingMode(document.getElementById("trackingMode").value);
 });
 
 // Initialize values
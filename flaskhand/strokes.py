@@ -0,0 +1,272 @@
+"""
+Server-side pinch detection, stroke recording and the stroke file format.
+
+The server applies the same pinch logic as drawing.js to the hand positions
+it sees - process_frame results, or landmark packets when the browser runs
+the hand model itself - and records the strokes. They are stored with the
+drawing in a compact binary format (see encode_strokes) from which the
+picture can be rendered at any size or replayed stroke by stroke.
+"""
+import math
+import re
+import struct
+
+import cv2
+import numpy as np
+
+CANVAS_WIDTH = 640
+CANVAS_HEIGHT = 480
+
+# uint32 timestamp (ms), then thumb x/y and index x/y as uint16
+LANDMARK_PACKET = struct.Struct('<IHHHH')
+NO_HAND = 0xFFFF
+
+HEX_COLOR = re.compile(r'^#[0-9a-fA-F]{6}$')
+
+# Stroke file: magic, canvas width and height, stroke count
+STROKE_MAGIC = b'HTS1'
+STROKE_HEADER = struct.Struct('<4sHHI')
+
+
+def parse_landmark_packet(packet):
+    """
+    Validate and unpack a landmark packet.
+
+    Returns (timestamp, thumb_pos, index_pos); both positions are None when
+    the client saw no hand.
+    """
+    if not isinstance(packet, (bytes, bytearray)) or \
+            len(packet) != LANDMARK_PACKET.size:
+        raise ValueError("Invalid landmark packet")
+
+    timestamp, thumb_x, thumb_y, index_x, index_y = \
+        LANDMARK_PACKET.unpack(packet)
+    if thumb_x == NO_HAND:
+        return timestamp, None, None
+
+    for x, y in ((thumb_x, thumb_y), (index_x, index_y)):
+        if x >= CANVAS_WIDTH or y >= CANVAS_HEIGHT:
+            raise ValueError("Landmark outside of canvas")
+    return timestamp, (thumb_x, thumb_y), (index_x, index_y)
+
+
+class StrokeRecorder:
+    """Turns a stream of thumb/index positions into pinch-drawn strokes."""
+
+    def __init__(self, min_distance=25, color='#FF0000', thickness=5):
+        self.min_distance = min_distance
+        self.color = color
+        self.thickness = thickness
+        self.strokes = []
+        self.last_timestamp = None
+        self.source = None
+        self._current = None
+
+    def set_options(self, min_distance=None, color=None, thickness=None):
+        if min_distance is not None:
+            min_distance = int(min_distance)
+            if not 0 <= min_distance <= 100:
+                raise ValueError("min_distance must be between 0 and 100")
+            self.min_distance = min_distance
+        if color is not None:
+            if not HEX_COLOR.match(color):
+                raise ValueError("color must be a #RRGGBB hex string")
+            self.color = color
+        if thickness is not None:
+            thickness = int(thickness)
+            if not 1 <= thickness <= 20:
+                raise ValueError("thickness must be between 1 and 20")
+            self.thickness = thickness
+        # Style changes start a new stroke, as they do on the client canvas
+        self._current = None
+
+    def update(self, timestamp, thumb_pos, index_pos, source=None):
+        """
+        Feed one observation. Returns True while pinching, False otherwise.
+
+        Observations older than the last one are ignored. source names the
+        clock timestamp comes from ('frames' for server time, 'landmarks'
+        for the browser's); switching sources ends the current stroke.
+        """
+        if source != self.source:
+            self.source = source
+            self.last_timestamp = None
+            self._current = None
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            return self._current is not None
+        self.last_timestamp = timestamp
+
+        # Like the client, keep the current state while no hand is visible
+        if thumb_pos is None or index_pos is None:
+            return self._current is not None
+
+        distance = math.hypot(thumb_pos[0] - index_pos[0],
+                              thumb_pos[1] - index_pos[1])
+        if distance >= self.min_distance:
+            self._current = None
+            return False
+
+        if self._current is None:
+            self._current = {
+                'color': self.color,
+                'thickness': self.thickness,
+                'points': []
+            }
+            self.strokes.append(self._current)
+        # Positions of a hand partly out of frame, or predicted ones, can
+        # fall off the canvas; the stroke format stores them unsigned
+        self._current['points'].append([
+            min(max(int(index_pos[0]), 0), CANVAS_WIDTH - 1),
+            min(max(int(index_pos[1]), 0), CANVAS_HEIGHT - 1),
+            int(timestamp)])
+        return True
+
+    def clear(self):
+        self.strokes = []
+        self._current = None
+
+    def export(self):
+        """Return the recorded strokes, or None if nothing was drawn."""
+        return [stroke for stroke in self.strokes
+                if len(stroke['points']) > 1] or None
+
+
+def _write_varint(out, value):
+    """Append an unsigned LEB128 varint."""
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    value = shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("Truncated stroke data")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+def encode_strokes(strokes, canvas_size=(CANVAS_WIDTH, CANVAS_HEIGHT)):
+    """
+    Pack recorded strokes into the binary stroke format.
+
+    After the header, each stroke is its RGB color and thickness as four
+    bytes, then varints: start time relative to the previous stroke, point
+    count, the first point, and for every further point zigzag-encoded
+    x/y deltas and the milliseconds since the previous point. Typical
+    points take three to four bytes, against ~15 as JSON.
+    """
+    out = bytearray(STROKE_HEADER.pack(
+        STROKE_MAGIC, canvas_size[0], canvas_size[1], len(strokes)))
+    previous_start = None
+    for stroke in strokes:
+        points = stroke['points']
+        color = stroke['color'].lstrip('#')
+        out += bytes.fromhex(color)
+        out.append(int(stroke['thickness']))
+
+        start = points[0][2]
+        _write_varint(out, _zigzag(
+            start - previous_start if previous_start is not None else 0))
+        previous_start = start
+        _write_varint(out, len(points))
+
+        last_x, last_y, last_t = points[0]
+        _write_varint(out, last_x)
+        _write_varint(out, last_y)
+        for x, y, t in points[1:]:
+            _write_varint(out, _zigzag(x - last_x))
+            _write_varint(out, _zigzag(y - last_y))
+            _write_varint(out, max(0, t - last_t))
+            last_x, last_y, last_t = x, y, t
+    return bytes(out)
+
+
+def stroke_canvas_size(data):
+    """(width, height) of the canvas the strokes were drawn on."""
+    magic, width, height, _ = STROKE_HEADER.unpack_from(data)
+    if magic != STROKE_MAGIC:
+        raise ValueError("Not stroke data")
+    return width, height
+
+
+def iter_strokes(data):
+    """
+    Decode strokes one at a time, for replay or rendering without holding
+    them all. Point times are milliseconds since the first stroke started.
+    """
+    if len(data) < STROKE_HEADER.size:
+        raise ValueError("Truncated stroke data")
+    magic, _, _, count = STROKE_HEADER.unpack_from(data)
+    if magic != STROKE_MAGIC:
+        raise ValueError("Not stroke data")
+
+    offset = STROKE_HEADER.size
+    start = 0
+    for _ in range(count):
+        if offset + 4 > len(data):
+            raise ValueError("Truncated stroke data")
+        color = '#' + data[offset:offset + 3].hex().upper()
+        thickness = data[offset + 3]
+        offset += 4
+
+        delta, offset = _read_varint(data, offset)
+        start += _unzigzag(delta)
+        length, offset = _read_varint(data, offset)
+        x, offset = _read_varint(data, offset)
+        y, offset = _read_varint(data, offset)
+        t = start
+        points = [[x, y, t]]
+        for _ in range(length - 1):
+            dx, offset = _read_varint(data, offset)
+            dy, offset = _read_varint(data, offset)
+            dt, offset = _read_varint(data, offset)
+            x += _unzigzag(dx)
+            y += _unzigzag(dy)
+            t += dt
+            points.append([x, y, t])
+        yield {'color': color, 'thickness': thickness, 'points': points}
+
+
+def decode_strokes(data):
+    return list(iter_strokes(data))
+
+
+def render_strokes(data, width=None, height=None, flip_horizontal=False):
+    """
+    Rasterize stroke data to a BGR image of width x height (the recorded
+    canvas size by default) on black, like a saved canvas. Strokes and
+    line widths scale with the output size.
+    """
+    canvas_width, canvas_height = stroke_canvas_size(data)
+    width = width or canvas_width
+    height = height or canvas_height
+    scale_x = width / canvas_width
+    scale_y = height / canvas_height
+
+    image = np.zeros((height, width, 3), np.uint8)
+    for stroke in iter_strokes(data):
+        points = np.array(stroke['points'], np.float64)[:, :2]
+        points *= (scale_x, scale_y)
+        red, green, blue = bytes.fromhex(stroke['color'][1:])
+        thickness = max(1, round(stroke['thickness'] * min(scale_x, scale_y)))
+        cv2.polylines(image, [np.round(points).astype(np.int32)], False,
+                      (blue, green, red), thickness, cv2.LINE_AA)
+
+    if flip_horizontal:
+        image = cv2.flip(image, 1)
+    return image
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+# The app's modules are imported top-level, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import close_pools  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    yield str(tmp_path / 'drawings.db')
+    close_pools()
+
+
+@pytest.fixture
+def png_bytes():
+    image = np.full((48, 64, 3), 255, np.uint8)
+    cv2.line(image, (4, 4), (60, 40), (0, 0, 255), 3)
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def wait_for(condition, timeout=10.0):
+    """Poll condition() until it is true; fail after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("Timed out waiting for condition")
+        time.sleep(0.01)
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py imported with the stub Gemini backend and a scratch database."""
+    os.environ['GEMINI_BACKEND'] = 'stub'
+    os.environ['DATABASE_PATH'] = str(
+        tmp_path_factory.mktemp('app') / 'drawings.db')
+    import app
+    app.init_services()
+    return app
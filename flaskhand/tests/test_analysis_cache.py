@@ -0,0 +1,112 @@
+import types
+
+import cv2
+import numpy as np
+import pytest
+
+import analysis_cache
+from analysis_cache import AnalysisCache, perceptual_hash
+
+
+def drawing(text=None, shape=None, scale=3, origin=(150, 280),
+            color=(255, 255, 255), thickness=5):
+    """Thin strokes on a black canvas, like the app's drawings."""
+    image = np.zeros((480, 640, 3), np.uint8)
+    if text:
+        cv2.putText(image, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale,
+                    color, thickness)
+    elif shape == 'circle':
+        cv2.circle(image, (320, 240), 150, color, thickness)
+    elif shape == 'square':
+        cv2.rectangle(image, (170, 90), (470, 390), color, thickness)
+    return image
+
+
+def reencoded(image, extension, quality_flag, quality):
+    encoded = cv2.imencode(extension, image, [quality_flag, quality])[1]
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+
+def test_expired_best_match_falls_back_to_fresh_entry(db_path, monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(analysis_cache, 'time',
+                        types.SimpleNamespace(time=lambda: clock.now))
+    cache = AnalysisCache(db_path=db_path, max_distance=6, ttl=100)
+    try:
+        phash = 0b1111 << 200
+        cache.put(phash, 'old analysis')
+        clock.now += 80
+        cache.put(phash ^ 0b11, 'fresh analysis')
+        clock.now += 30
+
+        # The exact match has expired; the near one is still within the TTL
+        assert cache.get(phash) == 'fresh analysis'
+        assert cache.snapshot()['entries'] == 1
+        assert cache.conn.execute(
+            'SELECT analysis FROM analysis_cache').fetchall() == [
+                ('fresh analysis',)]
+
+        clock.now += 100
+        assert cache.get(phash) is None
+        assert cache.snapshot()['entries'] == 0
+    finally:
+        cache.close()
+
+
+@pytest.mark.parametrize('first, second', [
+    (drawing('2+2'), drawing('3+5')),
+    (drawing('2+2'), drawing('2+3')),
+    (drawing(shape='circle'), drawing(shape='square')),
+    (drawing('12', scale=12, origin=(20, 440), thickness=8),
+     drawing('17', scale=12, origin=(20, 440), thickness=8)),
+])
+def test_distinct_drawings_miss(db_path, first, second):
+    cache = AnalysisCache(db_path=db_path)
+    try:
+        cache.put(perceptual_hash(first), 'first analysis')
+        assert cache.get(perceptual_hash(second)) is None
+    finally:
+        cache.close()
+
+
+@pytest.mark.parametrize('copy', [
+    drawing('2+2'),
+    reencoded(drawing('2+2'), '.webp', cv2.IMWRITE_WEBP_QUALITY, 80),
+    reencoded(drawing('2+2'), '.jpg', cv2.IMWRITE_JPEG_QUALITY, 70),
+    drawing('2+2', origin=(60, 200)),
+])
+def test_resaved_drawing_hits(db_path, copy):
+    cache = AnalysisCache(db_path=db_path)
+    try:
+        png = cv2.imencode('.png', drawing('2+2'))[1].tobytes()
+        cache.put(perceptual_hash(png), 'analysis of 2+2')
+        assert cache.get(perceptual_hash(copy)) == 'analysis of 2+2'
+    finally:
+        cache.close()
+
+
+def test_blank_canvas_hashes_to_zero():
+    assert perceptual_hash(drawing()) == 0
+
+
+def test_workers_share_one_cache(db_path):
+    """Each serve.py worker has its own AnalysisCache on the same table."""
+    first = AnalysisCache(db_path=db_path, max_entries=2)
+    second = AnalysisCache(db_path=db_path, max_entries=2)
+    try:
+        phash = perceptual_hash(drawing('2+2'))
+        assert second.get(phash) is None
+        first.put(phash, 'analysis of 2+2')
+        assert second.get(phash) == 'analysis of 2+2'
+
+        # Entries written by either worker count towards one limit, and
+        # the least recently used one goes
+        second.put(perceptual_hash(drawing('3+5')), 'analysis of 3+5')
+        first.put(perceptual_hash(drawing(shape='circle')), 'a circle')
+        assert first.snapshot()['entries'] == 2
+        assert second.snapshot()['entries'] == 2
+        assert second.get(phash) is None
+        assert second.get(perceptual_hash(drawing('3+5'))) == 'analysis of 3+5'
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,164 @@
+import types
+
+import pytest
+
+import analysis_queue
+from analysis_queue import AnalysisQueue
+from database import DrawingDatabase
+from gemini_helper import AnalysisScheduler, GeminiHelper, StubModel
+
+from conftest import wait_for
+
+
+class FlakyModel(StubModel):
+    """StubModel whose first failures calls raise."""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def generate_content(self, contents):
+        if self.failures:
+            self.failures -= 1
+            with self._lock:
+                self.calls += 1
+            raise RuntimeError("model unavailable")
+        return super().generate_content(contents)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays AnalysisQueue asked for, without sleeping."""
+    delays = []
+    monkeypatch.setattr(analysis_queue, 'time',
+                        types.SimpleNamespace(sleep=delays.append))
+    monkeypatch.setattr(analysis_queue.random, 'uniform', lambda a, b: 0.0)
+    return delays
+
+
+@pytest.fixture
+def statuses(monkeypatch):
+    """Every (drawing_id, status) written by update_analysis, in order."""
+    written = []
+    update_analysis = DrawingDatabase.update_analysis
+
+    def record(self, drawing_id, status, analysis=None):
+        written.append((drawing_id, status))
+        update_analysis(self, drawing_id, status, analysis)
+
+    monkeypatch.setattr(DrawingDatabase, 'update_analysis', record)
+    return written
+
+
+@pytest.fixture
+def make_queue(db_path):
+    created = []
+
+    def make(model=None, max_retries=3):
+        scheduler = AnalysisScheduler(
+            GeminiHelper(model=model or StubModel()),
+            requests_per_minute=6000, burst=10)
+        notifications = []
+        queue = AnalysisQueue(
+            scheduler,
+            notify=lambda *args: notifications.append(args),
+            max_retries=max_retries,
+            db_factory=lambda: DrawingDatabase(db_path))
+        created.append((queue, scheduler))
+        return queue, notifications
+
+    yield make
+    for queue, scheduler in created:
+        queue.shutdown()
+        scheduler.shutdown()
+
+
+def save_pending(db_path, image_bytes, status='pending'):
+    db = DrawingDatabase(db_path)
+    try:
+        return db.save_drawing(image_bytes, analysis_status=status)
+    finally:
+        db.close()
+
+
+def load(db_path, drawing_id):
+    db = DrawingDatabase(db_path)
+    try:
+        return db.get_drawing(drawing_id, include_image=False)
+    finally:
+        db.close()
+
+
+def test_pending_to_done(db_path, png_bytes, make_queue, statuses):
+    queue, notifications = make_queue()
+    drawing_id = save_pending(db_path, png_bytes)
+    assert load(db_path, drawing_id)['analysis_status'] == 'pending'
+
+    analysis = queue.submit(drawing_id, png_bytes, 'sid-1').result(timeout=10)
+
+    assert analysis == "Stub analysis of a 64x48 drawing."
+    assert statuses == [(drawing_id, 'running'), (drawing_id, 'done')]
+    drawing = load(db_path, drawing_id)
+    assert drawing['analysis_status'] == 'done'
+    assert drawing['analysis'] == analysis
+    assert notifications == [(drawing_id, 'sid-1', {
+        'status': 'done',
+        'analysis': analysis,
+        'drawing_id': drawing_id,
+    })]
+    assert queue.pending == 0
+
+
+def test_failed_after_retries(db_path, png_bytes, make_queue, statuses,
+                              sleeps):
+    model = FlakyModel(failures=10)
+    queue, notifications = make_queue(model, max_retries=2)
+    drawing_id = save_pending(db_path, png_bytes)
+
+    assert queue.submit(drawing_id, png_bytes, 'sid-1').result(
+        timeout=10) is None
+
+    assert model.calls == 3
+    assert statuses == [(drawing_id, 'running'), (drawing_id, 'failed')]
+    drawing = load(db_path, drawing_id)
+    assert drawing['analysis_status'] == 'failed'
+    assert drawing['analysis'] is None
+    assert notifications == [(drawing_id, 'sid-1', {
+        'status': 'failed',
+        'message': 'model unavailable',
+        'drawing_id': drawing_id,
+    })]
+
+
+def test_retries_with_exponential_backoff(db_path, png_bytes, make_queue,
+                                          sleeps):
+    model = FlakyModel(failures=2)
+    queue, notifications = make_queue(model, max_retries=3)
+    queue.backoff = 0.5
+    drawing_id = save_pending(db_path, png_bytes)
+
+    analysis = queue.submit(drawing_id, png_bytes).result(timeout=10)
+
+    assert analysis is not None
+    assert model.calls == 3
+    assert sleeps == [0.5, 1.0]
+    assert load(db_path, drawing_id)['analysis_status'] == 'done'
+    assert [payload['status'] for _, _, payload in notifications] == ['done']
+
+
+def test_resume_pending_after_restart(db_path, png_bytes, make_queue):
+    # Left behind by a process that stopped before or during the analysis
+    pending_id = save_pending(db_path, png_bytes, 'pending')
+    running_id = save_pending(db_path, png_bytes, 'running')
+    done_id = save_pending(db_path, png_bytes, 'done')
+
+    queue, notifications = make_queue()
+    assert queue.resume_pending() == 2
+    wait_for(lambda: queue.pending == 0)
+
+    for drawing_id in (pending_id, running_id):
+        assert load(db_path, drawing_id)['analysis_status'] == 'done'
+    assert load(db_path, done_id)['analysis'] is None
+    # Nobody is waiting on a resumed job, so only watchers are notified
+    assert sorted((drawing_id, sid) for drawing_id, sid, _ in notifications) \
+        == [(pending_id, None), (running_id, None)]
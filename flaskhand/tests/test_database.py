@@ -0,0 +1,34 @@
+from database import DrawingDatabase
+
+STROKES = [{'color': '#FF0000', 'thickness': 5,
+            'points': [[100, 100, 0], [110, 104, 16], [121, 109, 33]]}]
+
+
+def columns(db):
+    return [row[1] for row in db.conn.execute('PRAGMA table_info(drawings)')]
+
+
+def test_fresh_schema_has_no_json_strokes_column(db_path):
+    db = DrawingDatabase(db_path)
+    try:
+        assert 'strokes' not in columns(db)
+        assert 'stroke_data' in columns(db)
+    finally:
+        db.close()
+
+
+def test_strokes_decoded_only_on_request(db_path, png_bytes):
+    db = DrawingDatabase(db_path)
+    try:
+        drawing_id = db.save_drawing(png_bytes, strokes=STROKES)
+        assert db.get_drawing(drawing_id)['strokes'] is None
+        assert db.get_all_drawings()[0]['strokes'] is None
+
+        drawing = db.get_drawing(drawing_id, include_image=False,
+                                 include_strokes=True)
+        assert drawing['image_data'] is None
+        assert [stroke['points'] for stroke in drawing['strokes']] == [
+            STROKES[0]['points']]
+    finally:
+        db.close()
+
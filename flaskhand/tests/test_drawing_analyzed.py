@@ -0,0 +1,41 @@
+import base64
+
+from conftest import wait_for
+
+
+def received_events(client, events):
+    events.extend(client.get_received())
+    return [packet['name'] for packet in events]
+
+
+def test_save_notifies_saver_and_watchers(app_module, png_bytes):
+    saver = app_module.socketio.test_client(app_module.app)
+    watcher = app_module.socketio.test_client(app_module.app)
+    saver_events, watcher_events = [], []
+    try:
+        saver.emit('save_drawing', {
+            'image': 'data:image/png;base64,'
+                     + base64.b64encode(png_bytes).decode()})
+        wait_for(lambda: 'drawing_saved' in received_events(
+            saver, saver_events))
+        saved = next(packet['args'][0] for packet in saver_events
+                     if packet['name'] == 'drawing_saved')
+        assert saved['status'] == 'success'
+        assert saved['analysis_status'] == 'pending'
+        drawing_id = saved['drawing_id']
+
+        watcher.emit('watch_drawing', {'drawing_id': drawing_id})
+        wait_for(lambda: 'drawing_analyzed' in received_events(
+            saver, saver_events))
+        wait_for(lambda: 'drawing_analyzed' in received_events(
+            watcher, watcher_events))
+
+        for events in (saver_events, watcher_events):
+            analyzed = next(packet['args'][0] for packet in events
+                            if packet['name'] == 'drawing_analyzed')
+            assert analyzed['drawing_id'] == drawing_id
+            assert analyzed['status'] == 'done'
+            assert analyzed['analysis'].startswith('Stub analysis')
+    finally:
+        saver.disconnect()
+        watcher.disconnect()
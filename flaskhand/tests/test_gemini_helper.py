@@ -0,0 +1,36 @@
+import pytest
+
+from gemini_helper import QuotaExceededError, is_quota_error
+
+
+class ResourceExhausted(Exception):
+    code = 429
+
+
+class TooManyRequests(ResourceExhausted):
+    pass
+
+
+class HTTPError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize('error', [
+    QuotaExceededError("429 Resource has been exhausted"),
+    ResourceExhausted("Resource exhausted"),
+    TooManyRequests("slow down"),
+    HTTPError("Too Many Requests", 429),
+])
+def test_quota_errors(error):
+    assert is_quota_error(error)
+
+
+@pytest.mark.parametrize('error', [
+    RuntimeError("Request 7f429a failed"),
+    ValueError("Image of 1429 bytes exceeds the quota of the prompt"),
+    HTTPError("Internal error 429", 500),
+])
+def test_other_errors_mentioning_429(error):
+    assert not is_quota_error(error)
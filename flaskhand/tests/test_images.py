@@ -0,0 +1,32 @@
+import base64
+
+
+def saved_drawing(app_module, png_bytes):
+    response, _ = app_module.save_drawing('test-image-caching', {
+        'image': base64.b64encode(png_bytes).decode()})
+    assert response['status'] == 'success'
+    return response['drawing_id']
+
+
+def test_image_cached_for_a_year(app_module, png_bytes):
+    drawing_id = saved_drawing(app_module, png_bytes)
+    client = app_module.app.test_client()
+
+    response = client.get(f'/drawings/{drawing_id}/image')
+    assert response.status_code == 200
+    assert response.data
+    cache_control = response.cache_control
+    assert cache_control.public
+    assert cache_control.max_age == 31536000
+    assert cache_control.immutable
+    assert not cache_control.no_cache
+    etag = response.headers['ETag']
+
+    revalidated = client.get(f'/drawings/{drawing_id}/image',
+                             headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert revalidated.headers['ETag'] == etag
+    assert revalidated.cache_control.max_age == 31536000
+    assert revalidated.cache_control.immutable
+    assert not revalidated.cache_control.no_cache
@@ -0,0 +1,137 @@
+import asyncio
+import http.client
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from flask import Flask
+from flask_socketio import SocketIO
+from werkzeug.serving import make_server
+
+from message_queue import message_queue_options
+from serve import StickyBalancer
+
+
+class WorkerHandler(BaseHTTPRequestHandler):
+    """Answers every request with its worker's name, keeping alive."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.reply(self.server.name)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.reply(self.server.name + b' ' + body)
+
+    def reply(self, body):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def balancer():
+    """A balancer in front of two workers; yields its port."""
+    workers = []
+    for name in (b'worker-0', b'worker-1'):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), WorkerHandler)
+        server.name = name
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        workers.append(server)
+
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    ports = []
+    stop = loop.create_future()
+
+    async def serve():
+        balancer = StickyBalancer([server.server_address
+                                   for server in workers])
+        server = await asyncio.start_server(balancer.handle, '127.0.0.1', 0)
+        ports.append(server.sockets[0].getsockname()[1])
+        started.set()
+        async with server:
+            await stop
+
+    thread = threading.Thread(target=loop.run_until_complete,
+                              args=(serve(),), daemon=True)
+    thread.start()
+    started.wait(10)
+    yield ports[0]
+    loop.call_soon_threadsafe(stop.set_result, None)
+    thread.join(10)
+    loop.close()
+    for server in workers:
+        server.shutdown()
+        server.server_close()
+
+
+def request(connection, method='GET', cookie=None, body=None):
+    headers = {'Cookie': f'flaskhand_worker={cookie}'} if cookie else {}
+    connection.request(method, '/', body=body, headers=headers)
+    response = connection.getresponse()
+    return response.read(), response.getheader('Set-Cookie')
+
+
+def test_keep_alive_requests_routed_by_their_cookie(balancer):
+    connection = http.client.HTTPConnection('127.0.0.1', balancer, timeout=10)
+    try:
+        body, cookie = request(connection)
+        first = body.decode()[-1]
+        other = '1' if first == '0' else '0'
+        assert cookie.startswith(f'flaskhand_worker={first};')
+
+        # Same connection, each request to the worker its cookie names
+        assert request(connection, cookie=other) == (
+            f'worker-{other}'.encode(), None)
+        assert request(connection, 'POST', cookie=first, body=b'poll') == (
+            f'worker-{first} poll'.encode(), None)
+        # Cookieless requests stay with the connection's first worker
+        assert request(connection)[0] == f'worker-{first}'.encode()
+    finally:
+        connection.close()
+
+
+def poll(connection, sid=None, packet=None):
+    """One Engine.IO polling request; sends packet or receives a payload."""
+    path = '/socket.io/?EIO=4&transport=polling'
+    if sid:
+        path += f'&sid={sid}'
+    connection.request('POST' if packet else 'GET', path, body=packet)
+    return connection.getresponse().read().decode()
+
+
+def test_emit_reaches_clients_of_another_server():
+    """Two workers on one message queue channel, as serve.py runs them."""
+    servers = []
+    for _ in range(2):
+        app = Flask(__name__)
+        servers.append((app, SocketIO(
+            app, async_mode='threading',
+            **message_queue_options('local://test-serve'))))
+    (_, socketio_a), (app_b, _) = servers
+    # The test client refuses message queues, so server B really serves
+    http_server = make_server('127.0.0.1', 0, app_b, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+
+    connection = http.client.HTTPConnection(
+        '127.0.0.1', http_server.server_port, timeout=10)
+    try:
+        # Engine.IO long polling by hand: open, then connect to namespace /
+        sid = json.loads(poll(connection)[1:])['sid']
+        poll(connection, sid, b'40')
+        assert poll(connection, sid).startswith('40')
+
+        socketio_a.emit('drawing_analyzed', {'drawing_id': 7})
+        assert poll(connection, sid) == '42' + json.dumps(
+            ['drawing_analyzed', {'drawing_id': 7}], separators=(',', ':'))
+    finally:
+        connection.close()
+        http_server.shutdown()
+        for _, server in servers:
+            server.server.manager.close()
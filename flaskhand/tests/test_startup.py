@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_sets_up_nothing(tmp_path):
+    """Spawned inference workers re-import app.py; that must stay cheap."""
+    database = tmp_path / 'drawings.db'
+    script = (
+        'import threading\n'
+        'import app\n'
+        'assert app.analysis_queue is None and app.gemini is None\n'
+        'print(threading.active_count())\n')
+    env = dict(os.environ, DATABASE_PATH=str(database),
+               GEMINI_BACKEND='stub')
+    completed = subprocess.run([sys.executable, '-c', script], cwd=APP_DIR,
+                               env=env, capture_output=True, text=True,
+                               timeout=120)
+    assert completed.returncode == 0, completed.stderr
+    assert completed.stdout.split()[-1] == '1'
+    assert not database.exists()
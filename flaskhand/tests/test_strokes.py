@@ -0,0 +1,44 @@
+import base64
+
+from strokes import (CANVAS_HEIGHT, CANVAS_WIDTH, StrokeRecorder,
+                     decode_strokes, encode_strokes)
+
+
+def test_off_canvas_positions_round_trip_clamped():
+    recorder = StrokeRecorder(min_distance=25)
+    positions = [(-5, 102), (-40, -3), (CANVAS_WIDTH + 20, 50),
+                 (100, CANVAS_HEIGHT + 7), (320, 240)]
+    for timestamp, (x, y) in enumerate(positions):
+        # Thumb next to the index finger: pinching
+        recorder.update(timestamp * 10, (x + 1, y), (x, y))
+
+    strokes = recorder.export()
+    decoded = decode_strokes(encode_strokes(strokes))
+
+    assert decoded == strokes
+    assert [point[:2] for point in decoded[0]['points']] == [
+        [0, 102], [0, 0], [CANVAS_WIDTH - 1, 50], [100, CANVAS_HEIGHT - 1],
+        [320, 240]]
+
+
+def test_negative_deltas_round_trip():
+    strokes = [{'color': '#00FF00', 'thickness': 3,
+                'points': [[600, 400, 0], [10, 2, 4], [300, 470, 7]]}]
+    assert decode_strokes(encode_strokes(strokes)) == strokes
+
+
+def test_save_keeps_image_when_strokes_do_not_encode(app_module, png_bytes):
+    sid = 'test-unencodable-strokes'
+    app_module.get_stroke_recorder(sid).strokes = [
+        {'color': '#FF0000', 'thickness': 5,
+         'points': [[-5, 102, 0], [10, 110, 16]]}]
+    try:
+        response, _ = app_module.save_drawing(sid, {
+            'image': base64.b64encode(png_bytes).decode()})
+    finally:
+        app_module.stroke_recorders.pop(sid, None)
+
+    assert response['status'] == 'success'
+    info, stroke_data = app_module.load_stroke_data(response['drawing_id'])
+    assert info is not None
+    assert stroke_data is None
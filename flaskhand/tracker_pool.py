@@ -0,0 +1,257 @@
+"""
+Per-session pool of HandTracker instances.
+
+MediaPipe's Hands graph keeps tracking state between frames when
+static_image_mode is off, so every connected client gets its own tracker.
+Each tracker can be driven by a dedicated worker thread fed from a small
+bounded queue; OpenCV and MediaPipe release the GIL while they run, so
+several webcams are processed in parallel across cores instead of queueing
+behind one shared graph.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+from hand_tracker import HandTracker
+
+
+class PoolFullError(RuntimeError):
+    """Raised when a new session arrives and the pool is at capacity."""
+
+
+def decode_frame(buffer):
+    """Decode an encoded image (bytes or uint8 array) into a BGR frame."""
+    if not isinstance(buffer, np.ndarray):
+        buffer = np.frombuffer(buffer, np.uint8)
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def run_inference(tracker, buffer):
+    """
+    Decode an encoded frame and run it through a hand tracker.
+
+    Returns (hand_data, timings), timings mapping stages ('imdecode',
+    'cvt_color', 'inference', ...) to seconds. When the tracker's inference
+    rate limit says this frame can be skipped, it is not even decoded, the
+    predicted position is returned instead and timings is empty.
+    """
+    now = time.monotonic()
+    if not tracker.needs_inference(now):
+        return tracker.predict_hand_data(now), {}
+
+    start = time.perf_counter()
+    frame = decode_frame(buffer)
+    decode_seconds = time.perf_counter() - start
+    if frame is None:
+        raise ValueError("Invalid frame data")
+    hand_data = tracker.process_and_encode_frame(frame, now)
+    return hand_data, dict(tracker.timings, imdecode=decode_seconds)
+
+
+class FrameQueue:
+    """
+    Bounded FIFO of pending frames for one client.
+
+    When the queue is full the oldest frame is dropped so that the worker
+    always moves on to the freshest image. Every put() returns a Future;
+    dropped frames resolve to None.
+    """
+
+    def __init__(self, maxsize=2):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, payload):
+        future = Future()
+        with self._cond:
+            if self._closed:
+                future.set_result(None)
+                return future
+            if len(self._items) >= self.maxsize:
+                _, stale = self._items.popleft()
+                stale.set_result(None)
+                self.dropped += 1
+            self._items.append((payload, future))
+            self._cond.notify()
+        return future
+
+    def get(self):
+        """Block for the next frame; returns None once the queue is closed."""
+        with self._cond:
+            while not self._items and not self._closed:
+                self._cond.wait()
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def get_nowait(self):
+        with self._cond:
+            return self._items.popleft() if self._items else None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._items:
+                _, future = self._items.popleft()
+                future.set_result(None)
+            self._cond.notify_all()
+
+
+class SessionTracker:
+    """A HandTracker bound to one client session."""
+
+    def __init__(self, sid, queue_size=2, tracker_options=None):
+        self.sid = sid
+        self.tracker = HandTracker(**(tracker_options or {}))
+        self.frames = FrameQueue(queue_size)
+        self.last_used = time.monotonic()
+        # Serializes calls into this tracker's graph
+        self._lock = threading.Lock()
+        # Guards starting the worker against a concurrent close()
+        self._worker_lock = threading.Lock()
+        self._worker = None
+        self._closed = False
+
+    def process(self, buffer):
+        """Run a frame on the calling thread."""
+        self.last_used = time.monotonic()
+        with self._lock:
+            return run_inference(self.tracker, buffer)
+
+    def configure(self, **options):
+        with self._lock:
+            self.tracker.configure(**options)
+
+    def submit(self, buffer):
+        """Queue a frame for this session's worker thread."""
+        self.last_used = time.monotonic()
+        future = self.frames.put(buffer)
+        with self._worker_lock:
+            if self._worker is None and not self._closed:
+                self._worker = threading.Thread(
+                    target=self._run, name=f'tracker-{self.sid[:8]}',
+                    daemon=True)
+                self._worker.start()
+        return future
+
+    def _run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            buffer, future = item
+            try:
+                future.set_result(self.process(buffer))
+            except Exception as e:
+                future.set_exception(e)
+        self._close_tracker()
+
+    def is_idle(self, now, idle_timeout):
+        return now - self.last_used > idle_timeout
+
+    def close(self):
+        with self._worker_lock:
+            self._closed = True
+            worker = self._worker
+        self.frames.close()
+        # A running worker closes the graph itself once its frame finishes
+        if worker is None:
+            self._close_tracker()
+
+    def _close_tracker(self):
+        with self._lock:
+            self.tracker.close()
+
+
+class TrackerPool:
+    """Hands out one SessionTracker per session id, up to max_size."""
+
+    def __init__(self, max_size=32, idle_timeout=60.0, frame_timeout=10.0,
+                 queue_size=2, tracker_options=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.frame_timeout = frame_timeout
+        self.queue_size = queue_size
+        self.tracker_options = tracker_options or {}
+        self._sessions = {}
+        # configure() options per session, applied whenever its tracker is
+        # created, so clients that never send a frame hold no tracker
+        self._session_options = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def queue_depth(self):
+        """Frames waiting in the sessions' queues."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return sum(len(session.frames) for session in sessions)
+
+    def acquire(self, sid):
+        """Return the tracker for sid, creating it if needed."""
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is not None:
+                return session
+
+            if len(self._sessions) >= self.max_size:
+                self._evict_idle_locked()
+            if len(self._sessions) >= self.max_size:
+                raise PoolFullError(
+                    f"Tracker pool is full ({self.max_size} sessions)")
+
+            session = SessionTracker(
+                sid, self.queue_size, self.tracker_options)
+            options = self._session_options.get(sid)
+            if options:
+                session.configure(**options)
+            self._sessions[sid] = session
+            return session
+
+    def configure(self, sid, **options):
+        """Change sid's tracker options, now or when its tracker is made."""
+        with self._lock:
+            self._session_options.setdefault(sid, {}).update(options)
+            session = self._sessions.get(sid)
+        if session is not None:
+            session.configure(**options)
+
+    def release(self, sid):
+        """Drop the tracker for sid, e.g. when the client disconnects."""
+        with self._lock:
+            session = self._sessions.pop(sid, None)
+            self._session_options.pop(sid, None)
+        if session is not None:
+            session.close()
+
+    def evict_idle(self):
+        """Close trackers that have not seen a frame within idle_timeout."""
+        with self._lock:
+            return self._evict_idle_locked()
+
+    def _evict_idle_locked(self):
+        now = time.monotonic()
+        idle = [sid for sid, session in self._sessions.items()
+                if session.is_idle(now, self.idle_timeout)]
+        for sid in idle:
+            self._sessions.pop(sid).close()
+        return len(idle)
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._session_options.clear()
+        for session in sessions:
+            session.close()
@@ -0,0 +1,156 @@
+"""
+Frame payload handling for the process_frame event.
+
+Clients send frames either as raw JPEG bytes (binary Socket.IO attachment)
+or, as a fallback, as a base64 data URL. TransportStats keeps running
+counters per transport so the two can be compared on real traffic, and
+ClientLimits caps connections and how fast each session may send events.
+"""
+import base64
+import threading
+import time
+
+
+def decode_base64(base64_string):
+    """Decode a base64 string or data URL to bytes."""
+    # Remove data URL prefix if present
+    if ',' in base64_string:
+        base64_string = base64_string.split(',')[1]
+    return base64.b64decode(base64_string)
+
+
+def decode_frame_payload(payload):
+    """
+    Turn a process_frame payload into encoded image bytes.
+
+    Returns (image_bytes, transport) where transport is 'binary' or 'base64'.
+    Binary payloads are passed through without copying.
+    """
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return payload, 'binary'
+    if isinstance(payload, str):
+        return decode_base64(payload), 'base64'
+    raise ValueError("Invalid frame data")
+
+
+class TransportStats:
+    """Thread-safe counters of received frame bytes and decode times."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, transport, wire_bytes, payload_decode, image_decode):
+        with self._lock:
+            stats = self._stats.setdefault(transport, {
+                'frames': 0,
+                'wire_bytes': 0,
+                'payload_decode_seconds': 0.0,
+                'image_decode_seconds': 0.0,
+            })
+            stats['frames'] += 1
+            stats['wire_bytes'] += wire_bytes
+            stats['payload_decode_seconds'] += payload_decode
+            stats['image_decode_seconds'] += image_decode
+
+    def snapshot(self):
+        """Return totals and per-frame averages for each transport."""
+        with self._lock:
+            snapshot = {}
+            for transport, stats in self._stats.items():
+                frames = stats['frames'] or 1
+                snapshot[transport] = dict(
+                    stats,
+                    avg_wire_bytes=stats['wire_bytes'] / frames,
+                    avg_payload_decode_ms=(
+                        stats['payload_decode_seconds'] * 1000 / frames),
+                    avg_image_decode_ms=(
+                        stats['image_decode_seconds'] * 1000 / frames),
+                )
+            return snapshot
+
+
+def timed(func, *args):
+    """Call func(*args) and return (result, elapsed seconds)."""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class FrameSequencer:
+    """
+    Tracks the newest frame id answered for each session.
+
+    With several frames in flight, results can complete out of order; a
+    result for a frame older than one already answered is stale and only
+    needs to be acknowledged, not applied.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}
+
+    def accept(self, sid, frame_id):
+        """Return True if frame_id is newer than anything answered for sid."""
+        if frame_id is None:
+            return True
+        with self._lock:
+            latest = self._latest.get(sid)
+            if latest is not None and frame_id <= latest:
+                return False
+            self._latest[sid] = frame_id
+            return True
+
+    def release(self, sid):
+        with self._lock:
+            self._latest.pop(sid, None)
+
+
+class ClientLimits:
+    """
+    Connection cap and per-session event rate limits.
+
+    rates maps an event name to (events per second, burst); each session
+    gets its own token bucket per event. A max_connections or rate of 0 or
+    None means unlimited.
+    """
+
+    def __init__(self, max_connections=None, rates=None):
+        self.max_connections = max_connections or None
+        self.rates = {event: (rate, max(1, burst or 1))
+                      for event, (rate, burst) in (rates or {}).items()
+                      if rate}
+        self._lock = threading.Lock()
+        self._sessions = set()
+        self._buckets = {}
+
+    def connect(self, sid):
+        """Admit sid unless max_connections sessions are already open."""
+        with self._lock:
+            if (self.max_connections is not None
+                    and len(self._sessions) >= self.max_connections):
+                return False
+            self._sessions.add(sid)
+            return True
+
+    def disconnect(self, sid):
+        with self._lock:
+            self._sessions.discard(sid)
+            for event in self.rates:
+                self._buckets.pop((sid, event), None)
+
+    def allow(self, sid, event):
+        """Take a token from sid's bucket for event; False if it is empty."""
+        limit = self.rates.get(event)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get((sid, event), (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self._buckets[(sid, event)] = (tokens, now)
+                return False
+            self._buckets[(sid, event)] = (tokens - 1, now)
+            return True
@@ -1,14 +1,36 @@
 import streamlit as st
 import cv2
 import numpy as np
-from hand_tracker import HandTracker
 from database import DrawingDatabase
 from gemini_helper import GeminiHelper
+from pipeline import CameraPipeline, RateMeter
+from compositor import Compositor
 import base64
+import time
 from io import BytesIO
 from PIL import Image
 
 
+@st.cache_resource
+def get_camera_pipeline():
+    """One camera grabber and inference worker for all reruns and sessions."""
+    return CameraPipeline(camera_index=0, width=640, height=480)
+
+
+@st.cache_resource
+def get_database():
+    return DrawingDatabase()
+
+
+def show_pipeline_stats(placeholder, stats, render_fps):
+    placeholder.markdown(
+        f"Camera: **{stats['camera']:.1f}** FPS  \n"
+        f"Inference: **{stats['inference']:.1f}** FPS "
+        f"({stats['inference_ms']:.0f} ms)  \n"
+        f"Render: **{render_fps:.1f}** FPS  \n"
+        f"Frames skipped: {stats['skipped']}")
+
+
 def initialize_state():
     if 'canvas' not in st.session_state:
         st.session_state.canvas = None
@@ -24,11 +46,14 @@ def initialize_state():
         st.session_state.camera_active = True
     if 'current_analysis' not in st.session_state:
         st.session_state.current_analysis = None
+    if 'compositor' not in st.session_state:
+        st.session_state.compositor = Compositor()
 
 
 def clear_canvas():
     if st.session_state.canvas is not None:
         st.session_state.canvas = np.zeros_like(st.session_state.canvas)
+    st.session_state.compositor.clear()
     st.session_state.camera_active = True
     st.session_state.current_analysis = None
     st.session_state.view_history_triggered = False
@@ -74,8 +99,7 @@ def main():
 
     # Initialize components
     initialize_state()
-    hand_tracker = HandTracker()
-    db = DrawingDatabase()
+    db = get_database()
 
     # Sidebar controls
     st.sidebar.header("Drawing Controls")
@@ -100,6 +124,13 @@ def main():
         key="color_picker"
     )
 
+    jpeg_quality = st.sidebar.slider(
+        "Preview JPEG Quality",
+        30, 100, 80,
+        key="jpeg_quality_slider"
+    )
+    st.session_state.compositor.jpeg_quality = jpeg_quality
+
     # Convert color from hex to RGB
     color_rgb = tuple(int(color.lstrip('#')[i:i+2], 16)
                       for i in (0, 2, 4))[::-1]
@@ -123,6 +154,9 @@ def main():
     view_btn = col3.button(
         "View History", key="view_history_btn", on_click=view_history_callback)
 
+    st.sidebar.header("Pipeline")
+    stats_placeholder = st.sidebar.empty()
+
     # Main content area
     frame_placeholder = st.empty()
     analysis_placeholder = st.empty()
@@ -132,30 +166,32 @@ def main():
         # Display history view
         display_drawing_history(frame_placeholder, db)
     else:
-        # Camera and drawing view
+        # Camera and drawing view; grabbing and inference run in the
+        # pipeline's threads, this loop only renders their newest result
+        pipeline = get_camera_pipeline()
+        hand_tracker = pipeline.hand_tracker
+        render_fps = RateMeter()
+        stats_updated = 0.0
+        seq = 0
         try:
-            cap = cv2.VideoCapture(0)
-            cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-
             while True:
                 if st.session_state.camera_active:
-                    ret, frame = cap.read()
-                    if not ret:
-                        st.error("Failed to access webcam")
+                    seq, latest = pipeline.latest(seq)
+                    if pipeline.error:
+                        st.error(pipeline.error)
+                        # Let the next rerun reopen the camera
+                        pipeline.stop()
+                        get_camera_pipeline.clear()
                         break
-
-                    frame = cv2.flip(frame, 1)
+                    if latest is None:
+                        continue
+                    frame, results, thumb_pos, index_pos = latest
 
                     # Initialize canvas if needed
                     if st.session_state.canvas is None:
                         st.session_state.canvas = np.zeros(
                             frame.shape, dtype=np.uint8)
 
-                    results = hand_tracker.process_frame(frame)
-                    thumb_pos, index_pos = hand_tracker.get_finger_positions(
-                        results, frame.shape)
-
                     if thumb_pos and index_pos:
                         distance = hand_tracker.calculate_distance(
                             thumb_pos, index_pos)
@@ -167,7 +203,7 @@ def main():
                                 st.session_state.prev_point = index_pos
                             # Continue line if already drawing
                             elif st.session_state.prev_point is not None:
-                                cv2.line(
+                                st.session_state.compositor.draw_line(
                                     st.session_state.canvas,
                                     st.session_state.prev_point,
                                     index_pos,
@@ -191,10 +227,21 @@ def main():
                                 st.session_state.prev_point = None
 
                     frame = hand_tracker.draw_landmarks(frame, results)
-                    combined_image = cv2.addWeighted(
-                        frame, 0.7, st.session_state.canvas, 0.8, 0)
+                    # Blend into a reused buffer and send ready-made JPEG
+                    compositor = st.session_state.compositor
+                    compositor.compose(frame, st.session_state.canvas)
                     frame_placeholder.image(
-                        combined_image, channels="BGR", use_container_width=True)
+                        compositor.encode(), use_container_width=True)
+                    render_fps.tick()
+
+                    now = time.monotonic()
+                    if now - stats_updated >= 1.0:
+                        stats_updated = now
+                        show_pipeline_stats(
+                            stats_placeholder, pipeline.stats(), render_fps.rate())
+                else:
+                    # Nothing to render while saving or browsing
+                    time.sleep(0.05)
 
                 # Handle save action
                 if st.session_state.save_triggered:
@@ -238,9 +285,6 @@ def main():
 
         except Exception as e:
             st.error(f"An error occurred: {str(e)}")
-        finally:
-            if 'cap' in locals():
-                cap.release()
 
 
 if __name__ == "__main__":
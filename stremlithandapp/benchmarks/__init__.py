@@ -0,0 +1,6 @@
+"""
+Offline benchmarks for the Streamlit app.
+
+Run them from the stremlithandapp directory, e.g.
+python -m benchmarks.bench_compositor
+"""
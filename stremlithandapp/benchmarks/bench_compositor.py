@@ -0,0 +1,145 @@
+"""
+Per-frame time and allocations of blending the canvas and preparing the image.
+
+    python -m benchmarks.bench_compositor --repeat 100 --coverage 0.25
+
+At each resolution a synthetic camera frame and a canvas with strokes over
+--coverage of its area are composited the old way (cv2.addWeighted into a
+new image, then what st.image does with a BGR array: a channel-swapped
+copy, a uint8 copy and a PIL JPEG encode at quality 100) and with the
+Compositor (in-place blend of the drawn bounding box, one JPEG encode at
+--quality). Times are medians over --repeat frames; allocations are the
+peak bytes allocated while handling one frame, measured with tracemalloc
+after a warm-up frame.
+"""
+import argparse
+import io
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from compositor import Compositor
+
+RESOLUTIONS = ((640, 480), (1280, 720), (1920, 1080))
+
+
+def make_frame(width, height, seed=0):
+    """A smooth frame with a little sensor-like noise."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.empty((height, width, 3), np.uint8)
+    frame[..., 0] = (x * 0.5 + y * 0.3).astype(np.uint8)
+    frame[..., 1] = (y * 0.6).astype(np.uint8)
+    frame[..., 2] = (255 - x * 0.7).astype(np.uint8)
+    noise = rng.integers(0, 8, frame.shape, dtype=np.uint8)
+    return cv2.add(frame, noise)
+
+
+def make_canvas(compositor, width, height, coverage, seed=0):
+    """Canvas with strokes confined to a centred box of the given area share."""
+    rng = random.Random(seed)
+    canvas = np.zeros((height, width, 3), np.uint8)
+    box_w, box_h = int(width * coverage ** 0.5), int(height * coverage ** 0.5)
+    left, top = (width - box_w) // 2, (height - box_h) // 2
+    for _ in range(20):
+        points = [(left + rng.randrange(box_w), top + rng.randrange(box_h))
+                  for _ in range(6)]
+        for p1, p2 in zip(points, points[1:]):
+            compositor.draw_line(canvas, p1, p2, (0, 0, 255), 5)
+    return canvas
+
+
+def streamlit_encode(image):
+    """Roughly what st.image does with a BGR array before sending it."""
+    rgb = image[:, :, [2, 1, 0]].astype(np.uint8)
+    try:
+        from PIL import Image
+    except ImportError:
+        return cv2.imencode('.jpg', rgb, [cv2.IMWRITE_JPEG_QUALITY, 100])[1]
+    buffer = io.BytesIO()
+    Image.fromarray(rgb).save(buffer, format='JPEG', quality=100)
+    return buffer.getvalue()
+
+
+def old_frame(frame, canvas, compositor):
+    combined = cv2.addWeighted(frame, 0.7, canvas, 0.8, 0)
+    return streamlit_encode(combined)
+
+
+def new_frame(frame, canvas, compositor):
+    compositor.compose(frame, canvas)
+    return compositor.encode()
+
+
+def measure(handle, frame, canvas, compositor, repeat):
+    handle(frame, canvas, compositor)
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        payload = handle(frame, canvas, compositor)
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        handle(frame, canvas, compositor)
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        handle(frame, canvas, compositor)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'median_ms': statistics.median(durations) * 1000,
+        'p95_ms': float(np.percentile(durations, 95)) * 1000,
+        'peak_alloc_kb': (peak - before) / 1024,
+        'payload_bytes': len(payload),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--coverage', type=float, default=0.25,
+                        help='share of the frame covered by the drawing')
+    parser.add_argument('--quality', type=int, default=80,
+                        help='JPEG quality of the Compositor')
+    args = parser.parse_args()
+
+    report = {}
+    for width, height in RESOLUTIONS:
+        compositor = Compositor(jpeg_quality=args.quality)
+        frame = make_frame(width, height)
+        canvas = make_canvas(compositor, width, height, args.coverage)
+
+        # The composites should match before encoding, up to rounding
+        expected = cv2.addWeighted(frame, 0.7, canvas, 0.8, 0)
+        max_diff = int(cv2.absdiff(compositor.compose(frame, canvas),
+                                   expected).max())
+
+        old = measure(old_frame, frame, canvas, compositor, args.repeat)
+        new = measure(new_frame, frame, canvas, compositor, args.repeat)
+        name = f'{width}x{height}'
+        report[name] = {
+            'bbox': compositor.bbox,
+            'max_pixel_diff': max_diff,
+            'old': old,
+            'new': new,
+            'speedup': old['median_ms'] / new['median_ms'],
+        }
+        print(f"{name}: old {old['median_ms']:.2f} ms, "
+              f"{old['peak_alloc_kb']:.0f} KiB; "
+              f"new {new['median_ms']:.2f} ms, "
+              f"{new['peak_alloc_kb']:.0f} KiB")
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
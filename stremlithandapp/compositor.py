@@ -0,0 +1,67 @@
+"""
+Blending of the drawing canvas over camera frames.
+
+The composite is frame * 0.7 + canvas * 0.8, as cv2.addWeighted gave it,
+but computed into a preallocated buffer: the frame is scaled into the
+buffer and only the bounding box of what has been drawn gets the weighted
+blend. The result is encoded to JPEG once, so Streamlit can send the
+bytes as they are instead of converting and re-encoding the array.
+"""
+import cv2
+import numpy as np
+
+FRAME_WEIGHT = 0.7
+CANVAS_WEIGHT = 0.8
+
+
+class Compositor:
+    """Per-session canvas bounding box and output buffer."""
+
+    def __init__(self, jpeg_quality=80):
+        self.jpeg_quality = jpeg_quality
+        self.output = None
+        # (x0, y0, x1, y1) of drawn content, exclusive, or None
+        self.bbox = None
+
+    def draw_line(self, canvas, p1, p2, color, thickness):
+        """Draw on the canvas and grow the bounding box to cover the line."""
+        cv2.line(canvas, p1, p2, color, thickness)
+        # Round caps and anti-aliasing reach about half a thickness further
+        pad = thickness // 2 + 2
+        height, width = canvas.shape[:2]
+        x0 = max(0, min(p1[0], p2[0]) - pad)
+        y0 = max(0, min(p1[1], p2[1]) - pad)
+        x1 = min(width, max(p1[0], p2[0]) + pad + 1)
+        y1 = min(height, max(p1[1], p2[1]) + pad + 1)
+        if x0 >= x1 or y0 >= y1:
+            return
+        if self.bbox is not None:
+            x0 = min(x0, self.bbox[0])
+            y0 = min(y0, self.bbox[1])
+            x1 = max(x1, self.bbox[2])
+            y1 = max(y1, self.bbox[3])
+        self.bbox = (x0, y0, x1, y1)
+
+    def clear(self):
+        self.bbox = None
+
+    def compose(self, frame, canvas):
+        """Blend canvas over frame into the reused output buffer."""
+        if self.output is None or self.output.shape != frame.shape:
+            self.output = np.empty_like(frame)
+        cv2.convertScaleAbs(frame, dst=self.output, alpha=FRAME_WEIGHT)
+        if self.bbox is not None:
+            x0, y0, x1, y1 = self.bbox
+            cv2.addWeighted(frame[y0:y1, x0:x1], FRAME_WEIGHT,
+                            canvas[y0:y1, x0:x1], CANVAS_WEIGHT, 0,
+                            dst=self.output[y0:y1, x0:x1])
+        return self.output
+
+    def encode(self, image=None):
+        """JPEG bytes of image (by default the last composite)."""
+        image = self.output if image is None else image
+        ok, buffer = cv2.imencode(
+            '.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise ValueError("Failed to encode frame")
+        return buffer.tobytes()
@@ -1,11 +1,38 @@
 import sqlite3
 from datetime import datetime
+import base64
+import hashlib
 import json
+import threading
+
+
+def image_hash(image_bytes):
+    """Content address of an encoded image."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def to_image_bytes(image_data):
+    """Accept raw image bytes or a base64 string / data URL."""
+    if isinstance(image_data, (bytes, bytearray, memoryview)):
+        return bytes(image_data)
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data)
 
 
 class DrawingDatabase:
-    def __init__(self):
-        self.conn = sqlite3.connect('drawings.db', check_same_thread=False)
+    """
+    Drawing metadata plus content-addressed image blobs.
+
+    Same layout as the Flask app's database; legacy base64 rows are read as
+    a fallback until flaskhand/migrate_images.py has converted the file.
+    """
+
+    def __init__(self, db_path='drawings.db'):
+        # One instance is shared by all Streamlit sessions; the lock keeps
+        # their transactions on the connection from interleaving
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
         self.create_tables()
 
     def create_tables(self):
@@ -13,33 +40,63 @@ class DrawingDatabase:
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS drawings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            image_data TEXT,
+            image_hash TEXT,
             gemini_analysis TEXT,
             timestamp DATETIME
         )
         ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS images (
+            hash TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL
+        )
+        ''')
+
+        cursor.execute('PRAGMA table_info(drawings)')
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'image_hash' not in columns:
+            cursor.execute('ALTER TABLE drawings ADD COLUMN image_hash TEXT')
+        self.has_legacy_images = 'image_data' in columns
         self.conn.commit()
 
     def save_drawing(self, image_data, gemini_analysis=None):
+        image_bytes = to_image_bytes(image_data)
+        digest = image_hash(image_bytes)
+        with self.lock:
+            self._insert(image_bytes, digest, gemini_analysis)
+
+    def _insert(self, image_bytes, digest, gemini_analysis):
         cursor = self.conn.cursor()
         cursor.execute(
-            'INSERT INTO drawings (image_data, gemini_analysis, timestamp) VALUES (?, ?, ?)',
-            (image_data, json.dumps(gemini_analysis)
+            'INSERT OR IGNORE INTO images (hash, data, size) VALUES (?, ?, ?)',
+            (digest, sqlite3.Binary(image_bytes), len(image_bytes))
+        )
+        cursor.execute(
+            'INSERT INTO drawings (image_hash, gemini_analysis, timestamp) VALUES (?, ?, ?)',
+            (digest, json.dumps(gemini_analysis)
              if gemini_analysis else None, datetime.now())
         )
         self.conn.commit()
 
     def get_all_drawings(self):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT * FROM drawings ORDER BY timestamp DESC')
-        drawings = cursor.fetchall()
+        legacy = 'd.image_data' if self.has_legacy_images else 'NULL'
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                f'SELECT d.id, i.data, {legacy}, d.gemini_analysis, d.timestamp '
+                'FROM drawings d LEFT JOIN images i ON i.hash = d.image_hash '
+                'ORDER BY d.timestamp DESC')
+            drawings = cursor.fetchall()
 
         # Parse JSON gemini_analysis back to string
         parsed_drawings = []
-        for drawing in drawings:
-            gemini_analysis = json.loads(drawing[2]) if drawing[2] else None
+        for drawing_id, data, legacy_data, analysis, timestamp in drawings:
+            image_data = base64.b64encode(data).decode('utf-8') \
+                if data is not None else legacy_data
+            gemini_analysis = json.loads(analysis) if analysis else None
             parsed_drawings.append(
-                (drawing[0], drawing[1], gemini_analysis, drawing[3]))
+                (drawing_id, image_data, gemini_analysis, timestamp))
         return parsed_drawings
 
     def close(self):
@@ -0,0 +1,165 @@
+"""
+Threaded camera pipeline for the Streamlit app.
+
+A grabber thread reads the webcam as fast as it delivers and keeps only the
+newest frame; an inference thread runs the hand tracker on the newest frame
+it has not seen yet. The Streamlit script is left with the render stage: it
+takes the newest result, draws and displays it. A slow stage therefore
+skips frames instead of adding its time to every other stage's latency.
+"""
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from hand_tracker import HandTracker
+
+
+class RateMeter:
+    """Events per second over a sliding window."""
+
+    def __init__(self, window=2.0):
+        self.window = window
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    def tick(self):
+        now = time.monotonic()
+        with self._lock:
+            self._times.append(now)
+            while self._times[0] < now - self.window:
+                self._times.popleft()
+
+    def rate(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._times and self._times[0] < now - self.window:
+                self._times.popleft()
+            return len(self._times) / self.window
+
+
+class LatestValue:
+    """A single slot holding the newest value, with a sequence number."""
+
+    def __init__(self):
+        self._value = None
+        self._seq = 0
+        self._condition = threading.Condition()
+
+    def put(self, value):
+        with self._condition:
+            self._value = value
+            self._seq += 1
+            self._condition.notify_all()
+
+    def get(self, after_seq=0, timeout=None):
+        """Wait for a value newer than after_seq; returns (seq, value)."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._seq > after_seq, timeout)
+            if self._seq <= after_seq:
+                return after_seq, None
+            return self._seq, self._value
+
+
+class FrameGrabber(threading.Thread):
+    """Reads camera frames continuously, keeping only the latest one."""
+
+    def __init__(self, camera_index=0, width=640, height=480):
+        super().__init__(daemon=True, name='camera-grabber')
+        self.camera_index = camera_index
+        self.width = width
+        self.height = height
+        self.frames = LatestValue()
+        self.fps = RateMeter()
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        cap = cv2.VideoCapture(self.camera_index)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        try:
+            while not self._stop_event.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    self.error = "Failed to access webcam"
+                    break
+                self.frames.put(frame)
+                self.fps.tick()
+        finally:
+            cap.release()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class InferenceWorker(threading.Thread):
+    """Runs the hand tracker on the newest grabbed frame."""
+
+    def __init__(self, grabber, hand_tracker=None):
+        super().__init__(daemon=True, name='hand-inference')
+        self.grabber = grabber
+        self.hand_tracker = hand_tracker or HandTracker()
+        self.results = LatestValue()
+        self.fps = RateMeter()
+        self.skipped = 0
+        self.latency = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        seq = 0
+        while not self._stop_event.is_set():
+            new_seq, frame = self.grabber.frames.get(seq, timeout=0.5)
+            if frame is None:
+                continue
+            if seq:
+                self.skipped += new_seq - seq - 1
+            seq = new_seq
+
+            start = time.perf_counter()
+            # Mirror like a selfie view; the flipped copy belongs to the result
+            frame = cv2.flip(frame, 1)
+            results = self.hand_tracker.process_frame(frame)
+            thumb_pos, index_pos = self.hand_tracker.get_finger_positions(
+                results, frame.shape)
+            self.latency = time.perf_counter() - start
+            self.results.put((frame, results, thumb_pos, index_pos))
+            self.fps.tick()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class CameraPipeline:
+    """Grabber plus inference worker, shared by every script rerun."""
+
+    def __init__(self, camera_index=0, width=640, height=480):
+        self.grabber = FrameGrabber(camera_index, width, height)
+        self.worker = InferenceWorker(self.grabber)
+        self.grabber.start()
+        self.worker.start()
+
+    @property
+    def hand_tracker(self):
+        return self.worker.hand_tracker
+
+    @property
+    def error(self):
+        return self.grabber.error
+
+    def latest(self, after_seq=0, timeout=1.0):
+        """Newest (frame, results, thumb_pos, index_pos) after after_seq."""
+        return self.worker.results.get(after_seq, timeout)
+
+    def stats(self):
+        return {
+            'camera': self.grabber.fps.rate(),
+            'inference': self.worker.fps.rate(),
+            'inference_ms': self.worker.latency * 1000,
+            'skipped': self.worker.skipped,
+        }
+
+    def stop(self):
+        self.worker.stop()
+        self.grabber.stop()